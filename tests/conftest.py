@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# the utils modules are flat top-level modules in the repo root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+FIXTURES = ROOT / 'tests' / 'fixtures'
+
+
+@pytest.fixture(autouse=True)
+def local_keys(tmp_path, monkeypatch):
+    ''' key dictionaries go to a temporary directory instead of ./store/keys '''
+    import utils_keys
+    monkeypatch.setattr(utils_keys, 'KEYS_DIR', str(tmp_path / 'keys'))
@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+import utils
+
+from conftest import FIXTURES
+from utils import check_backends_match
+from utils import read_iso_codes
+from utils import read_us_states
+
+EMISSIONS_AGG_COLUMNS = ['emissions_id', 'actor_id', 'year', 'total_emissions', 'datasource_id']
+
+# harmonizer, source argument and golden EmissionsAgg of each dataset
+CASES = {
+    'primap': (utils.harmonize_primap_emissions,
+               {'fl': str(FIXTURES / 'primap.csv'),
+                'datasourceDict': {'datasource_id': 'PRIMAP:10.5281/zenodo.7179775:v2.4'}},
+               FIXTURES / 'primap_EmissionsAgg.csv'),
+    'unfccc': (utils.harmonize_unfccc_emissions,
+               {'fl': str(FIXTURES / 'unfccc.xlsx'),
+                'datasourceDict': {'datasource_id': 'UNFCCC:GHG_ANNEX1:2019-11-08'}},
+               FIXTURES / 'unfccc_EmissionsAgg.csv'),
+    'epa': (utils.harmonize_epa_state_ghg,
+            {'dataDir': str(FIXTURES / 'epa'),
+             'datasourceDict': {'datasource_id': 'EPA:state_GHG_inventory:2022-08-31'}},
+            FIXTURES / 'epa_EmissionsAgg.csv'),
+}
+
+
+@pytest.fixture(autouse=True)
+def local_references(monkeypatch):
+    ''' reference tables from the fixtures instead of github '''
+    df_iso = read_iso_codes(str(FIXTURES / 'ISO-3166-1.csv'))
+    df_sub = read_us_states(str(FIXTURES / 'ISO-3166-2.csv'))
+    monkeypatch.setattr(utils, 'read_iso_codes', lambda fl=None: df_iso)
+    monkeypatch.setattr(utils, 'read_us_states', lambda fl=None: df_sub)
+
+    utils_sql = pytest.importorskip('utils_sql')
+    monkeypatch.setitem(utils_sql.REFERENCE_SOURCES, 'iso3166_1', str(FIXTURES / 'ISO-3166-1.csv'))
+    monkeypatch.setitem(utils_sql.REFERENCE_SOURCES, 'iso3166_2', str(FIXTURES / 'ISO-3166-2.csv'))
+
+
+@pytest.mark.parametrize('backend', ['pandas', 'polars', 'duckdb'])
+@pytest.mark.parametrize('case', list(CASES))
+def test_harmonizer_matches_golden(case, backend, tmp_path):
+    if backend != 'pandas':
+        pytest.importorskip(backend)
+    harmonizer, kwargs, golden = CASES[case]
+
+    df = harmonizer(outputDir=str(tmp_path), tableName='EmissionsAgg', backend=backend, **kwargs)
+
+    assert (tmp_path / 'EmissionsAgg.csv').read_text() == golden.read_text()
+
+    # every backend returns the EmissionsAgg table it wrote
+    assert list(df.columns) == EMISSIONS_AGG_COLUMNS
+    df_golden = pd.read_csv(golden, keep_default_na=False, na_values=[''])
+    assert df['year'].tolist() == df_golden['year'].tolist()
+    assert df['emissions_id'].astype(str).tolist() == df_golden['emissions_id'].tolist()
+
+
+def test_check_backends_match_returns_mismatches(tmp_path):
+    pytest.importorskip('polars')
+    harmonizer, kwargs, _ = CASES['primap']
+
+    assert check_backends_match(harmonizer, outputDir=str(tmp_path), tableName='EmissionsAgg', **kwargs) == []
+
+    def pandas_only(outputDir=None, tableName=None, backend=None, **kwargs):
+        df = harmonizer(outputDir=outputDir, tableName=tableName, backend=backend, **kwargs)
+        if backend == 'polars':
+            df.iloc[:-1].to_csv(f'{outputDir}/{tableName}.csv', index=False)
+        return df
+
+    assert check_backends_match(pandas_only, outputDir=str(tmp_path), tableName='EmissionsAgg', **kwargs) == ['polars']
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils_cube import build_emissions_cube
+
+
+def emissions(values):
+    return pd.DataFrame({
+        'actor_id': ['US', 'US', 'NA'][:len(values)],
+        'year': [2020, 2020, 2021][:len(values)],
+        'total_emissions': values,
+        'datasource_id': ['A', 'A', 'A'][:len(values)],
+    })
+
+
+def test_duplicate_records_raise(tmp_path):
+    with pytest.raises(AssertionError, match='share an'):
+        build_emissions_cube(df=emissions([1.0, 2.0, 3.0]), cubeDir=str(tmp_path / 'cube'), keysDir=str(tmp_path / 'keys'))
+
+
+@pytest.mark.parametrize('duplicates, expected', [('sum', 3.0), ('max', 2.0), ('last', 2.0), ('mean', 1.5)])
+def test_duplicate_records_are_combined(tmp_path, duplicates, expected):
+    cube = build_emissions_cube(df=emissions([1.0, 2.0, 3.0]), cubeDir=str(tmp_path / 'cube'),
+                                keysDir=str(tmp_path / 'keys'), duplicates=duplicates)
+
+    actors = list(cube['actors'])
+    assert cube['cube'][actors.index('US'), 0, 0] == expected
+    assert cube['cube'][actors.index('NA'), 1, 0] == 3.0
+    assert np.isnan(cube['cube'][actors.index('NA'), 0, 0])
+
+
+def test_unique_records(tmp_path):
+    cube = build_emissions_cube(df=emissions([1.0, 3.0]).iloc[[0]], cubeDir=str(tmp_path / 'cube'), keysDir=str(tmp_path / 'keys'))
+
+    assert cube['cube'].shape == (1, 1, 1)
+    assert cube['cube'][0, 0, 0] == 1.0
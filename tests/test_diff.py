@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from utils_diff import diff_tables
+from utils_diff import hash_rows
+
+
+def test_int_and_float_hash_the_same():
+    df_int = pd.DataFrame({'actor_id': ['US', 'NA'], 'year': [2020, 2021], 'total': pd.array([1, None], dtype='Int64')})
+    df_float = pd.DataFrame({'actor_id': ['US', 'NA'], 'year': [2020.0, 2021.0], 'total': [1.0, np.nan]})
+
+    columns = ['actor_id', 'year', 'total']
+    assert (hash_rows(df_int, columns) == hash_rows(df_float, columns)).all()
+
+
+def test_different_values_hash_differently():
+    df = pd.DataFrame({'total': [1.0, 1.5, np.nan]})
+    df_text = pd.DataFrame({'total': ['1.0', '1.5', 'nan']})
+
+    hashes = hash_rows(df, ['total'])
+    assert len(set(hashes)) == 3
+    # a missing value is not the string "nan"
+    assert hashes[2] != hash_rows(df_text, ['total'])[2]
+
+
+def test_diff_ignores_int_float_changes():
+    df_old = pd.DataFrame({'emissions_id': ['a', 'b'], 'total_emissions': [1, 2]})
+    df_new = pd.DataFrame({'emissions_id': ['a', 'b', 'c'], 'total_emissions': [1.0, 2.5, 3.0]})
+
+    diff = diff_tables(df_old=df_old, df_new=df_new, key=['emissions_id'])
+
+    assert diff['inserted']['emissions_id'].tolist() == ['c']
+    assert diff['updated']['emissions_id'].tolist() == ['b']
+    assert diff['deleted'].empty
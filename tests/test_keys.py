@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+from utils_keys import MISSING_KEY
+from utils_keys import KeyDictionary
+from utils_keys import remap_keys
+
+
+def read_dictionary(keysDir, column='actor_id'):
+    return pd.read_csv(f'{keysDir}/{column}.csv', dtype={column: str}, keep_default_na=False)
+
+
+def test_save_merges_keys_saved_by_another_build(tmp_path):
+    keysDir = str(tmp_path)
+    first = KeyDictionary('actor_id', keysDir=keysDir)
+    first.encode(['US'])
+    first.save()
+
+    # both builds start from ['US'] and hand out key 1 to different values
+    a = KeyDictionary('actor_id', keysDir=keysDir)
+    b = KeyDictionary('actor_id', keysDir=keysDir)
+    keys_a = a.encode(['DE', 'US'])
+    keys_b = b.encode(['NA', 'DE', None])
+    assert keys_a[0] == keys_b[0] == 1
+
+    remap_a = a.save()
+    remap_b = b.save()
+    saved_b = remap_keys(keys_b, remap_b)
+
+    df = read_dictionary(keysDir)
+    assert df['actor_key'].tolist() == [0, 1, 2]
+    assert df['actor_id'].tolist() == ['US', 'DE', 'NA']
+    assert remap_keys(keys_a, remap_a).tolist() == [1, 0]
+    assert saved_b.tolist() == [2, 1, MISSING_KEY]
+
+    # keys written after save() decode to the same values in a fresh read
+    assert KeyDictionary('actor_id', keysDir=keysDir).decode(saved_b)[:2].tolist() == ['NA', 'DE']
+
+
+def test_concurrent_saves_keep_one_key_per_value(tmp_path):
+    keysDir = str(tmp_path)
+    n_builds = 8
+    barrier = threading.Barrier(n_builds)
+    results = {}
+
+    def build(i):
+        keys = KeyDictionary('actor_id', keysDir=keysDir)
+        values = [f'shared-{j}' for j in range(20)] + [f'build{i}-{j}' for j in range(20)]
+        handed_out = keys.encode(values)
+        barrier.wait()
+        results[i] = (values, remap_keys(handed_out, keys.save()))
+
+    threads = [threading.Thread(target=build, args=(i,)) for i in range(n_builds)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    df = read_dictionary(keysDir)
+    assert df['actor_key'].tolist() == list(range(len(df)))
+    assert df['actor_id'].is_unique
+    assert len(df) == 20 + 20 * n_builds
+
+    decoded = KeyDictionary('actor_id', keysDir=keysDir)
+    for values, saved in results.values():
+        assert decoded.decode(saved).tolist() == values
+
+
+def test_remap_keys_keeps_missing():
+    assert remap_keys(np.array([MISSING_KEY, MISSING_KEY]), np.array([], dtype='int32')).tolist() == [MISSING_KEY] * 2
+
+
+def test_empty_string_is_a_value(tmp_path):
+    # the ISO code of EARTH is "", only None is missing
+    keys = KeyDictionary('actor_id', keysDir=str(tmp_path))
+    assert keys.encode(['', None, 'NA']).tolist() == [0, MISSING_KEY, 1]
+    keys.save()
+
+    assert KeyDictionary('actor_id', keysDir=str(tmp_path)).values == ['', 'NA']
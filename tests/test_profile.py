@@ -0,0 +1,50 @@
+import tracemalloc
+
+import pytest
+
+import utils_profile
+from utils_profile import profiled
+from utils_profile import stage_profiler
+
+
+def test_failing_harmonizer_stops_tracing(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_profile, 'PROFILE_DIR', str(tmp_path))
+
+    @profiled
+    def harmonizer():
+        prof = stage_profiler('harmonizer')
+        prof.stage('read')
+        raise ValueError('bad input')
+
+    with pytest.raises(ValueError):
+        harmonizer()
+
+    assert not tracemalloc.is_tracing()
+    assert utils_profile._OPEN_PROFILERS == []
+
+
+def test_profiler_context_manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_profile, 'PROFILE_DIR', str(tmp_path))
+
+    with pytest.raises(ValueError):
+        with stage_profiler('harmonizer') as prof:
+            prof.stage('read')
+            raise ValueError('bad input')
+
+    assert not tracemalloc.is_tracing()
+
+
+def test_finished_profiler_writes_report(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils_profile, 'PROFILE_DIR', str(tmp_path))
+
+    @profiled
+    def harmonizer():
+        prof = stage_profiler('harmonizer')
+        prof.stage('read')
+        return prof.finish()
+
+    report = harmonizer()
+
+    assert [s['stage'] for s in report['stages']] == ['read']
+    assert len(list(tmp_path.glob('harmonizer_*.json'))) == 1
+    assert not tracemalloc.is_tracing()
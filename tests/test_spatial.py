@@ -0,0 +1,35 @@
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+from shapely.geometry import box
+
+from utils_spatial import assign_points_to_polygons
+from utils_spatial import points_from_lat_lng
+
+
+def polygons():
+    # two squares sharing the border lng = 1
+    return gpd.GeoDataFrame({'actor_id': ['AA-1', 'AA-2']},
+                            geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)],
+                            crs='EPSG:4326')
+
+
+def test_points_inside_on_border_and_outside():
+    df = pd.DataFrame({'lat': [0.5, 0.5, 0.5, 0.0, 5.0], 'lng': [0.5, 1.5, 1.0, 0.5, 5.0]})
+    points = points_from_lat_lng(df=df, lat='lat', lng='lng')
+
+    values = assign_points_to_polygons(points=points, polygons=polygons())
+
+    # inside, inside, shared border (first polygon), outer border, outside
+    assert values.tolist()[:4] == ['AA-1', 'AA-2', 'AA-1', 'AA-1']
+    assert pd.isna(values.iloc[4])
+
+
+def test_shared_border_follows_polygon_order():
+    df = pd.DataFrame({'lat': [0.5], 'lng': [1.0]})
+    points = points_from_lat_lng(df=df, lat='lat', lng='lng')
+
+    values = assign_points_to_polygons(points=points, polygons=polygons().iloc[::-1])
+
+    assert values.tolist() == ['AA-2']
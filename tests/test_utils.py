@@ -0,0 +1,302 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+
+from conftest import FIXTURES
+from utils import df_wide_to_long
+from utils import parse_numeric
+from utils import read_csv_arrow
+from utils import read_csv_budgeted
+from utils import read_iso_codes
+from utils_keys import KeyDictionary
+from utils_keys import load_key_dictionaries
+
+
+def wide_frame():
+    return pd.DataFrame({
+        'actor_id': ['US', 'NA', None],
+        'name': pd.array(['United States', 'Namibia', 'Other'], dtype='string'),
+        'rank': pd.array([1, None, 3], dtype='Int64'),
+        '1990': [1.0, np.nan, 3.0],
+        '1991': [4.0, 5.0, np.nan],
+    })
+
+
+def test_df_wide_to_long_matches_melt():
+    df = wide_frame()
+
+    df_long = df_wide_to_long(df=df, value_name='emissions', var_name='year')
+    df_melt = df.melt(id_vars=['actor_id', 'name', 'rank'], var_name='year', value_name='emissions')
+    df_melt['year'] = df_melt['year'].astype(int)
+
+    pd.testing.assert_frame_equal(df_long, df_melt)
+
+
+def test_df_wide_to_long_keeps_id_dtypes():
+    df = wide_frame()
+    df_long = df_wide_to_long(df=df, dropna=True)
+
+    for column in ['actor_id', 'name', 'rank']:
+        assert df_long[column].dtype == df[column].dtype
+        assert not isinstance(df_long[column].dtype, pd.CategoricalDtype)
+
+    # callers assign new labels and concatenate
+    df_long.loc[0, 'actor_id'] = 'new label'
+    df_concat = pd.concat([df_long, df_long])
+    assert df_concat['actor_id'].dtype == df['actor_id'].dtype
+    assert df_concat['actor_id'].iloc[0] == 'new label'
+
+
+def test_df_wide_to_long_rejects_duplicate_labels():
+    df = pd.DataFrame([[1, 2.0, 3.0]], columns=['actor_id', 1990, '1990'])
+
+    with pytest.raises(AssertionError):
+        df_wide_to_long(df=df)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1,234', 1234.0),
+    ('12,345,678.9', 12345678.9),
+    ('3 234.123', 3234.123),
+    ('1 234', 1234.0),
+    ('−12', -12.0),
+    ('123*', 123.0),
+    ('45[a]', 45.0),
+    ('1.5e3', 1500.0),
+])
+def test_parse_numeric_accepts(text, expected):
+    values, reject = parse_numeric(pd.Series([text]))
+
+    assert values[0] == expected
+    assert not reject[0]
+
+
+@pytest.mark.parametrize('text', ['1.234,5', '12,34', '1 234,567', '1,23,456'])
+def test_parse_numeric_rejects_mixed_or_misplaced_separators(text):
+    values, reject = parse_numeric(pd.Series([text]))
+
+    assert np.isnan(values[0])
+    assert reject[0]
+
+
+def test_parse_numeric_decimal_comma():
+    values, reject = parse_numeric(pd.Series(['1.234,5', '12.345.678,9', '1,234.5']), decimal=',')
+
+    assert values[:2].tolist() == [1234.5, 12345678.9]
+    assert reject.tolist() == [False, False, True]
+
+
+def test_parse_numeric_sentinels_are_not_rejected():
+    values, reject = parse_numeric(pd.Series(['Question not applicable', '', None]))
+
+    assert values.isna().all()
+    assert not reject.any()
+
+
+def ghgrp_facilities(units='kilotonnes of carbon dioxide equivalents (kt CO2 eq)'):
+    return pd.DataFrame({
+        'Facility ID': [10, 10, 11],
+        'Report year': [2019, 2020, 2020],
+        'Facility name': ['Mill', 'Mill', 'Mine'],
+        'Company name': ['Acme', 'Acme', 'Ore Co'],
+        'City': ['Quebec', 'Quebec', 'Sudbury'],
+        'Province': ['Quebec', 'Quebec', 'Ontario'],
+        'Latitude': [46.8, 46.8, 46.5],
+        'Longitude': [-71.2, -71.2, -81.0],
+        'Units': units,
+        'Total emissions': ['1 234.5', '1,000', '2.5'],
+    })
+
+
+@pytest.fixture
+def canadian_subdivisions(monkeypatch):
+    df_subdiv = pd.DataFrame({'country': ['CA', 'CA'], 'name': ['Quebec', 'Ontario'], 'subdivision': ['QC', 'ON']})
+    monkeypatch.setattr(utils, 'read_subdivisions', lambda: df_subdiv)
+
+
+def test_ghgrp_actor_tables_skip_emissions_checks(canadian_subdivisions):
+    # units are only checked when emissions are requested
+    tables = utils.create_eccc_ghgrp_actor_tables(DataSourceDict={'datasource_id': 'ECCC:GHGRP'},
+                                                  PublisherDict={'id': 'ECCC'},
+                                                  df=ghgrp_facilities(units='tonnes'))
+
+    assert sorted(tables) == ['Actor', 'ActorIdentifier', 'ActorName', 'Territory']
+    assert tables['Actor']['actor_id'].tolist() == ['ECCC:GHGRP:10', 'ECCC:GHGRP:11']
+    assert tables['Actor']['is_part_of'].tolist() == ['CA-QC', 'CA-ON']
+
+
+@pytest.mark.parametrize('publisher', ['ECCC', 'OEF'])
+def test_ghgrp_tables_share_one_parse(canadian_subdivisions, publisher):
+    df = ghgrp_facilities()
+    datasource = {'datasource_id': 'ECCC:GHGRP'}
+
+    tables = utils.create_eccc_ghgrp_actor_tables(DataSourceDict=datasource, PublisherDict={'id': publisher}, df=df)
+    df_emissions = utils.create_eccc_ghgrp_facilities_emissions_table(DataSourceDict=datasource,
+                                                                      PublisherDict={'id': publisher},
+                                                                      MethodologyDict={'methodology_id': 'M'},
+                                                                      df=df)
+
+    assert set(df_emissions['actor_id']) == set(tables['Actor']['actor_id'])
+    assert df_emissions['emissions_id'].astype(str).tolist() == ['ECCC:GHGRP:10:2019', 'ECCC:GHGRP:10:2020',
+                                                                 'ECCC:GHGRP:11:2020']
+    assert df_emissions['total_emissions'].tolist() == [1234500.0, 1000000.0, 2500.0]
+
+
+def test_ghgrp_emissions_check_units(canadian_subdivisions):
+    with pytest.raises(AssertionError):
+        utils.create_eccc_ghgrp_facilities_emissions_table(DataSourceDict={'datasource_id': 'ECCC:GHGRP'},
+                                                           PublisherDict={'id': 'ECCC'},
+                                                           MethodologyDict={'methodology_id': 'M'},
+                                                           df=ghgrp_facilities(units='tonnes'))
+
+
+def test_coordinate_fallback_skips_cities_matched_by_name(monkeypatch):
+    pytest.importorskip('scipy')
+
+    # BE AAA and BE BBB are both next to city A, BE CCC is next to city B
+    df_locode = pd.DataFrame({
+        'actor_id': ['BE AAA', 'BE BBB', 'BE CCC'],
+        'iso2': ['BE', 'BE', 'BE'],
+        'lat': [50.800, 50.801, 51.200],
+        'lng': [4.300, 4.301, 4.400],
+    })
+    monkeypatch.setattr(utils, 'unlocode_coordinates', lambda: df_locode)
+
+    # city A reported 2014 and 2015 and matched "BE AAA" by name, city B has no name match
+    df_with_iso = pd.DataFrame({
+        'row_id': [0, 1, 2],
+        'name': ['A', 'A', 'B'],
+        'year': [2014, 2015, 2015],
+        'iso2': ['BE', 'BE', 'BE'],
+        'lat': [50.8005, 50.8009, 51.2001],
+        'lng': [4.3005, 4.3009, 4.4001],
+    })
+    df_name_matches = df_with_iso.iloc[[0, 1]].assign(actor_id='BE AAA')
+    df_merged = df_name_matches.drop_duplicates(subset=['actor_id']).reset_index(drop=True)
+
+    df_out = utils.match_unlocode_by_coordinates(df_with_iso=df_with_iso,
+                                                 df_merged=df_merged,
+                                                 df_name_matches=df_name_matches,
+                                                 radiusKm=5)
+
+    assert dict(zip(df_out['name'], df_out['actor_id'])) == {'A': 'BE AAA', 'B': 'BE CCC'}
+    assert 'BE BBB' not in set(df_out['actor_id'])
+
+
+def test_coordinate_fallback_encodes_nearest_locodes(monkeypatch):
+    pytest.importorskip('scipy')
+
+    df_locode = pd.DataFrame({
+        'actor_id': ['BE AAA', 'BE CCC'],
+        'iso2': ['BE', 'BE'],
+        'lat': [50.800, 51.200],
+        'lng': [4.300, 4.400],
+    })
+    monkeypatch.setattr(utils, 'unlocode_coordinates', lambda: df_locode)
+
+    # city A matched "BE AAA" by name and carries its key, B is next to "BE AAA" too, C is next to "BE CCC"
+    keys = load_key_dictionaries()
+    df_with_iso = pd.DataFrame({
+        'row_id': [0, 1, 2],
+        'name': ['A', 'B', 'C'],
+        'iso2': ['BE', 'BE', 'BE'],
+        'lat': [50.8005, 50.8009, 51.2001],
+        'lng': [4.3005, 4.3009, 4.4001],
+    })
+    df_merged = df_with_iso.iloc[[0]].assign(actor_key=keys['actor_id'].encode(['BE AAA']))
+
+    df_out = utils.match_unlocode_by_coordinates(df_with_iso=df_with_iso,
+                                                 df_merged=df_merged,
+                                                 df_name_matches=df_merged,
+                                                 radiusKm=5,
+                                                 keys=keys)
+
+    assert 'actor_id' not in df_out.columns
+    assert dict(zip(df_out['name'], keys['actor_id'].decode(df_out['actor_key']))) == {'A': 'BE AAA', 'C': 'BE CCC'}
+
+
+def test_df_wide_to_long_arrow_years_are_float64():
+    df = read_csv_arrow(FIXTURES / 'primap.csv', dtype=utils.PRIMAP_DTYPES)
+    df = df.drop(columns=['source', 'scenario (PRIMAP-hist)', 'entity', 'unit', 'category (IPCC2006_PRIMAP)'])
+
+    df_long = df_wide_to_long(df=df, value_name='emissions', var_name='year')
+
+    assert df_long['emissions'].dtype == np.float64
+    assert df_long['emissions'].isna().sum() == 2
+
+
+def test_harmonize_primap_emissions_matches_golden(monkeypatch, tmp_path):
+    df_iso = read_iso_codes(str(FIXTURES / 'ISO-3166-1.csv'))
+    monkeypatch.setattr(utils, 'read_iso_codes', lambda fl=None: df_iso)
+
+    utils.harmonize_primap_emissions(
+        fl=str(FIXTURES / 'primap.csv'),
+        outputDir=str(tmp_path),
+        tableName='EmissionsAgg',
+        datasourceDict={'datasource_id': 'PRIMAP:10.5281/zenodo.7179775:v2.4'},
+    )
+
+    golden = (FIXTURES / 'primap_EmissionsAgg.csv').read_text()
+    assert (tmp_path / 'EmissionsAgg.csv').read_text() == golden
+
+
+def test_harmonize_primap_emissions_sorts_on_saved_keys(monkeypatch, tmp_path):
+    df_iso = read_iso_codes(str(FIXTURES / 'ISO-3166-1.csv'))
+    monkeypatch.setattr(utils, 'read_iso_codes', lambda fl=None: df_iso)
+
+    # keys from an earlier build, in reverse string order
+    keys = KeyDictionary('actor_id')
+    keys.encode(['US', 'NA', 'GB', 'DE'])
+    keys.save()
+
+    utils.harmonize_primap_emissions(
+        fl=str(FIXTURES / 'primap.csv'),
+        outputDir=str(tmp_path),
+        tableName='EmissionsAgg',
+        datasourceDict={'datasource_id': 'PRIMAP:10.5281/zenodo.7179775:v2.4'},
+    )
+
+    golden = (FIXTURES / 'primap_EmissionsAgg.csv').read_text()
+    assert (tmp_path / 'EmissionsAgg.csv').read_text() == golden
+
+    # saved keys are kept and the datasource got one
+    keys = load_key_dictionaries()
+    assert keys['actor_id'].values[:4] == ['US', 'NA', 'GB', 'DE']
+    assert keys['datasource_id'].values == ['PRIMAP:10.5281/zenodo.7179775:v2.4']
+
+
+def test_read_csv_budgeted_partitions_match_in_memory(tmp_path, caplog):
+    # x is int until row 250, blank is missing until row 200, mix is int until row 300
+    rows = []
+    for n in range(1, 301):
+        x = '2.5' if n == 250 else str(n)
+        blank = '1' if n == 200 else ''
+        mix = 'a' if n == 300 else str(n)
+        rows.append(f'"US,{n}",{n},{x},{blank},{mix}')
+    fl = tmp_path / 'mixed.csv'
+    fl.write_text('code,n,x,blank,mix\n' + '\n'.join(rows) + '\n')
+
+    def every_50th(df):
+        return df.loc[df['n'].isin(range(50, 301, 50))]
+
+    df_memory = read_csv_budgeted(str(fl), dtype={'code': 'string'}, transform=every_50th)
+    with caplog.at_level('INFO', logger='utils'):
+        df_parts = read_csv_budgeted(str(fl), dtype={'code': 'string'}, transform=every_50th, memoryBudget=3000)
+
+    assert 'reading in partitions' in caplog.text
+    assert list(df_memory.dtypes.astype(str)) == ['string[pyarrow]', 'int64[pyarrow]', 'double[pyarrow]',
+                                                  'int64[pyarrow]', 'string[pyarrow]']
+    pd.testing.assert_frame_equal(df_parts, df_memory)
+
+
+def test_apply_dtype_plan_rejects_missing_ints_like_astype_int():
+    df = pd.DataFrame({'year': [1990, 1991], 'total_emissions': [1.5, np.nan]})
+
+    with pytest.raises(AssertionError, match='total_emissions'):
+        utils.apply_dtype_plan(df)
+
+    df_out = utils.apply_dtype_plan(df, nullable=['total_emissions'])
+    assert df_out['total_emissions'].dtype == 'Int64'
+    assert df_out['total_emissions'].isna().tolist() == [False, True]
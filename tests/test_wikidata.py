@@ -0,0 +1,63 @@
+import pytest
+
+import wikidata_city_area
+import wikidata_city_population
+
+ITEM = 'http://www.wikidata.org/entity/'
+
+# Q7 is added (first in the file), Q2 changes and gets a duplicate, Q3 leaves the extract,
+# Q1, Q4 (does not parse), Q5 (unknown actor) and Q6 (Namibia, "NA") are unchanged
+POPULATION_EXTRACTS = {
+    'previous': [('Q1', 'USNYC', '100', '2020'), ('Q1', 'USNYC', '110', '2021'),
+                 ('Q2', 'GBLON', '200', '2020'), ('Q3', 'FRPAR', '300', '2020'),
+                 ('Q4', 'DEBER', 'abc', '2020'), ('Q5', 'XXBAD', '50', '2020'),
+                 ('Q6', 'NAWDH', '60', '2019')],
+    'new': [('Q7', 'ITRGO', '70', '2020'),
+            ('Q1', 'USNYC', '100', '2020'), ('Q1', 'USNYC', '110', '2021'),
+            ('Q2', 'GBLON', '250', '2020'), ('Q4', 'DEBER', 'abc', '2020'),
+            ('Q5', 'XXBAD', '50', '2020'), ('Q2', 'GBLON', '260', '2020'),
+            ('Q6', 'NAWDH', '60', '2019')],
+}
+
+SCRIPTS = {
+    'population': (wikidata_city_population, 'item,locode,population,populationYear', lambda row: row),
+    'area': (wikidata_city_area, 'city,locode,area', lambda row: row[:3]),
+}
+
+
+def write_extract(fl, header, rows):
+    fl.write_text(header + '\n' + ''.join(','.join([ITEM + row[0]] + list(row[1:])) + '\n' for row in rows))
+    return str(fl)
+
+
+def run(script, monkeypatch, inputFile, outputDir, **kwargs):
+    monkeypatch.setattr(script, 'INPUT_FILE', inputFile)
+    monkeypatch.setattr(script, 'OUTPUT_DIR', str(outputDir))
+    script.main(**kwargs)
+    return {fl.name: fl.read_text() for fl in outputDir.iterdir()}
+
+
+@pytest.mark.parametrize('name', list(SCRIPTS))
+def test_incremental_matches_full_run(name, monkeypatch, tmp_path):
+    script, header, columns = SCRIPTS[name]
+    lookups = []
+    def is_actor_id(actor_id):
+        lookups.append(actor_id)
+        return actor_id != 'XX BAD'
+    monkeypatch.setattr(script, 'is_actor_id', is_actor_id)
+
+    previous = write_extract(tmp_path / 'previous.csv', header, map(columns, POPULATION_EXTRACTS['previous']))
+    new = write_extract(tmp_path / 'new.csv', header, map(columns, POPULATION_EXTRACTS['new']))
+
+    run(script, monkeypatch, previous, tmp_path / 'previous', policy='max')
+    full = run(script, monkeypatch, new, tmp_path / 'full', policy='max')
+
+    lookups.clear()
+    incremental = run(script, monkeypatch, new, tmp_path / 'incremental', policy='max',
+                      previousInput=previous, previousOutput=str(tmp_path / 'previous'))
+
+    assert incremental == full
+    # only changed actors that were not resolved before are looked up
+    assert lookups == ['IT RGO']
+    table = full['Population.csv' if name == 'population' else 'Territory.csv']
+    assert 'FR PAR' not in table and 'XX BAD' not in table and 'NA WDH' in table
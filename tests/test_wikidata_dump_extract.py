@@ -0,0 +1,62 @@
+import json
+
+from wikidata_dump_extract import ENTITY_PREFIX
+from wikidata_dump_extract import extract_lines
+
+
+def snak(prop, value, datatype='string'):
+    return {'snaktype': 'value', 'property': prop, 'datavalue': {'value': value, 'type': datatype}}
+
+
+def statement(prop, value, rank='normal', year=None, references=None, datatype='string'):
+    # same key order as the dump, statement lists start with "mainsnak"
+    st = {'mainsnak': snak(prop, value, datatype), 'type': 'statement', 'rank': rank}
+    if year is not None:
+        st['qualifiers'] = {'P585': [snak('P585', {'time': f'+{year}-00-00T00:00:00Z'}, 'time')]}
+    if references is not None:
+        st['references'] = references
+    return st
+
+
+def quantity(amount, unit='1'):
+    unit = unit if unit == '1' else ENTITY_PREFIX + unit
+    return {'amount': amount, 'unit': unit}
+
+
+def entity_line(qid, claims):
+    # one entity per line, "id" right after "type", compact separators and a trailing comma
+    return json.dumps({'type': 'item', 'id': qid, 'claims': claims}, separators=(',', ':')) + ',\n'
+
+
+def test_extract_lines():
+    reference = [{'hash': 'h', 'snaks': {'P1937': [snak('P1937', 'US REF')]}, 'snaks-order': ['P1937']}]
+    city = entity_line('Q1', {
+        # a P1937 reference snak comes before the P1937 statements
+        'P1082': [statement('P1082', quantity('+8000000'), year=2020, datatype='quantity', references=reference),
+                  statement('P1082', quantity('+7000000'), year=2010, datatype='quantity'),
+                  # no point in time, skipped
+                  statement('P1082', quantity('+9000000'), datatype='quantity')],
+        'P2046': [statement('P2046', quantity('+783.8', 'Q712226'), rank='preferred', datatype='quantity'),
+                  statement('P2046', quantity('+1', 'Q712226'), datatype='quantity')],
+        'P1937': [statement('P1937', 'US NYC'),
+                  statement('P1937', 'US OLD', rank='deprecated')],
+    })
+    region = entity_line('Q2', {
+        'P300': [statement('P300', 'US-NY')],
+        # hectare is converted, a unit without a conversion is skipped
+        'P2046': [statement('P2046', quantity('+250', 'Q35852'), datatype='quantity'),
+                  statement('P2046', quantity('+5', 'Q11573'), datatype='quantity')],
+    })
+    # P1937 only inside a reference of another statement
+    referenced = entity_line('Q3', {
+        'P1082': [statement('P1082', quantity('+10'), year=2020, datatype='quantity',
+                            references=reference)],
+    })
+    unrelated = entity_line('Q4', {'P31': [statement('P31', {'id': 'Q5'}, datatype='wikibase-entityid')]})
+
+    out = extract_lines(([city, region, referenced, unrelated], 2015))
+
+    assert out['city-population'] == [(ENTITY_PREFIX + 'Q1', 'USNYC', '8000000', 2020)]
+    assert out['city-area'] == [(ENTITY_PREFIX + 'Q1', 'USNYC', 783.8)]
+    assert out['subnational-population'] == []
+    assert out['subnational-area'] == [(ENTITY_PREFIX + 'Q2', 'US-NY', 2.5)]
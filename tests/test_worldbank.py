@@ -0,0 +1,32 @@
+import pandas as pd
+
+import worldbank_subnational_population as worldbank
+
+from conftest import FIXTURES
+
+
+def test_read_input_keeps_every_year_and_reads_missing_markers():
+    df = worldbank.read_input(str(FIXTURES / 'worldbank_subnational_population.csv'))
+
+    assert list(df.columns) == ['Country Code', 'Country Name', '2015', '2016', '2017']
+    assert len(df) == 3
+    assert df['2016'].isna().tolist() == [False, True, True]
+    assert df['2017'].tolist()[:2] == [1240000, 1001000]
+
+
+def test_main_writes_population_for_all_years(monkeypatch, tmp_path):
+    monkeypatch.setattr(worldbank, 'INPUT_FILE', str(FIXTURES / 'worldbank_subnational_population.csv'))
+    monkeypatch.setattr(worldbank, 'OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(worldbank, 'is_actor_id', lambda code: code in ['AF-BD', 'AF-BL'])
+    monkeypatch.setattr(worldbank, 'get_by_name', lambda name: [])
+
+    worldbank.main()
+
+    df = pd.read_csv(tmp_path / 'Population.csv', keep_default_na=False)
+    assert df[['actor_id', 'year', 'population']].values.tolist() == [
+        ['AF-BD', 2015, 1188000], ['AF-BD', 2016, 1216000], ['AF-BD', 2017, 1240000],
+        ['AF-BL', 2015, 958000], ['AF-BL', 2017, 1001000],
+    ]
+
+    df_identifiers = pd.read_csv(tmp_path / 'ActorIdentifier.csv')
+    assert df_identifiers['identifier'].tolist() == ['AFG_Badakhshan_AF.BD_272_AFG001', 'AFG_Baghlan_AF.BL_274_AFG003']
@@ -0,0 +1,41 @@
+import csv
+
+import wpp_to_world_population as wpp
+
+from conftest import FIXTURES
+
+
+def read_table(fl):
+    with open(fl, newline='') as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def test_main_writes_each_variant(tmp_path):
+    wpp.main(inputDir=str(FIXTURES / 'wpp'), outputDir=str(tmp_path))
+
+    # estimates in the output directory, projection variants in subdirectories, no NOTES
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['DataSource.csv', 'Medium variant',
+                                                                 'Population.csv', 'Publisher.csv']
+
+    estimates = read_table(tmp_path / 'Population.csv')
+    assert [(row['actor_id'], row['year'], row['population']) for row in estimates] == [
+        ('EARTH', '1950', '2536431000'), ('NA', '1950', '482500'),
+        ('EARTH', '1951', '3804646500'), ('NA', '1951', '723800'),
+    ]
+    assert {row['datasource_id'] for row in estimates} == {'UNPD:WPP:2022'}
+    assert read_table(tmp_path / 'DataSource.csv')[0]['datasource_id'] == 'UNPD:WPP:2022'
+
+    medium = read_table(tmp_path / 'Medium variant' / 'Population.csv')
+    assert [(row['actor_id'], row['year']) for row in medium] == [
+        ('EARTH', '2022'), ('NA', '2022'), ('EARTH', '2023'), ('NA', '2023'),
+    ]
+    assert {row['datasource_id'] for row in medium} == {'UNPD:WPP:2022:medium-variant'}
+    datasource = read_table(tmp_path / 'Medium variant' / 'DataSource.csv')[0]
+    assert datasource['datasource_id'] == 'UNPD:WPP:2022:medium-variant'
+    assert datasource['name'].endswith('(Medium variant)')
+
+
+def test_main_only_requested_variants(tmp_path):
+    wpp.main(inputDir=str(FIXTURES / 'wpp'), outputDir=str(tmp_path), variants=['Medium variant'])
+
+    assert [path.name for path in tmp_path.iterdir()] == ['Medium variant']
@@ -1,6 +1,9 @@
 import csv
+import filecmp
+import io
 #from difflib import SequenceMatcher
 import json
+import logging
 import pandas as pd
 from pathlib import Path
 import pathlib
@@ -8,6 +11,107 @@ import re
 import xlrd
 import glob
 import os
+import numpy as np
+from utils_profile import profiled
+from utils_profile import stage_profiler
+
+logger = logging.getLogger(__name__)
+
+# Arrow-backed strings are much smaller than object columns,
+# fall back to the plain pandas string dtype if pyarrow is missing
+try:
+    import pyarrow
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+# dtype plan for harmonized tables, applied with apply_dtype_plan()
+# low-cardinality columns repeated on every row are categoricals
+CATEGORICAL_COLUMNS = [
+    'datasource_id',
+    'methodology_id',
+    'target_type',
+    'target_unit',
+]
+
+# identifiers and free text
+STRING_COLUMNS = [
+    'emissions_id',
+    'target_id',
+    'actor_id',
+    'URL',
+]
+
+# years fit in an int16
+SMALL_INT_COLUMNS = [
+    'year',
+    'baseline_year',
+    'target_year',
+]
+
+# quantities, Int64 so a column passed as nullable= keeps missing values
+# without becoming float, the others must have none (like astype(int))
+NULLABLE_INT_COLUMNS = [
+    'total_emissions',
+    'target_value',
+    'population',
+    'gdp',
+    'area',
+]
+
+# strings in raw numeric columns that mean "no value", compared case-insensitively
+NUMERIC_SENTINELS = [
+    'question not applicable',
+    'no data',
+    'n/a',
+    '..',
+    '-',
+    '—',
+]
+
+# execution backend of the harmonizers that have a lazy polars plan (utils_polars)
+# or a DuckDB query (utils_sql), set per call with backend= or with OPENCLIMATE_BACKEND
+BACKENDS = ['pandas', 'polars', 'duckdb']
+
+def resolve_backend(backend=None):
+    ''' backend argument, else OPENCLIMATE_BACKEND, else pandas '''
+    backend = os.environ.get('OPENCLIMATE_BACKEND', 'pandas') if backend is None else backend
+
+    assert backend in BACKENDS, f"backend must be one of {BACKENDS}"
+
+    return backend
+
+def check_backends_match(harmonizer=None, outputDir=None, tableName=None, backends=None, **kwargs):
+    ''' run a harmonizer with several backends and compare the written tables
+
+    input
+    -----
+    harmonizer: function with outputDir, tableName and backend arguments
+                (harmonize_primap_emissions, harmonize_unfccc_emissions, harmonize_epa_state_ghg)
+    outputDir: directory, each backend writes to {outputDir}/{backend}
+    tableName: name of the table to create
+    backends: backends to compare, the first is the reference [default: ['pandas', 'polars']]
+    kwargs: other harmonizer arguments
+
+    output
+    ------
+    mismatches: backends whose csv differs from the reference, empty if all are byte-identical
+    '''
+    backends = ['pandas', 'polars'] if backends is None else backends
+
+    assert all(backend in BACKENDS for backend in backends), f"backends must be in {BACKENDS}"
+
+    files = {}
+    for backend in backends:
+        out_dir = f'{Path(outputDir).as_posix()}/{backend}'
+        harmonizer(outputDir=out_dir, tableName=tableName, backend=backend, **kwargs)
+        files[backend] = f'{out_dir}/{tableName}.csv'
+
+    reference = backends[0]
+    mismatches = [backend for backend in backends[1:]
+                  if not filecmp.cmp(files[reference], files[backend], shallow=False)]
+
+    return mismatches
 
 def make_dir(path=None):
     """Create a new directory at this given path. 
@@ -114,36 +218,530 @@ def df_to_csv(df=None,
     
     df.to_csv(f'{out_dir}/{tableName}.csv', index=False)
 
+def apply_dtype_plan(df=None, nullable=None):
+    '''cast a harmonized table to compact dtypes
+
+    columns in CATEGORICAL_COLUMNS become categoricals, STRING_COLUMNS
+    become (arrow-backed) strings, SMALL_INT_COLUMNS become int16 and
+    NULLABLE_INT_COLUMNS become Int64. Columns not in the plan are left alone.
+
+    values are converted the same way as astype({col: str}) and 
+    astype({col: int}) so the written csv does not change, a missing
+    value in an int column fails like astype(int) unless it is in nullable
+
+    input
+    -----
+    df: harmonized table (EmissionsAgg, Target, Population, GDP, ...)
+    nullable: NULLABLE_INT_COLUMNS that may keep missing values [default: none]
+
+    output
+    ------
+    df: new dataframe with compact dtypes
+    '''
+
+    nullable = [] if nullable is None else nullable
+
+    # ensure correct type
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+    assert isinstance(nullable, list), f"nullable must be a list"
+
+    def to_nullable_int(series):
+        # object columns (e.g. numbers read as strings) need parsing first
+        if series.dtype == object:
+            series = pd.to_numeric(series)
+
+        # astype(int) fails on missing values, so does the plan unless the column may be missing
+        assert series.name in nullable or series.notna().all(), \
+            f"{series.isna().sum()} missing {series.name} values, pass nullable=['{series.name}'] to keep them"
+
+        # astype(int) truncates floats, Int64 refuses to, so truncate first
+        if pd.api.types.is_float_dtype(series.dtype):
+            series = np.trunc(series)
+
+        return series.astype('Int64')
+
+    columns = {}
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            columns[column] = df[column].astype(str).astype('category')
+        elif column in STRING_COLUMNS:
+            columns[column] = df[column].astype(str).astype(STRING_DTYPE)
+        elif column in SMALL_INT_COLUMNS:
+            columns[column] = df[column].astype('int16')
+        elif column in NULLABLE_INT_COLUMNS:
+            columns[column] = to_nullable_int(df[column])
+        else:
+            columns[column] = df[column]
+
+    return pd.DataFrame(columns, index=df.index)
+
+
+def parse_numeric(series=None, sentinels=None, decimal=None):
+    '''parse a raw numeric column in one vectorized pass
+
+    handles thousands separators ("3 234.123", "1,234", no-break and thin spaces),
+    which must group digits by three and be used consistently ("1.234,5" or
+    "12,34" with decimal "." are rejected, not read as 1.2345 or 1234), unicode minus signs ("−12"), trailing footnote markers ("123*", "45[a]", "67†")
+    and sentinel strings ("Question not applicable", "no data", ...)
+
+    input
+    -----
+    series: raw column, usually strings
+    sentinels: strings meaning "no value" [default: NUMERIC_SENTINELS]
+    decimal: decimal mark, "." or "," [default: "."]
+
+    output
+    ------
+    values: float64 series, NaN for missing, sentinel and rejected values
+    reject: boolean series, True where a value was present but could not be parsed
+    '''
+    sentinels = NUMERIC_SENTINELS if sentinels is None else sentinels
+    decimal = '.' if decimal is None else decimal
+
+    # ensure correct type
+    assert isinstance(series, pd.core.series.Series), f"series must be a Series"
+    assert isinstance(sentinels, list), f"sentinels must be a list"
+    assert decimal in ['.', ','], f"decimal must be '.' or ','"
+
+    # already numeric, nothing to clean
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype('float64'), pd.Series(False, index=series.index)
+
+    present = series.notna()
+    text = series.astype(str).str.strip()
+
+    is_sentinel = text.str.lower().isin([s.lower() for s in sentinels]) | (text == '')
+
+    thousands = ',' if decimal == '.' else '.'
+    text = (
+        text
+        # unicode minus, figure dash and en dash used as minus signs
+        .str.replace('[\u2212\u2012\u2013]', '-', regex=True)
+        # footnote markers at the end of a value
+        .str.replace(r'(\s*(\[[^\]]*\]|[*†‡§¹²³⁴⁵⁶⁷⁸⁹⁰]+))+$', '', regex=True)
+    )
+
+    # one thousands separator per value, groups of three digits after the first
+    separators = [thousands, ' ', '\u00a0', '\u2009', '\u202f']
+    grouped = '|'.join(f'\\d{{1,3}}(?:{re.escape(sep)}\\d{{3}})+' for sep in separators)
+    well_formed = text.str.match(f'^[+-]?(?:{grouped}|\\d*)(?:{re.escape(decimal)}\\d*)?(?:[eE][+-]?\\d+)?$').fillna(False)
+
+    # thousands separators
+    cleaned = text.str.replace(f'[\\s\u00a0\u2009\u202f{re.escape(thousands)}]', '', regex=True)
+    if decimal == ',':
+        cleaned = cleaned.str.replace(',', '.', regex=False)
+
+    values = pd.to_numeric(cleaned.where(present & ~is_sentinel & well_formed), errors='coerce').astype('float64')
+    reject = present & ~is_sentinel & values.isna()
+
+    return values, reject
+
+
+# pandas' default missing markers that pyarrow does not have
+PANDAS_EXTRA_NA_VALUES = ['None', '<NA>']
+
+# pandas dtypes used when pyarrow is not installed
+PANDAS_FALLBACK_DTYPES = {
+    'string': 'string',
+    'float64': 'float64',
+    'int64': 'Int64',
+    'int16': 'Int16',
+    'bool': 'boolean',
+}
+
+
+def read_csv_arrow(fl=None,
+                   dtype=None,
+                   usecols=None,
+                   keep_default_na=None,
+                   na_values=None,
+                   encoding=None):
+    '''read a large csv with pyarrow's multithreaded parser
+
+    column types are given to the parser instead of being inferred
+    and converted afterwards, columns not in dtype are inferred.
+    falls back to pd.read_csv if pyarrow is not installed
+
+    input
+    -----
+    fl: path or url
+    dtype: dictionary {column: type}, types are 'string', 'float64', 'int64', 'int16' or 'bool'
+    usecols: optional list of columns to read
+    keep_default_na: same as pd.read_csv, False keeps e.g. the ISO code "NA" a string [default: True]
+    na_values: additional strings to read as missing, same as pd.read_csv
+    encoding: file encoding [default: utf-8]
+
+    output
+    ------
+    df: dataframe with arrow-backed (ArrowDtype) columns
+    '''
+    dtype = {} if dtype is None else dtype
+    keep_default_na = True if keep_default_na is None else keep_default_na
+    na_values = [] if na_values is None else na_values
+    encoding = 'utf-8' if encoding is None else encoding
+
+    # ensure correct type
+    assert isinstance(dtype, dict), f"dtype must be a dictionary"
+    assert isinstance(keep_default_na, bool), f"keep_default_na must be a boolean"
+    assert isinstance(na_values, list), f"na_values must be a list"
+
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return pd.read_csv(fl,
+                           dtype={column: PANDAS_FALLBACK_DTYPES[name] for column, name in dtype.items()},
+                           usecols=usecols,
+                           keep_default_na=keep_default_na,
+                           na_values=na_values,
+                           encoding=encoding)
+
+    # same missing markers as pd.read_csv
+    null_values = list(na_values)
+    if keep_default_na:
+        null_values += pa_csv.ConvertOptions().null_values + PANDAS_EXTRA_NA_VALUES
+
+    read_options = pa_csv.ReadOptions(use_threads=True, encoding=encoding)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={column: pa.type_for_alias(name) for column, name in dtype.items()},
+        null_values=null_values,
+        strings_can_be_null=True,
+        include_columns=usecols,
+    )
+
+    # pyarrow opens local (and compressed) files itself, urls are streamed
+    source = fl
+    if isinstance(fl, str) and fl.startswith(('http://', 'https://')):
+        from urllib.request import urlopen
+        source = urlopen(fl)
+
+    table = pa_csv.read_csv(source, read_options=read_options, convert_options=convert_options)
+
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+# memory a harmonizer may use, e.g. "2GB", set per call with memoryBudget= or with
+# OPENCLIMATE_MEMORY_BUDGET. without a budget sources are read in memory
+MEMORY_BUDGET = os.environ.get('OPENCLIMATE_MEMORY_BUDGET')
+
+# peak memory of the pandas steps as a multiple of the parsed input
+# (merge, melt and apply each hold a copy while they run)
+MEMORY_OVERHEAD = 3
+
+MEMORY_UNITS = {
+    'B': 1,
+    'KB': 10**3,
+    'MB': 10**6,
+    'GB': 10**9,
+    'TB': 10**12,
+    'KIB': 2**10,
+    'MIB': 2**20,
+    'GIB': 2**30,
+    'TIB': 2**40,
+}
+
+# the on-disk size of these says little about the parsed size
+COMPRESSED_SUFFIXES = ['.gz', '.bz2', '.zip', '.xz', '.zst', '.tar']
+
+def parse_memory_size(size=None):
+    ''' "512MB", "2GiB", "1.5 GB" or a number of bytes -> bytes '''
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([A-Za-z]*)\s*', str(size))
+    assert match and match.group(2).upper() in list(MEMORY_UNITS) + [''], \
+        f"memory size must be a number of bytes or like '2GB', got {size}"
+
+    number, unit = match.groups()
+    return int(float(number) * MEMORY_UNITS.get(unit.upper(), 1))
+
+def resolve_memory_budget(memoryBudget=None):
+    ''' memoryBudget argument, else OPENCLIMATE_MEMORY_BUDGET, in bytes (None: no budget) '''
+    memoryBudget = MEMORY_BUDGET if memoryBudget is None else memoryBudget
+
+    return None if memoryBudget is None else parse_memory_size(memoryBudget)
+
+def is_url(fl=None):
+    return isinstance(fl, str) and fl.startswith(('http://', 'https://'))
+
+def csv_source_size(fl=None):
+    ''' size of a csv in bytes, None if it is unknown (compressed, or a url without Content-Length) '''
+    if any(str(fl).lower().endswith(suffix) for suffix in COMPRESSED_SUFFIXES):
+        return None
+
+    if is_url(fl):
+        from urllib.request import Request, urlopen
+        try:
+            with urlopen(Request(fl, method='HEAD')) as response:
+                length = response.headers.get('Content-Length')
+        except OSError:
+            return None
+        return int(length) if length else None
+
+    return os.path.getsize(fl)
+
+def open_csv_source(fl=None):
+    ''' local path as is (pandas streams it), urls as a streamed response
+
+    pd.read_csv(url) downloads the whole file before parsing
+    '''
+    if is_url(fl):
+        from urllib.request import urlopen
+        return urlopen(fl)
+
+    return fl
+
+def estimate_csv_memory(fl=None, dtype=None, sampleRows=None, encoding=None):
+    '''estimate the in-memory size of a csv before reading it
+
+    the first rows are parsed and the bytes per row in memory are
+    scaled to the file size
+
+    input
+    -----
+    fl: path or url
+    dtype: dictionary {column: type}, same as read_csv_arrow()
+    sampleRows: rows to sample [default: 10000]
+    encoding: file encoding [default: utf-8]
+
+    output
+    ------
+    dictionary with
+    file_bytes: size on disk (None if unknown)
+    rows: estimated number of rows (None if unknown)
+    row_bytes: memory per parsed row
+    memory_bytes: estimated memory of the parsed file (None if unknown)
+    '''
+    dtype = {} if dtype is None else dtype
+    sampleRows = 10000 if sampleRows is None else sampleRows
+    encoding = 'utf-8' if encoding is None else encoding
+
+    file_bytes = csv_source_size(fl)
+
+    df_sample = pd.read_csv(open_csv_source(fl),
+                            nrows=sampleRows,
+                            dtype={column: PANDAS_FALLBACK_DTYPES[name] for column, name in dtype.items()},
+                            encoding=encoding)
+
+    # object strings are larger than arrow strings, so this errs on the safe side
+    n = max(len(df_sample), 1)
+    row_bytes = df_sample.memory_usage(deep=True, index=False).sum() / n
+
+    if file_bytes is None:
+        return {'file_bytes': None, 'rows': None, 'row_bytes': row_bytes, 'memory_bytes': None}
+
+    # bytes per row on disk, from the sample written back as csv
+    disk_row_bytes = len(df_sample.to_csv(index=False, header=False).encode(encoding)) / n
+    rows = int(file_bytes / max(disk_row_bytes, 1))
+
+    return {'file_bytes': file_bytes, 'rows': rows, 'row_bytes': row_bytes, 'memory_bytes': int(rows * row_bytes)}
+
+def read_csv_budgeted(fl=None,
+                      dtype=None,
+                      transform=None,
+                      memoryBudget=None,
+                      sampleRows=None,
+                      encoding=None):
+    '''read and transform a csv within a memory budget
+
+    the input size is estimated first. if the file fits in the budget
+    (with MEMORY_OVERHEAD for the steps that follow) it is read at once
+    with read_csv_arrow(), otherwise it is read in partitions that are
+    transformed one at a time and appended. the partition size shrinks
+    as transformed rows accumulate so the total stays in the budget
+
+    transform should drop what is not needed (rows, columns), it must
+    give the same rows when applied per partition as on the whole file
+
+    input
+    -----
+    fl: path or url
+    dtype: dictionary {column: type}, same as read_csv_arrow()
+    transform: function dataframe -> dataframe [default: none]
+    memoryBudget: e.g. "2GB" or bytes, see resolve_memory_budget() [default: no budget, read in memory]
+    sampleRows: rows sampled to estimate the size [default: 10000]
+    encoding: file encoding [default: utf-8]
+
+    output
+    ------
+    df: transformed dataframe, the index counts rows of the file in both modes
+    '''
+    dtype = {} if dtype is None else dtype
+    transform = (lambda df: df) if transform is None else transform
+    encoding = 'utf-8' if encoding is None else encoding
+    budget = resolve_memory_budget(memoryBudget)
+
+    # ensure correct type
+    assert isinstance(dtype, dict), f"dtype must be a dictionary"
+    assert callable(transform), f"transform must be a function"
+
+    if budget is None:
+        return transform(read_csv_arrow(fl, dtype=dtype, encoding=encoding))
+
+    estimate = estimate_csv_memory(fl, dtype=dtype, sampleRows=sampleRows, encoding=encoding)
+
+    if estimate['memory_bytes'] is not None and estimate['memory_bytes'] * MEMORY_OVERHEAD <= budget:
+        return transform(read_csv_arrow(fl, dtype=dtype, encoding=encoding))
+
+    logger.info(f"{fl}: ~{estimate['memory_bytes'] or 'unknown'} bytes in memory, "
+                f"reading in partitions to stay in {budget} bytes")
+
+    parts = []
+    kept_bytes = 0
+    # partitions are split as text and parsed by read_csv_arrow(), like the whole file
+    with pd.read_csv(open_csv_source(fl),
+                     dtype=str,
+                     keep_default_na=False,
+                     na_filter=False,
+                     encoding=encoding,
+                     chunksize=1) as reader:
+        while True:
+            # rows that fit in what is left of the budget
+            rows = int((budget / MEMORY_OVERHEAD - kept_bytes) / max(estimate['row_bytes'], 1))
+            if rows < 1:
+                raise MemoryError(f"transformed rows of {fl} alone exceed the memory budget of {budget} bytes")
+
+            try:
+                df_part = reader.get_chunk(rows)
+            except StopIteration:
+                break
+
+            df_part = transform(read_csv_text(df_part, dtype=dtype))
+            kept_bytes += df_part.memory_usage(deep=True, index=False).sum()
+            parts.append(df_part)
+
+    # header only
+    if not parts:
+        df_header = pd.read_csv(open_csv_source(fl), nrows=0, dtype=str, encoding=encoding)
+        return transform(read_csv_text(df_header, dtype=dtype))
+
+    # types are inferred per partition, widen them to what the whole file would give
+    return pd.concat(unify_arrow_dtypes(parts))
+
+def read_csv_text(df_text=None, dtype=None):
+    ''' parse a partition read as text (dtype=str, na_filter=False) with read_csv_arrow(),
+    the index of df_text is kept '''
+    df = read_csv_arrow(io.BytesIO(df_text.to_csv(index=False).encode('utf-8')), dtype=dtype)
+    df.index = df_text.index
+
+    return df
+
+def unify_arrow_dtypes(parts=None):
+    ''' cast the columns of each partition to one ArrowDtype per column,
+    int and float give float and a missing-only column takes the other type,
+    like pyarrow's inference on the whole file. other conflicts give strings '''
+    try:
+        import pyarrow as pa
+    except ImportError:
+        # pd.read_csv partitions, concat widens e.g. int and float to float
+        return parts
+
+    columns = parts[0].columns
+    dtypes = {}
+    for column in columns:
+        types = [part[column].dtype.pyarrow_dtype for part in parts]
+        try:
+            schema = pa.unify_schemas([pa.schema([(str(column), t)]) for t in types], promote_options='permissive')
+            dtypes[column] = pd.ArrowDtype(schema.field(0).type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            dtypes[column] = pd.ArrowDtype(pa.string())
+
+    return [part.astype(dtypes) for part in parts]
+
+
+def is_extension_numeric(dtype=None):
+    ''' arrow-backed or nullable (Int64, Float64) numeric dtype '''
+    return (pd.api.types.is_extension_array_dtype(dtype)
+            and pd.api.types.is_numeric_dtype(dtype)
+            and not pd.api.types.is_bool_dtype(dtype))
+
+def numpy_numeric(column=None):
+    ''' numeric column as the numpy array pd.read_csv would have given,
+    int64 without missing values, float64 with NaN otherwise '''
+    if is_extension_numeric(column.dtype):
+        if column.isna().any() or pd.api.types.is_float_dtype(column.dtype.numpy_dtype):
+            return column.to_numpy(dtype='float64', na_value=np.nan)
+        return column.to_numpy(dtype=column.dtype.numpy_dtype)
+    return column.to_numpy()
+
 def df_wide_to_long(df=None, 
                     value_name=None, 
-                    var_name=None):
+                    var_name=None,
+                    dropna=None):
+    '''unpivot a dataframe with one column per year into long format
+
+    columns with digit-only labels are the years, all other columns are
+    identifiers. Output matches DataFrame.melt (same column and row order
+    and identifier dtypes): the year block is stacked as a single numpy
+    array and each identifier column is taken once at the tiled row positions.
+
+    input
+    -----
+    df: wide dataframe
+    value_name: name of the new value column [default: values]
+    var_name: name of the new year column [default: year]
+    dropna: drop rows where the value is NaN during the reshape [default: False]
+
+    output
+    ------
+    df_long: long dataframe with columns id_vars + [var_name, value_name]
+    '''
     
     # set default values (new column names)
     var_name = "year" if var_name is None else var_name          # new column name with {value_vars}
     value_name = "values" if value_name is None else value_name  # new column name with values
+    dropna = False if dropna is None else dropna
     
     # ensure correct type
     assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
     assert isinstance(var_name, str), f"var_name must a be string"
     assert isinstance(value_name, str), f"value_name must be a string"
+    assert isinstance(dropna, bool), f"dropna must be a boolean"
+
+    # output columns are keyed by label, 1990 and "1990" would collide
+    labels = [str(label) for label in df.columns]
+    assert len(set(labels)) == len(labels), f"column labels must be unique, got duplicates {sorted({l for l in labels if labels.count(l) > 1})}"
     
-    # ensure column names are strings
-    df.columns = df.columns.astype(str)
-    
-    # columns to use as identifiers (columns that are not number)
-    id_vars = [val for val in list(df.columns) if not val.isdigit()]
+    # split columns into identifiers and years in one pass
+    id_pos, year_pos, years = [], [], []
+    for pos, label in enumerate(df.columns):
+        label = str(label)
+        if label.isdigit():
+            year_pos.append(pos)
+            years.append(int(label))
+        else:
+            id_pos.append(pos)
 
-    # columns to unpivot (columns that are numbers)
-    value_vars = [val for val in list(df.columns) if val.isdigit()]
+    n_rows = len(df)
+    n_years = len(year_pos)
 
-    # Unpivot (melt) a DataFrame from wide to long format
-    df_long = df.melt(id_vars = id_vars, 
-                            value_vars = value_vars,
-                            var_name = var_name, 
-                            value_name = value_name)
-    
-    # convert var_name column to int
-    df_long[var_name] = df_long[var_name].astype(int)
+    # arrow-backed (read_csv_arrow) or nullable year columns as plain numpy,
+    # mixed int64[pyarrow] and double[pyarrow] would stack as boxed objects
+    df_years = df.iloc[:, year_pos]
+    if any(is_extension_numeric(dtype) for dtype in df_years.dtypes):
+        df_years = pd.DataFrame({i: numpy_numeric(df_years.iloc[:, i]) for i in range(n_years)})
+
+    # stack the year block column by column (same order as melt)
+    values = df_years.to_numpy().ravel(order='F')
+    year_values = np.repeat(np.array(years, dtype=int), n_rows)
+
+    # source row of every output row
+    rows = np.tile(np.arange(n_rows), n_years)
+
+    # rows to keep after the reshape
+    keep = ~pd.isna(values) if dropna else None
+    if keep is not None:
+        values = values[keep]
+        year_values = year_values[keep]
+        rows = rows[keep]
+
+    # take() on the underlying array keeps the dtype of each identifier column
+    columns = {labels[pos]: df.iloc[:, pos].array.take(rows) for pos in id_pos}
+
+    columns[var_name] = year_values
+    columns[value_name] = values
+
+    df_long = pd.DataFrame(columns)
     
     return df_long
 
@@ -245,9 +843,24 @@ def check_all_names_match(df=None, column=None):
     assert len(df.loc[filt]) == len(df)
     
     
+# columns of the GHGRP facility file used by harmonize_eccc_ghgrp(), the rest is inferred
+# "Total emissions" is a string, some values have thousands separators
+GOC_FACILITIES_DTYPES = {
+    'Report year': 'int64',
+    'Facility ID': 'int64',
+    'Facility name': 'string',
+    'Company name': 'string',
+    'City': 'string',
+    'Province': 'string',
+    'Latitude': 'float64',
+    'Longitude': 'float64',
+    'Total emissions': 'string',
+    'Units': 'string',
+}
+
 def read_goc_facilities():
     fl = '/Users/luke/Documents/work/data/GoC_large_facilities/raw/Greenhouse_gas_emissions_from_large_facilities.csv'
-    df = pd.read_csv(fl, encoding='latin-1')
+    df = read_csv_arrow(fl, dtype=GOC_FACILITIES_DTYPES, encoding='latin-1')
     return df
 
 
@@ -258,13 +871,27 @@ def read_subdivisions():
     return df
 
 
+def read_us_states(fl=None):
+    ''' US states from the ISO-3166-2 actors, names in title case
+    with columns ['actor_id', 'is_part_of', 'name']
+    '''
+    if fl is None:
+        fl = 'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-2/Actor.csv'
+
+    df_sub = pd.read_csv(fl)
+    df_sub = df_sub[['actor_id','is_part_of','name']]
+    filt = (df_sub['is_part_of'] == 'US')
+    df_sub = df_sub.loc[filt]
+    df_sub['name'] = df_sub['name'].str.title()
+    return df_sub
+
+
 def df_columns(df):
     return list(df.columns)
 
 
-def unlocode_name_dict():    
-    # creates dictionary of LOCODE w/ and w/out diacritics {name_with_out_diacritic : name}
-    # can be pulled out and named something like name_dictionary():
+def read_unlocode_codelist():
+    # read the raw UNLOCODE code list (all parts)
     LOCODE_COLUMNS = [
       "Ch",
       "ISO 3166-1",
@@ -285,14 +912,183 @@ def unlocode_name_dict():
     INPUT_DIR = '/Users/luke/Documents/work/projects/OpenClimate-UNLOCODE/loc221csv'
     all_files = glob.glob(os.path.join(INPUT_DIR, "*CodeListPart*.csv"))
 
-    df_raw = pd.concat((pd.read_csv(f, names=LOCODE_COLUMNS) for f in all_files), ignore_index=True)
+    # keep_default_na=False so the ISO code "NA" (Namibia) is not NaN
+    df_raw = pd.concat((pd.read_csv(f, names=LOCODE_COLUMNS, keep_default_na=False, na_values=[''])
+                        for f in all_files), ignore_index=True)
     filt = ~df_raw['LOCODE'].isna()
     df_raw = df_raw.loc[filt]
+
+    return df_raw
+
+
+def unlocode_name_dict():    
+    # creates dictionary of LOCODE w/ and w/out diacritics {name_with_out_diacritic : name}
+    df_raw = read_unlocode_codelist()
     name_dict = dict(zip(df_raw.NameWoDiacritics, df_raw.Name))
     
     return name_dict
 
-    
+
+def decode_unlocode_coordinates(coordinates=None):
+    ''' decode UNLOCODE coordinates like "5058N 00530E" to degrees
+
+    input
+    -----
+    coordinates: series of DDMM[NS] DDDMM[EW] strings
+
+    output
+    ------
+    df: dataframe with lat and lng in degrees, NaN where not decodable
+    '''
+    parts = coordinates.astype(str).str.extract(r'^(\d{2})(\d{2})([NS])\s+(\d{3})(\d{2})([EW])$')
+
+    lat = parts[0].astype(float) + parts[1].astype(float) / 60
+    lng = parts[3].astype(float) + parts[4].astype(float) / 60
+
+    return pd.DataFrame({
+        'lat': lat.where(parts[2] != 'S', -lat),
+        'lng': lng.where(parts[5] != 'W', -lng),
+    }, index=coordinates.index)
+
+
+def unlocode_coordinates():
+    ''' LOCODEs with decoded coordinates
+
+    output
+    ------
+    df: dataframe with columns actor_id ("BE GNK"), iso2, lat, lng
+    '''
+    df_raw = read_unlocode_codelist()
+
+    df_out = decode_unlocode_coordinates(df_raw['Coordinates'])
+    df_out['actor_id'] = df_raw['ISO 3166-1'] + ' ' + df_raw['LOCODE']
+    df_out['iso2'] = df_raw['ISO 3166-1']
+
+    # only keep LOCODEs with coordinates
+    df_out = df_out.loc[df_out['lat'].notna() & df_out['lng'].notna()]
+
+    return df_out[['actor_id', 'iso2', 'lat', 'lng']].reset_index(drop=True)
+
+
+def lat_lng_to_unit_vectors(lat=None, lng=None):
+    ''' 3D unit vectors, euclidean distances between them are chord lengths '''
+    lat = np.radians(np.asarray(lat, dtype='float64'))
+    lng = np.radians(np.asarray(lng, dtype='float64'))
+    return np.column_stack([np.cos(lat) * np.cos(lng),
+                            np.cos(lat) * np.sin(lng),
+                            np.sin(lat)])
+
+
+def nearest_locodes(df=None, df_locode=None, radiusKm=None, k=None):
+    ''' nearest LOCODEs within radiusKm of each row, in the same country
+
+    one KD-tree is built per ISO2 code on unit-sphere vectors and all rows
+    of that country are queried in a single batched call
+
+    input
+    -----
+    df: dataframe with lat, lng (degrees) and iso2 columns
+    df_locode: output of unlocode_coordinates()
+    radiusKm: search radius in km [default: 10]
+    k: number of candidates per row [default: 1]
+
+    output
+    ------
+    df: candidates with columns index (row label in df), actor_id, distance_km, rank
+    '''
+    # scipy is only needed for the coordinate fallback
+    from scipy.spatial import cKDTree
+
+    EARTH_RADIUS_KM = 6371.0088
+
+    radiusKm = 10 if radiusKm is None else radiusKm
+    k = 1 if k is None else k
+
+    # ensure correct type
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+    assert isinstance(df_locode, pd.core.frame.DataFrame), f"df_locode must be a DataFrame"
+
+    # chord length of the search radius on the unit sphere
+    max_chord = 2 * np.sin(radiusKm / EARTH_RADIUS_KM / 2)
+
+    df = df.loc[df['lat'].notna() & df['lng'].notna()]
+    locode_groups = df_locode.groupby('iso2').indices
+
+    candidates = []
+    for iso2, rows in df.groupby('iso2').indices.items():
+        if iso2 not in locode_groups:
+            continue
+
+        df_loc = df_locode.iloc[locode_groups[iso2]]
+        tree = cKDTree(lat_lng_to_unit_vectors(df_loc['lat'], df_loc['lng']))
+
+        # batched query of every row in this country
+        chord, pos = tree.query(lat_lng_to_unit_vectors(df['lat'].iloc[rows], df['lng'].iloc[rows]),
+                                k=k, distance_upper_bound=max_chord)
+        chord = chord.reshape(len(rows), k)
+        pos = pos.reshape(len(rows), k)
+
+        # misses are returned with infinite distance
+        found = np.isfinite(chord)
+        row_pos, rank = np.nonzero(found)
+        candidates.append(pd.DataFrame({
+            'index': df.index[rows[row_pos]],
+            'actor_id': df_loc['actor_id'].to_numpy()[pos[found]],
+            'distance_km': 2 * EARTH_RADIUS_KM * np.arcsin(chord[found] / 2),
+            'rank': rank + 1,
+        }))
+
+    columns = ['index', 'actor_id', 'distance_km', 'rank']
+    if not candidates:
+        return pd.DataFrame(columns=columns)
+
+    return pd.concat(candidates, ignore_index=True)[columns]
+
+
+def match_unlocode_by_coordinates(df_with_iso=None, df_merged=None, df_name_matches=None, radiusKm=None, keys=None):
+    ''' fill EUCoM rows that did not match UNLOCODE by name with the nearest LOCODE
+
+    input
+    -----
+    df_with_iso: EUCoM rows with iso2, lat, lng and a row_id column
+    df_merged: name matches after dropping duplicate actor_ids (with row_id and actor_id)
+    df_name_matches: every row matched by name, before dropping duplicates.
+                     rows in here are never matched by coordinates, so the other
+                     years of a city matched by name cannot claim a neighbouring LOCODE
+    radiusKm: search radius in km, see nearest_locodes()
+    keys: output of load_key_dictionaries(), if set df_merged has an actor_key
+          instead of actor_id and the nearest LOCODEs are encoded the same way
+
+    output
+    ------
+    df: df_merged with the coordinate matches appended
+    '''
+    # ensure correct type
+    assert isinstance(df_name_matches, pd.core.frame.DataFrame), f"df_name_matches must be a DataFrame"
+
+    # rows without a name match
+    filt = ~df_with_iso['row_id'].isin(df_name_matches['row_id'])
+    df_unmatched = df_with_iso.loc[filt]
+
+    df_candidates = nearest_locodes(df=df_unmatched, df_locode=unlocode_coordinates(), radiusKm=radiusKm)
+    df_candidates = df_candidates.loc[df_candidates['rank'] == 1]
+
+    df_nearest = df_unmatched.loc[df_candidates['index']].copy()
+
+    # actor_id of the nearest LOCODE, or its key when df_merged carries keys
+    column = 'actor_id'
+    if keys is None:
+        df_nearest[column] = df_candidates['actor_id'].to_numpy()
+    else:
+        from utils_keys import key_column
+        column = key_column('actor_id')
+        df_nearest[column] = keys['actor_id'].encode(df_candidates['actor_id'].to_numpy())
+
+    # name matches first, a LOCODE is only used once
+    df_out = pd.concat([df_merged, df_nearest], ignore_index=True)
+    return df_out.drop_duplicates(subset=[column], keep='first').reset_index(drop=True)
+
+
 def name_harmonize_iso():
     # name harmonize
     from utils import read_iso_codes
@@ -326,6 +1122,16 @@ def name_harmonize_iso():
 
 
 
+# identifier columns of PRIMAP-hist, one float column per year follows
+PRIMAP_DTYPES = {
+    'source': 'string',
+    'scenario (PRIMAP-hist)': 'string',
+    'area (ISO3)': 'string',
+    'entity': 'string',
+    'unit': 'string',
+    'category (IPCC2006_PRIMAP)': 'string',
+}
+
 def read_primap(fl=None):
     ''' read primap from web
 
@@ -356,8 +1162,8 @@ def read_primap(fl=None):
     if fl is None:
         fl = "https://zenodo.org/record/5494497/files/Guetschow-et-al-2021-PRIMAP-hist_v2.3.1_no_extrap_20-Sep_2021.csv"
 
-    # read as pandas dataframe
-    df = pd.read_csv(fl)
+    # read as pandas dataframe, year columns are inferred as float
+    df = read_csv_arrow(fl, dtype=PRIMAP_DTYPES)
 
     return df
 
@@ -547,13 +1353,16 @@ def remove_country_groups(df, column=None):
 
     
 # TODO: separate into primap specific file (?)
+@profiled
 def harmonize_primap_emissions(fl=None,
                                outputDir=None, 
                                tableName=None,
                                datasourceDict=None,
                                entity=None, 
                                category=None, 
-                               scenario=None):
+                               scenario=None,
+                               backend=None,
+                               memoryBudget=None):
     '''harmonize primap dataset
 
     haramonize primap to conform to open cliamte schema
@@ -563,10 +1372,13 @@ def harmonize_primap_emissions(fl=None,
     outputDir: directory where table will be created
     tableName: name of the table to create
     datasourceDict: dictionary with datasource info
+    backend: pandas, polars or duckdb, see resolve_backend() [default: pandas]
+    memoryBudget: e.g. "2GB", see read_csv_budgeted(), DuckDB uses it as memory_limit
+                  [default: OPENCLIMATE_MEMORY_BUDGET, else no budget]
 
     output
     -------
-    df: final dataframe with emissions info
+    df_emissionsAgg: EmissionsAgg table, the same with every backend
     '''
     
     # set default values
@@ -591,47 +1403,90 @@ def harmonize_primap_emissions(fl=None,
     
     # create out_dir if does not exist
     make_dir(path=out_dir)
+
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_primap_emissions')
     
     # read iso
-    df_iso = read_iso_codes()
-    
-    # read subset of primap
-    df_pri_tmp = read_primap(fl=fl)
-    df_pri = subset_primap(df_pri_tmp, entity=entity, category=category, scenario=scenario)
+    df_iso = read_iso_codes() if resolve_backend(backend) != 'duckdb' else None
+
+    # lazy query plan, polars is only needed here
+    if resolve_backend(backend) == 'polars':
+        from utils_polars import primap_emissions_plan, collect_emissions_agg
+        lf = primap_emissions_plan(fl=fl, df_iso=df_iso, datasourceDict=datasourceDict,
+                                   entity=entity, category=category, scenario=scenario)
+        df_emissionsAgg = collect_emissions_agg(lf=lf, outputDir=out_dir, tableName=tableName)
+        prof.stage('collect_write', df_emissionsAgg)
+        prof.finish()
+        return df_emissionsAgg
+
+    # one query over the csv and the iso_codes reference view, DuckDB is only needed here
+    if resolve_backend(backend) == 'duckdb':
+        from utils_sql import connect, primap_emissions_sql, collect_emissions_agg
+        query = primap_emissions_sql(fl=fl, datasourceDict=datasourceDict,
+                                     entity=entity, category=category, scenario=scenario)
+        budget = resolve_memory_budget(memoryBudget)
+        con = connect(references=['iso_codes'], memoryLimit=None if budget is None else f'{budget}B')
+        df_emissionsAgg = collect_emissions_agg(con=con, query=query, outputDir=out_dir, tableName=tableName)
+        prof.stage('query_write', df_emissionsAgg)
+        prof.finish()
+        return df_emissionsAgg
+    
+    # read subset of primap, in partitions if the file does not fit in memoryBudget
+    df_pri = read_csv_budgeted(fl,
+                               dtype=PRIMAP_DTYPES,
+                               transform=lambda df: subset_primap(df, entity=entity, category=category, scenario=scenario),
+                               memoryBudget=memoryBudget)
+    prof.stage('read_subset', df_pri)
+
+    # int32 surrogate keys, utils_keys imports utils so it is only imported here
+    from utils_keys import MISSING_KEY, load_key_dictionaries, save_key_dictionaries, decode_keys, sort_order
+    keys = load_key_dictionaries()
+
+    # merge on iso3 and carry actor_key instead of the string iso2
+    df_iso_keys = pd.DataFrame({'iso3': df_iso['iso3'],
+                                'actor_key': keys['actor_id'].encode(df_iso['iso2'])})
 
     # merge datasets
-    df_merged = pd.merge(df_pri, df_iso, 
+    df_merged = pd.merge(df_pri, df_iso_keys, 
                          left_on=['area (ISO3)'], 
                          right_on=["iso3"], 
                          how="left")
+    df_merged['actor_key'] = df_merged['actor_key'].fillna(MISSING_KEY).astype('int32')
+    prof.stage('merge_iso', df_merged)
     
     # convert from wide to long dataframe
     df_long = df_wide_to_long(df=df_merged,
                               value_name="emissions",
-                              var_name="year")
+                              var_name="year",
+                              dropna=True)
+    prof.stage('melt', df_long)
 
     # filter un-necessary ISO codes and where emissions ana (removes 251 records)
     df = filter_primap(df=df_long, identifier="iso3", emissions="emissions")
-    
-    # rename columns
-    df = df.rename(columns={'iso2': 'actor_id'})
 
     # filter out ISO3 code ANT (netherland antilles)
     filt = ~(df['area (ISO3)'] == 'ANT')
     df = df.loc[filt]
 
+    # sort by actor_id and year, on the rank of actor_key
+    df = df.iloc[sort_order(df, by=['actor_id', 'year'], keys=keys)]
+    prof.stage('sort', df)
+
     def gigagram_to_metric_ton(val):
         ''' 1 gigagram = 1000 tonnes  '''
         return val * 1000
     
-    # create id columns
-    df['datasource_id'] = datasourceDict['datasource_id']
+    # create id columns, the keys are decoded only for the written table
+    df['datasource_key'] = keys['datasource_id'].encode([datasourceDict['datasource_id']])[0]
+    df = decode_keys(df, keys)
     df['emissions_id'] = df.apply(lambda row: 
                                   f"{row['source']}:{row['actor_id']}:{row['year']}", 
                                   axis=1)
 
     # convert emissions to metric tons
     df['total_emissions'] = df['emissions'].apply(gigagram_to_metric_ton)
+    prof.stage('apply', df)
 
     # Create EmissionsAgg table
     emissionsAggColumns = ["emissions_id",
@@ -643,21 +1498,21 @@ def harmonize_primap_emissions(fl=None,
     df_emissionsAgg = df[emissionsAggColumns]
 
     # ensure columns have correct types
-    df_emissionsAgg = df_emissionsAgg.astype({'emissions_id': str,
-                                              'actor_id': str,
-                                              'year': int,
-                                              'total_emissions': int,
-                                              'datasource_id': str})
-
-    # sort by actor_id and year
-    df_emissionsAgg = df_emissionsAgg.sort_values(by=['actor_id', 'year'])
+    df_emissionsAgg = apply_dtype_plan(df_emissionsAgg)
+    prof.stage('astype', df_emissionsAgg)
 
     # convert to csv
     df_emissionsAgg.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_emissionsAgg)
+    prof.finish()
 
-    return df
+    # keep the keys handed out for the next build
+    save_key_dictionaries(keys)
 
+    return df_emissionsAgg
 
+
+@profiled
 def harmonize_imf_gdp(outputDir=None, 
                       tableName=None,
                       datasourceDict=None):
@@ -674,11 +1529,15 @@ def harmonize_imf_gdp(outputDir=None,
     
     # create out_dir if does not exist
     make_dir(path=out_dir)
+
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_imf_gdp')
     
     # read dataset
     workbook = xlrd.open_workbook_xls('/Users/luke/Documents/work/data/GDP/country/imf-dm-export-20221017.xls', 
                                       ignore_workbook_corruption=True)  
     df_gdp_tmp = pd.read_excel(workbook)
+    prof.stage('read', df_gdp_tmp)
 
     # open climactor and isocode dataset 
     df_climactor = get_climactor_country()
@@ -713,15 +1572,18 @@ def harmonize_imf_gdp(outputDir=None,
     # sanity check that names match
     check_all_names_match(df_out, 'country_harmonized')
 
+    prof.stage('name_harmonize', df_out)
+
     # unpivot the dataset wide to long
     df_long = df_wide_to_long(df=df_out, value_name='GDP')
+    prof.stage('melt', df_long)
 
-    # remove any records with no GDP data
-    filt = ~(df_long['GDP'] == 'no data')
-    df_long = df_long.loc[filt]
+    # convert to float, "no data" becomes NaN
+    df_long['GDP'], reject = parse_numeric(df_long['GDP'])
+    assert reject.sum() == 0, f"{reject.sum()} GDP values could not be parsed"
 
-    # convert to float
-    df_long['GDP'] = df_long['GDP'].astype(float)
+    # remove any records with no GDP data
+    df_long = df_long.loc[df_long['GDP'].notna()]
 
     # convert GDP to USD instead of billion USD
     df_long['GDP'] = df_long['GDP'] * 10**9
@@ -735,6 +1597,7 @@ def harmonize_imf_gdp(outputDir=None,
 
     # merge ISO codes into dataframe to get actor_id
     df_out = pd.merge(df_long, df_iso, left_on=["country_harmonized"], right_on=["name"], how="left")
+    prof.stage('merge_iso', df_out)
 
     # filter out Kosovo (not in our emission or pledge databases)
     filt = (df_out['country_harmonized'] != 'Kosovo')
@@ -751,34 +1614,97 @@ def harmonize_imf_gdp(outputDir=None,
     df_out = df_out[columns]
 
     # ensure types are correct
-    df_out = df_out.astype({
-        'actor_id': str,
-        'gdp': int,
-        'year': int,
-        'datasource_id': str
-    })
+    df_out = apply_dtype_plan(df_out)
+    prof.stage('astype', df_out)
 
     # sort dataframe and save
     df_out = df_out.sort_values(by=['actor_id', 'year'])
+    prof.stage('sort', df_out)
 
     # convert to csv
     df_out.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_out)
+    prof.finish()
     
     return df_out
 
 
-def create_eccc_ghgrp_actor_tables(DataSourceDict=None, 
-                                 PublisherDict=None):
-    # get iso codes
-    df_iso = read_iso_codes()
+GHGRP_TABLES = ['Actor', 'ActorIdentifier', 'ActorName', 'Territory', 'EmissionsAgg']
+
+def harmonize_eccc_ghgrp(DataSourceDict=None,
+                         PublisherDict=None,
+                         MethodologyDict=None,
+                         df=None,
+                         spatial=None,
+                         boundaries=None,
+                         tables=None):
+    ''' ECCC GHGRP facility actors and emissions from a single parse
+
+    the facility csv is read once, provinces are matched once and
+    emissions are keyed on Facility ID (same as actor_id) instead of
+    joining back on facility and company names
+
+    input
+    -----
+    DataSourceDict: dictionary with datasource_id
+    PublisherDict: dictionary with id
+    MethodologyDict: dictionary with methodology_id, only needed for EmissionsAgg
+    df: raw facility dataframe, pass it to parse the csv once for several calls [default: read_goc_facilities()]
+    spatial: assign is_part_of by point-in-polygon on Latitude/Longitude,
+             facilities without coordinates keep their Province [default: False]
+    boundaries: admin-1 polygons for spatial [default: read_admin1_boundaries(countries=['CA'])]
+    tables: tables to create [default: GHGRP_TABLES], the emissions are only
+            checked and converted if EmissionsAgg is in tables
+
+    output
+    ------
+    dictionary {'Actor': df, 'ActorIdentifier': df, 'ActorName': df,
+                'Territory': df, 'EmissionsAgg': df} with the requested tables
+    '''
+    spatial = False if spatial is None else spatial
+    tables = GHGRP_TABLES if tables is None else tables
+
+    # ensure input types are correct
+    assert isinstance(DataSourceDict, dict), f"DataSourceDict must be a dictionary"
+    assert isinstance(PublisherDict, dict), f"PublisherDict must be a dictionary"
+    assert all(table in GHGRP_TABLES for table in tables), f"tables must be in {GHGRP_TABLES}"
+    if 'EmissionsAgg' in tables:
+        assert isinstance(MethodologyDict, dict), f"MethodologyDict must be a dictionary"
+
+    # read facility GHGs
+    df = read_goc_facilities() if df is None else df
 
     # get canadian provinces
     df_subdiv = read_subdivisions()
     filt = df_subdiv['country'] == 'CA'
-    df_provinces = df_subdiv.loc[filt]
+    province_to_subdivision = dict(zip(df_subdiv.loc[filt, 'name'], df_subdiv.loc[filt, 'subdivision']))
 
-    # read facility GHGs
-    df = read_goc_facilities()
+    # match provinces once, on the raw rows
+    df = df.copy()
+    df['subdivision'] = df['Province'].map(province_to_subdivision)
+
+    # sanity check, make sure all match
+    assert df['subdivision'].isna().sum() == 0, (
+        f"{df['subdivision'].isna().sum()} provinces did not match a subdivision"
+    )
+
+    # actor_id straight from the facility ID, shared by actor and emissions tables,
+    # built once per facility and carried as an int32 actor_key,
+    # utils_keys imports utils so it is only imported here
+    from utils_keys import load_key_dictionaries, save_key_dictionaries, decode_keys
+    keys = load_key_dictionaries()
+    codes, facility_ids = pd.factorize(df['Facility ID'], use_na_sentinel=False)
+    actor_ids = f"{PublisherDict['id']}:GHGRP:" + pd.Series(facility_ids).astype(str)
+    df['actor_key'] = keys['actor_id'].encode(actor_ids)[codes]
+    df['is_part_of'] = 'CA-' + df['subdivision']
+
+    # point-in-polygon against admin-1 boundaries, geopandas only needed here
+    if spatial:
+        from utils_spatial import assign_actors, read_admin1_boundaries
+        boundaries = read_admin1_boundaries(countries=['CA']) if boundaries is None else boundaries
+        subdivision_id = assign_actors(df=df, lat='Latitude', lng='Longitude', subdivisions=boundaries)['subdivision_id']
+        df['is_part_of'] = subdivision_id.fillna(df['is_part_of'])
+    df['datasource_key'] = keys['datasource_id'].encode([DataSourceDict['datasource_id']])[0]
 
     # create companies dataframe
     columns = [
@@ -792,52 +1718,20 @@ def create_eccc_ghgrp_actor_tables(DataSourceDict=None,
     ]
 
     # only get company information
-    df_companies = df[columns]
-
-    # drop duplicates
-    df_companies = df_companies.drop_duplicates()
-
-    # merge on province names
-    df_out = pd.merge(df_companies, df_provinces, left_on=["Province"], right_on=["name"], how="left")
+    df_out = df.drop_duplicates(subset=columns)
 
-    # drop uneeded columns
-    df_out = df_out.drop(columns=['name'])
+    # decode the keys, only the actor tables need the string ids
+    df_out = decode_keys(df_out, keys)
 
-    # sanity check, make sure all match
-    assert ~sum(df_out['subdivision'].isna())
-
-    # add type, datasource_id, actor_id, and is_part_of
-    df_out["namespace"] = 'ECCC GHGRP'
-    df_out['type'] = "site"
-
-    df_out['datasource_id'] = DataSourceDict['datasource_id']
-
-    df_out['actor_id'] = df_out.apply(lambda row: 
-                                      f"{PublisherDict['id']}:GHGRP:{row['Facility ID']}", 
-                                      axis=1)
-
-    df_out['is_part_of'] = df_out.apply(lambda row: 
-                                      f"{row['country']}-{row['subdivision']}", 
-                                      axis=1)
-
-    df_out['identifier'] = df_out.apply(lambda row: 
-                                      f"ECCC_GHGRP{row['Facility ID']}", 
-                                      axis=1)
+    # add identifier, type and namespace
+    df_out = df_out.assign(identifier='ECCC_GHGRP' + df_out['Facility ID'].astype(str),
+                           namespace='ECCC GHGRP', type='site', language='und', preferred=0)
 
     # rename columns
     df_out = df_out.rename(columns={'Facility name':'name', 'Company name':'is_owned_by'})
 
     # create Actor table
-    columns = [
-        'actor_id', 
-        'type', 
-        'name', 
-        'is_part_of', 
-        'is_owned_by', 
-        'datasource_id'
-    ]
-
-    df_actor = df_out[columns]
+    df_actor = df_out[['actor_id', 'type', 'name', 'is_part_of', 'is_owned_by', 'datasource_id']]
 
     # ensure types are correct
     df_actor = df_actor.astype({
@@ -848,16 +1742,8 @@ def create_eccc_ghgrp_actor_tables(DataSourceDict=None,
         'is_owned_by': str,
         'datasource_id':str,
     })
-    
 
-    columns = [
-        "actor_id",
-        "identifier",
-        "namespace",
-        "datasource_id"
-    ]
-    
-    df_actorIdentifier = df_out[columns]
+    df_actorIdentifier = df_out[["actor_id", "identifier", "namespace", "datasource_id"]]
 
     # ensure types are correct
     df_actorIdentifier = df_actorIdentifier.astype({
@@ -867,19 +1753,7 @@ def create_eccc_ghgrp_actor_tables(DataSourceDict=None,
         'datasource_id':str,
     })
 
-    df_out['language'] = 'und'
-    df_out['preferred'] = 0
-
-    columns = [
-        "actor_id",
-        "name",
-        "language",
-        "preferred",
-        "datasource_id"
-    ]
-
-    df_actorName = df_out[columns]
-
+    df_actorName = df_out[["actor_id", "name", "language", "preferred", "datasource_id"]]
 
     # ensure types are correct
     df_actorName = df_actorName.astype({
@@ -889,23 +1763,14 @@ def create_eccc_ghgrp_actor_tables(DataSourceDict=None,
         "preferred": bool,
         'datasource_id':str,
     })
-    
-    
-    df_out = df_out.rename(columns={'Latitude':'lat', 'Longitude':'lng'})
-    df_out['lat'] = df_out['lat'] * 10000
-    df_out['lng'] = df_out['lng'] * 10000
-
-    columns = [
-        "actor_id",
-        "lat",
-        "lng",
-        "datasource_id"
-    ]
-
-    # how should we handle pipelines? 
-    # lat/lng are 0 for these fornow
 
-    df_territory = df_out[columns]
+    # lat/lng are 0 for pipelines
+    df_territory = pd.DataFrame({
+        'actor_id': df_out['actor_id'],
+        'lat': df_out['Latitude'] * 10000,
+        'lng': df_out['Longitude'] * 10000,
+        'datasource_id': df_out['datasource_id'],
+    })
 
     # ensure types are correct
     df_territory = df_territory.astype({
@@ -914,99 +1779,73 @@ def create_eccc_ghgrp_actor_tables(DataSourceDict=None,
         'lng': int,
         'datasource_id':str,
     })
-    
 
-    dict_out=  {'Actor': df_actor,
-           'ActorIdentifier': df_actorIdentifier, 
-           'ActorName': df_actorName,
-           'Territory': df_territory}
-    return dict_out
+    dict_out = {'Actor': df_actor,
+                'ActorIdentifier': df_actorIdentifier,
+                'ActorName': df_actorName,
+                'Territory': df_territory}
 
+    # keep the keys handed out for the next build
+    save_key_dictionaries(keys)
 
-def create_eccc_ghgrp_facilities_emissions_table(DataSourceDict=None, 
-                                                 MethodologyDict=None):
-    # get canadian provinces
-    df_subdiv = read_subdivisions()
-    filt = df_subdiv['country'] == 'CA'
-    df_provinces = df_subdiv.loc[filt]
-
-    # read facility GHGs
-    df = read_goc_facilities()
-
-
-    # merge on province names
-    df_out = pd.merge(df, df_provinces, left_on=["Province"], right_on=["name"], how="left")
-
-    # drop uneeded columns
-    df_out = df_out.drop(columns=['name'])
-
-    # sanity check, make sure all match
-    assert ~sum(df_out['subdivision'].isna())
-
-    # some facilities emissions reported as "3 234.123", whats with the white space?
-    filt = ~(df_out['Total emissions'].str.contains(' '))
-    df_out = df_out.loc[filt]
-
-    # merge on Actor table to get actor_id
-    fl = '/Users/luke/Documents/jupyterlab/OpenClimate/Actor_ECCC-GHGRP_facilities/Actor.csv'
-    df_actor = pd.read_csv(fl)
+    if 'EmissionsAgg' not in tables:
+        return {table: dict_out[table] for table in tables}
 
+    # make units are kilotonnes
+    assert all(list(df['Units'] == 'kilotonnes of carbon dioxide equivalents (kt CO2 eq)'))
 
-    # merge on province names
-    df_out = pd.merge(df_out, df_actor, 
-                      left_on=["Facility name", "Company name"], 
-                      right_on=["name", "is_owned_by"], how="left")
-
-
-    # ensure they all match
-    assert (~sum(df_out['actor_id'].isna()))
-
-    # get datasource_id from dataSource table
-    df_out['datasource_id'] = DataSourceDict['datasource_id']
-
-    df_out['methodology_id'] = MethodologyDict['methodology_id']
+    # some facilities emissions reported as "3 234.123", parse instead of dropping them
+    total_emissions, reject = parse_numeric(df['Total emissions'])
+    assert reject.sum() == 0, (
+        f"{reject.sum()} emissions could not be parsed: {list(df.loc[reject, 'Total emissions'])}"
+    )
 
-    df_out['emissions_id'] = df_out.apply(lambda row: 
-                                      f"ECCC:GHGRP:{row['Facility ID']}:{row['Report year']}", 
-                                      axis=1)
+    # convert from kilotonnes to tonnes
+    df_emissions = pd.DataFrame({
+        # emissions ids keep the ECCC:GHGRP prefix whatever the publisher id
+        'emissions_id': 'ECCC:GHGRP:' + df['Facility ID'].astype(str) + ':' + df['Report year'].astype(str),
+        'actor_id': keys['actor_id'].decode(df['actor_key']),
+        'year': df['Report year'],
+        'total_emissions': total_emissions * 1000,
+        'methodology_id': MethodologyDict['methodology_id'],
+        'datasource_id': keys['datasource_id'].decode(df['datasource_key']),
+    }, index=df.index)
 
-    df_out = df_out.rename(columns={'Report year':'year', 'Total emissions': 'total_emissions'})
+    dict_out['EmissionsAgg'] = apply_dtype_plan(df_emissions)
 
+    return {table: dict_out[table] for table in tables}
 
-    # make units are kilotonnes
-    assert all(list(df_out['Units'] == 'kilotonnes of carbon dioxide equivalents (kt CO2 eq)'))
 
-    df_out['total_emissions'] = df_out['total_emissions'].astype('float')
+def create_eccc_ghgrp_actor_tables(DataSourceDict=None, 
+                                 PublisherDict=None,
+                                 df=None):
+    ''' Actor, ActorIdentifier, ActorName and Territory, see harmonize_eccc_ghgrp()
 
-    # convert from kilotonnes to tonnes
-    df_out['total_emissions'] = df_out['total_emissions'] * 1000
+    pass df=read_goc_facilities() to share one parse with
+    create_eccc_ghgrp_facilities_emissions_table()
+    '''
+    return harmonize_eccc_ghgrp(DataSourceDict=DataSourceDict,
+                                PublisherDict=PublisherDict,
+                                df=df,
+                                tables=['Actor', 'ActorIdentifier', 'ActorName', 'Territory'])
 
 
-    columns = [
-        'emissions_id',
-        'actor_id',
-        'year',
-        'total_emissions',
-        'methodology_id',
-        'datasource_id',
-    ]
+def create_eccc_ghgrp_facilities_emissions_table(DataSourceDict=None, 
+                                                 PublisherDict=None,
+                                                 MethodologyDict=None,
+                                                 df=None):
+    ''' EmissionsAgg, see harmonize_eccc_ghgrp() and create_eccc_ghgrp_actor_tables()
 
-    # only get company information
-    df_emissions = df_out[columns]
+    pass the PublisherDict of the actor tables so actor_id points at their actors
+    '''
+    dict_out = harmonize_eccc_ghgrp(DataSourceDict=DataSourceDict,
+                                    PublisherDict=PublisherDict,
+                                    MethodologyDict=MethodologyDict,
+                                    df=df,
+                                    tables=['EmissionsAgg'])
+    return dict_out['EmissionsAgg']
 
-    df_emissions = df_emissions.astype({
-        'emissions_id': str,
-        'actor_id': str,
-        'year': int,
-        'total_emissions': int,
-        'methodology_id': str,
-        'datasource_id': str
-    })
-    
-    return df_emissions
-    
 
-    
 def create_eccc_nir_emissionsAgg(DataSourceDict=None, 
                                            PublisherDict=None):
     fl = '/Users/luke/Documents/work/data/Can_provinces/ghg-emissions-regional-en.csv'
@@ -1065,22 +1904,17 @@ def create_eccc_nir_emissionsAgg(DataSourceDict=None,
     ]
     df_out = df_out[cols]
     
-    df_out = df_out.astype({
-        'emissions_id': str,
-        'actor_id': str,
-        'year': int,
-        'total_emissions': int,
-        'methodology_id': str,
-        'datasource_id': str
-    })
+    df_out = apply_dtype_plan(df_out)
         
     return df_out
 
 
+@profiled
 def harmonize_unfccc_emissions(fl=None,
                                outputDir=None, 
                                tableName=None,
-                               datasourceDict=None):
+                               datasourceDict=None,
+                               backend=None):
     '''harmonize UNFCCC dataset
 
     haramonize UNFCCC to conform to open climate schema
@@ -1091,6 +1925,7 @@ def harmonize_unfccc_emissions(fl=None,
     outputDir: directory where table will be created
     tableName: name of the table to create
     datasourceDict: dictionary with datasource info
+    backend: pandas or polars, see resolve_backend(), duckdb runs the pandas path (excel source) [default: pandas]
 
     output
     -------
@@ -1117,8 +1952,12 @@ def harmonize_unfccc_emissions(fl=None,
     assert isinstance(tableName, str), f"tableName must be a string"
     assert isinstance(datasourceDict, dict), f"datasourceDict must be a dictionary"
     
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_unfccc_emissions')
+
     # read excel file into pandas
     df = pd.read_excel(fl, skiprows=2, na_values=True)
+    prof.stage('read', df)
     df_tmp = df.copy()
     first_row_with_all_NaN = df[df.isnull().all(axis=1) == True].index.tolist()[0]
     df = df.loc[0:first_row_with_all_NaN-1]
@@ -1136,6 +1975,15 @@ def harmonize_unfccc_emissions(fl=None,
         filt = df['Party'].isin(alt_names[correctName])
         df.loc[filt, 'Party'] = correctName
 
+    # lazy query plan, polars is only needed here
+    if resolve_backend(backend) == 'polars':
+        from utils_polars import unfccc_emissions_plan, collect_emissions_agg
+        lf = unfccc_emissions_plan(df=df, df_iso=df_iso, datasourceDict=datasourceDict)
+        df_emissionsAgg = collect_emissions_agg(lf=lf, outputDir=out_dir, tableName=tableName)
+        prof.stage('collect_write', df_emissionsAgg)
+        prof.finish()
+        return df_emissionsAgg
+
     # merge datasets (wide, each year is a column)
     df_wide = pd.merge(df, df_iso, 
                        left_on=["Party"], 
@@ -1145,12 +1993,14 @@ def harmonize_unfccc_emissions(fl=None,
     # filter out null values in English short name
     filt = df_wide['country'].notnull()
     df_wide = df_wide.loc[filt]
+    prof.stage('merge_iso', df_wide)
 
 
     # convert from wide to long dataframe (was def_merged_long)
     df_long = df_wide_to_long(df=df_wide,
                               value_name="emissions",
                               var_name="year")
+    prof.stage('melt', df_long)
     
     # rename columns 
     df = df_long.rename(columns={'iso3': 'identifier',
@@ -1171,6 +2021,7 @@ def harmonize_unfccc_emissions(fl=None,
         return val * 1000
 
     df['total_emissions'] = df['emissions'].apply(kilotonne_to_metric_ton)
+    prof.stage('apply', df)
 
     # Create EmissionsAgg table
     emissionsAggColumns = ["emissions_id", 
@@ -1182,17 +2033,17 @@ def harmonize_unfccc_emissions(fl=None,
     df_emissionsAgg = df[emissionsAggColumns]
 
     # ensure data has correct types
-    df_emissionsAgg = df_emissionsAgg.astype({'emissions_id': str,
-                                             'actor_id': str,
-                                             'year': int,
-                                             'total_emissions': int,
-                                             'datasource_id': str})
+    df_emissionsAgg = apply_dtype_plan(df_emissionsAgg)
+    prof.stage('astype', df_emissionsAgg)
 
     # sort by actor_id and year
     df_emissionsAgg = df_emissionsAgg.sort_values(by=['actor_id', 'year'])
+    prof.stage('sort', df_emissionsAgg)
 
     # convert to csv
     df_emissionsAgg.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_emissionsAgg)
+    prof.finish()
     
     return df_emissionsAgg 
 
@@ -1252,6 +2103,7 @@ def read_eccc_ghg_inventory_fl(fl=None, province=None):
 
 
 
+@profiled
 def harmonize_eccc_ghg_inventory(dataDir=None,                               
                                  outputDir=None,
                                  tableName=None,
@@ -1268,6 +2120,9 @@ def harmonize_eccc_ghg_inventory(dataDir=None,
     assert isinstance(tableName, str), f"tableName must be a string"
     assert isinstance(datasourceDict, dict), f"datasourceDict must be a dictionary"
     
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_eccc_ghg_inventory')
+
     # get list of files
     path = Path(dataDir)
     files = sorted((path.glob('EN_GHG_IPCC_*.xlsx')))
@@ -1275,6 +2130,7 @@ def harmonize_eccc_ghg_inventory(dataDir=None,
     # merge into one dataset, the provinces are being read the file name
     # 
     df_out = pd.concat([read_eccc_ghg_inventory_fl(fl=fl) for fl in files], ignore_index=True)
+    prof.stage('read_melt', df_out)
 
     # convert emissions to tonnes
     if set(df_out['units']) == {'kt CO2  eq'}:
@@ -1286,6 +2142,7 @@ def harmonize_eccc_ghg_inventory(dataDir=None,
     df_out['emissions_id'] = df_out.apply(lambda row: 
                                   f"ECCC_GHG_inventory:{row['actor_id']}:{row['year']}", 
                                   axis=1)
+    prof.stage('apply', df_out)
 
     # Create EmissionsAgg table
     emissionsAggColumns = ["emissions_id", 
@@ -1297,25 +2154,52 @@ def harmonize_eccc_ghg_inventory(dataDir=None,
     df_emissionsAgg = df_out[emissionsAggColumns]
 
     # ensure data has correct types
-    df_emissionsAgg = df_emissionsAgg.astype({'emissions_id': str,
-                                             'actor_id': str,
-                                             'year': int,
-                                             'total_emissions': int,
-                                             'datasource_id': str})
+    df_emissionsAgg = apply_dtype_plan(df_emissionsAgg)
+    prof.stage('astype', df_emissionsAgg)
 
     # sort by actor_id and year
     df_emissionsAgg = df_emissionsAgg.sort_values(by=['actor_id', 'year'])
+    prof.stage('sort', df_emissionsAgg)
 
     # convert to csv
     df_emissionsAgg.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_emissionsAgg)
+    prof.finish()
 
     return df_emissionsAgg 
 
 
+# columns of the EUCoM clean file used by the harmonizers, the rest is inferred
+# years stay float like the pd.read_csv inference, they are part of emissions_id
+EUCOM_DTYPES = {
+    'name': 'string',
+    'country': 'string',
+    'iso': 'string',
+    'entity_type': 'string',
+    'GCoM_ID': 'string',
+    'url': 'string',
+    'region': 'string',
+    'data_source': 'string',
+    'lat': 'float64',
+    'lng': 'float64',
+    'total_co2_emissions_year': 'float64',
+    'total_co2_emissions': 'float64',
+    'ghg_reduction_target_type': 'string',
+    'baseline_year': 'float64',
+    'target_year': 'float64',
+    'percent_reduction': 'float64',
+    'action_description': 'string',
+    'ghgs_included': 'string',
+}
+
+@profiled
 def harmonize_eucom_emissions(fl=None,
                                     outputDir=None, 
                                     tableName=None,
-                                    datasourceDict=None):
+                                    datasourceDict=None,
+                                    nearestRadiusKm=None):
+    ''' nearestRadiusKm: if set, cities that do not match UNLOCODE by name get
+    the nearest LOCODE in the same country within this radius (km) '''
     # set default path
     if fl is None:
         fl = '/Users/luke/Documents/work/data/EUCoM/raw/EUCovenantofMayors2022_clean_NCI_7Jun22.csv'
@@ -1331,9 +2215,13 @@ def harmonize_eucom_emissions(fl=None,
     
     # create out_dir if does not exist
     make_dir(path=out_dir)
+
+    # opt-in stage profiling
+    prof = stage_profiler(f'harmonize_eucom_{tableName}')
     
     # read EUCoM
-    df = pd.read_csv(fl)
+    df = read_csv_arrow(fl, dtype=EUCOM_DTYPES)
+    prof.stage('read', df)
 
     # drop Kosovo for now
     # only partially recognized and not recognized by UN
@@ -1346,6 +2234,7 @@ def harmonize_eucom_emissions(fl=None,
 
     #name.astype(str).map(name_dict)
     df['name_with_diacritic'] = [locodeDict[name] if locodeDict.get(name) else name for name in df['name']]
+    prof.stage('diacritics', df)
 
     # filter where total emissions NaN
     filt = ~df['total_co2_emissions'].isna()
@@ -1400,6 +2289,10 @@ def harmonize_eucom_emissions(fl=None,
     assert sum(df_with_iso.iso3.isna()) == 0, (
         f"{sum(df_with_iso.iso3.isna())} ISO codes did not match in EUCoM"
     )
+    prof.stage('merge_iso', df_with_iso)
+
+    # keep track of rows through the name matches
+    df_with_iso['row_id'] = range(len(df_with_iso))
 
     # read UNLOCODE, name includes diacritics
     fl = 'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-UNLOCODE/main/UNLOCODE/Actor.csv'
@@ -1408,6 +2301,13 @@ def harmonize_eucom_emissions(fl=None,
     # split UNLOCODE to get ISO2 code
     df_unl['iso2'] = [val.split(' ')[0] for val in df_unl['actor_id']]
 
+    # merge and drop duplicates on an int32 actor_key instead of the string actor_id,
+    # utils_keys imports utils so it is only imported here
+    from utils_keys import load_key_dictionaries, save_key_dictionaries, decode_keys, sort_order
+    keys = load_key_dictionaries()
+    df_unl['actor_key'] = keys['actor_id'].encode(df_unl['actor_id'])
+    df_unl = df_unl.drop(columns=['actor_id'])
+
     # convert to uppercase
     df_unl['name_title_case'] = df_unl['name'].str.title()
 
@@ -1428,16 +2328,27 @@ def harmonize_eucom_emissions(fl=None,
                        how="left")
 
     # remove nan actors
-    df_wide = df_wide.loc[~df_wide['actor_id'].isna()]
-    df_wide2 = df_wide2.loc[~df_wide2['actor_id'].isna()]
+    df_wide = df_wide.loc[~df_wide['actor_key'].isna()]
+    df_wide2 = df_wide2.loc[~df_wide2['actor_key'].isna()]
 
     # concatenate the two datasets into one
     df_out = pd.concat([df_wide, df_wide2], ignore_index=False)
+    df_out['actor_key'] = df_out['actor_key'].astype('int32')
 
     # drop duplicates on actor_id
     df_merged = df_out.drop_duplicates(
-        subset = ['actor_id'],
+        subset = ['actor_key'],
         keep = 'first').reset_index(drop = True)
+    prof.stage('merge_unlocode', df_merged)
+
+    # coordinate fallback for cities without a name match
+    if nearestRadiusKm is not None:
+        df_merged = match_unlocode_by_coordinates(df_with_iso=df_with_iso, 
+                                                  df_merged=df_merged, 
+                                                  df_name_matches=df_out,
+                                                  radiusKm=nearestRadiusKm,
+                                                  keys=keys)
+        prof.stage('match_coordinates', df_merged)
 
     # rename some columns
     df = df_merged.rename(columns={
@@ -1480,11 +2391,17 @@ def harmonize_eucom_emissions(fl=None,
     
 
     # create id columns
-    df['datasource_id'] = datasourceDict['datasource_id']
+    df['datasource_key'] = keys['datasource_id'].encode([datasourceDict['datasource_id']])[0]
 
+    # sort by actor_id and year, on the rank of actor_key
+    order = sort_order(df, by=['actor_id', 'year'], keys=keys)
+
+    # decode the keys, only the written table needs the string ids
+    df = decode_keys(df, keys)
     df['emissions_id'] = df.apply(lambda row: 
                               f"DDL-EUCoM:{row['actor_id']}:{row['year']}", 
                               axis=1)
+    prof.stage('apply', df)
     
     # create emissions_id columns
     #df['emissions_id'] = df.apply(lambda row: 
@@ -1501,22 +2418,21 @@ def harmonize_eucom_emissions(fl=None,
         "datasource_id"
     ]
 
-    df_emissionsAgg = df[emissionsAggColumns]
+    # sort by actor_id and year
+    df_emissionsAgg = df[emissionsAggColumns].iloc[order]
+    prof.stage('sort', df_emissionsAgg)
 
     # ensure type
-    df_emissionsAgg = df_emissionsAgg.astype({
-        'emissions_id': str,
-        'actor_id': str,
-        'year': int,
-        'total_emissions': int,
-        'datasource_id': str
-    })
-
-    # sort by actor_id and year
-    df_emissionsAgg = df_emissionsAgg.sort_values(by=['actor_id', 'year'])
+    df_emissionsAgg = apply_dtype_plan(df_emissionsAgg)
+    prof.stage('astype', df_emissionsAgg)
 
     # convert to csv
     df_emissionsAgg.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_emissionsAgg)
+    prof.finish()
+
+    # keep the keys handed out for the next build
+    save_key_dictionaries(keys)
 
     return df
 
@@ -1599,10 +2515,13 @@ def match_locode_to_climactor():
     
 
     
+@profiled
 def harmonize_epa_state_ghg(dataDir=None,                               
                                  outputDir=None,
                                  tableName=None,
-                                 datasourceDict=None):
+                                 datasourceDict=None,
+                                 backend=None):
+    ''' backend: pandas, polars or duckdb, see resolve_backend() [default: pandas] '''
 
     # output directory
     out_dir = Path(outputDir).as_posix()
@@ -1619,14 +2538,32 @@ def harmonize_epa_state_ghg(dataDir=None,
     assert isinstance(tableName, str), f"tableName must be a string"
     assert isinstance(datasourceDict, dict), f"datasourceDict must be a dictionary"
     
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_epa_state_ghg')
+
     path = Path(dataDir)
     files = sorted((path.glob('*.csv')))
 
-    df_sub = pd.read_csv('https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-2/Actor.csv')
-    df_sub = df_sub[['actor_id','is_part_of','name']]
-    filt = (df_sub['is_part_of'] == 'US')
-    df_sub = df_sub.loc[filt]
-    df_sub['name'] = df_sub['name'].str.title()
+    # one query over the state files and the us_states reference view, DuckDB is only needed here
+    if resolve_backend(backend) == 'duckdb':
+        from utils_sql import connect, epa_state_ghg_sql, collect_emissions_agg
+        con = connect(references=['us_states'])
+        query = epa_state_ghg_sql(con=con, files=files, datasourceDict=datasourceDict)
+        df_emissionsAgg = collect_emissions_agg(con=con, query=query, outputDir=out_dir, tableName=tableName)
+        prof.stage('query_write', df_emissionsAgg)
+        prof.finish()
+        return df_emissionsAgg
+
+    df_sub = read_us_states()
+
+    # lazy query plan, polars is only needed here
+    if resolve_backend(backend) == 'polars':
+        from utils_polars import epa_state_ghg_plan, collect_emissions_agg
+        lf = epa_state_ghg_plan(files=files, df_sub=df_sub, datasourceDict=datasourceDict)
+        df_emissionsAgg = collect_emissions_agg(lf=lf, outputDir=out_dir, tableName=tableName)
+        prof.stage('collect_write', df_emissionsAgg)
+        prof.finish()
+        return df_emissionsAgg
 
     def read_each_file(fl):
         df = pd.read_csv(fl)
@@ -1645,6 +2582,7 @@ def harmonize_epa_state_ghg(dataDir=None,
 
     # concatenate the files
     df_concat = pd.concat([read_each_file(fl=fl) for fl in files], ignore_index=True)
+    prof.stage('read_melt', df_concat)
     
     # convert to metric tonnes
     df_concat['total_emissions'] = df_concat.apply(lambda row: 
@@ -1656,12 +2594,14 @@ def harmonize_epa_state_ghg(dataDir=None,
                                left_on=["state"], 
                                right_on=["name"], 
                                how="left")
+    prof.stage('merge_iso', df_out)
     
     # create datasource and emissions id
     df_out['datasource_id'] = datasourceDict['datasource_id']
     df_out['emissions_id'] = df_out.apply(lambda row: 
                                           f"EPA_state_GHG_inventory:{row['actor_id']}:{row['year']}", 
                                           axis=1)
+    prof.stage('apply', df_out)
     
     
     # Create EmissionsAgg table
@@ -1674,25 +2614,29 @@ def harmonize_epa_state_ghg(dataDir=None,
     df_emissionsAgg = df_out[emissionsAggColumns]
 
     # ensure data has correct types
-    df_emissionsAgg = df_emissionsAgg.astype({'emissions_id': str,
-                                             'actor_id': str,
-                                             'year': int,
-                                             'total_emissions': int,
-                                             'datasource_id': str})
+    df_emissionsAgg = apply_dtype_plan(df_emissionsAgg)
+    prof.stage('astype', df_emissionsAgg)
 
     # sort by actor_id and year
     df_emissionsAgg = df_emissionsAgg.sort_values(by=['actor_id', 'year'])
+    prof.stage('sort', df_emissionsAgg)
 
     # convert to csv
     df_emissionsAgg.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_emissionsAgg)
+    prof.finish()
     
     return df_emissionsAgg
 
 
+@profiled
 def harmonize_eucom_pledges(fl=None,
                             outputDir=None, 
                             tableName=None,
-                            datasourceDict=None):
+                            datasourceDict=None,
+                            nearestRadiusKm=None):
+    ''' nearestRadiusKm: if set, cities that do not match UNLOCODE by name get
+    the nearest LOCODE in the same country within this radius (km) '''
     # set default path
     if fl is None:
         fl = '/Users/luke/Documents/work/data/EUCoM/raw/EUCovenantofMayors2022_clean_NCI_7Jun22.csv'
@@ -1708,9 +2652,13 @@ def harmonize_eucom_pledges(fl=None,
     
     # create out_dir if does not exist
     make_dir(path=out_dir)
+
+    # opt-in stage profiling
+    prof = stage_profiler(f'harmonize_eucom_{tableName}')
     
     # read EUCoM
-    df = pd.read_csv(fl)
+    df = read_csv_arrow(fl, dtype=EUCOM_DTYPES)
+    prof.stage('read', df)
 
     # drop Kosovo for now
     # only partially recognized and not recognized by UN
@@ -1723,6 +2671,7 @@ def harmonize_eucom_pledges(fl=None,
 
     #name.astype(str).map(name_dict)
     df['name_with_diacritic'] = [locodeDict[name] if locodeDict.get(name) else name for name in df['name']]
+    prof.stage('diacritics', df)
 
     # filter where total emissions NaN
     filt = ~df['total_co2_emissions'].isna()
@@ -1741,11 +2690,12 @@ def harmonize_eucom_pledges(fl=None,
         'url',
         'action_description',
         'data_source',
-        'country',
         'iso',
         'entity_type',
         'GCoM_ID',
         'ghgs_included', 
+        'lat',
+        'lng',
     ]
     df = df[columns]
 
@@ -1792,6 +2742,10 @@ def harmonize_eucom_pledges(fl=None,
     assert sum(df_with_iso.iso3.isna()) == 0, (
         f"{sum(df_with_iso.iso3.isna())} ISO codes did not match in EUCoM"
     )
+    prof.stage('merge_iso', df_with_iso)
+
+    # keep track of rows through the name matches
+    df_with_iso['row_id'] = range(len(df_with_iso))
 
     # read UNLOCODE, name includes diacritics
     fl = 'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-UNLOCODE/main/UNLOCODE/Actor.csv'
@@ -1800,6 +2754,13 @@ def harmonize_eucom_pledges(fl=None,
     # split UNLOCODE to get ISO2 code
     df_unl['iso2'] = [val.split(' ')[0] for val in df_unl['actor_id']]
 
+    # merge and drop duplicates on an int32 actor_key instead of the string actor_id,
+    # utils_keys imports utils so it is only imported here
+    from utils_keys import load_key_dictionaries, save_key_dictionaries, decode_keys, sort_order
+    keys = load_key_dictionaries()
+    df_unl['actor_key'] = keys['actor_id'].encode(df_unl['actor_id'])
+    df_unl = df_unl.drop(columns=['actor_id'])
+
     # convert to uppercase
     df_unl['name_title_case'] = df_unl['name'].str.title()
 
@@ -1820,16 +2781,27 @@ def harmonize_eucom_pledges(fl=None,
                        how="left")
 
     # remove nan actors
-    df_wide = df_wide.loc[~df_wide['actor_id'].isna()]
-    df_wide2 = df_wide2.loc[~df_wide2['actor_id'].isna()]
+    df_wide = df_wide.loc[~df_wide['actor_key'].isna()]
+    df_wide2 = df_wide2.loc[~df_wide2['actor_key'].isna()]
 
     # concatenate the two datasets into one
     df_out = pd.concat([df_wide, df_wide2], ignore_index=False)
+    df_out['actor_key'] = df_out['actor_key'].astype('int32')
 
     # drop duplicates on actor_id
     df_merged = df_out.drop_duplicates(
-        subset = ['actor_id'],
+        subset = ['actor_key'],
         keep = 'first').reset_index(drop = True)
+    prof.stage('merge_unlocode', df_merged)
+
+    # coordinate fallback for cities without a name match
+    if nearestRadiusKm is not None:
+        df_merged = match_unlocode_by_coordinates(df_with_iso=df_with_iso, 
+                                                  df_merged=df_merged, 
+                                                  df_name_matches=df_out,
+                                                  radiusKm=nearestRadiusKm,
+                                                  keys=keys)
+        prof.stage('match_coordinates', df_merged)
 
 
     # target_id  actor_id target_type baseline_year target_year target_value target_unit URL
@@ -1872,13 +2844,19 @@ def harmonize_eucom_pledges(fl=None,
     #df['datasource_id'] = df['data_source'].map(datasource_id_dict)
 
     # create id columns
-    df['datasource_id'] = datasourceDict['datasource_id']
-    
+    df['datasource_key'] = keys['datasource_id'].encode([datasourceDict['datasource_id']])[0]
+
+    # sort by actor_id and baseline_year, on the rank of actor_key
+    order = sort_order(df, by=['actor_id', 'baseline_year'], keys=keys)
+
+    # decode the keys, only the written table needs the string ids
+    df = decode_keys(df, keys)
     
     # create emissions_id columns
     df['target_id'] = df.apply(lambda row: 
                                   f"DDL-EUCoM:EUCoM_pledge:{row['actor_id']}",
                                   axis=1)
+    prof.stage('apply', df)
 
 
     df['target_unit'] = 'percent'
@@ -1896,7 +2874,9 @@ def harmonize_eucom_pledges(fl=None,
         "datasource_id"
     ]
 
-    df_target = df[targetColumns]
+    # sort by actor_id and baseline_year, the filters below keep this order
+    df_target = df[targetColumns].iloc[order]
+    prof.stage('sort', df_target)
 
     # drop nans in target_type
     # have to do this before change type to str
@@ -1904,17 +2884,8 @@ def harmonize_eucom_pledges(fl=None,
     df_target = df_target.loc[filt]
         
     # ensure type
-    df_target = df_target.astype({
-        "target_id": str,
-        "actor_id": str,
-        "target_type": str,
-        "baseline_year": int,
-        "target_year": int,
-        "target_value": int,
-        'target_unit': str,
-        "URL": str,
-        "datasource_id": str
-    })
+    df_target = apply_dtype_plan(df_target)
+    prof.stage('astype', df_target)
 
     # fill missing URL with 
     filt = df_target['URL'] == 'nan'
@@ -1925,12 +2896,14 @@ def harmonize_eucom_pledges(fl=None,
     # ZHI YI: these records mostly came from JRC, no mention of being "per capita"
     filt = df_target["target_type"] != 'Intensity target'
     df_target = df_target.loc[filt]
-        
-    # sort by actor_id and year
-    df_target = df_target.sort_values(by=['actor_id', 'baseline_year'])
 
     # convert to csv
     df_target.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+    prof.stage('write', df_target)
+    prof.finish()
+
+    # keep the keys handed out for the next build
+    save_key_dictionaries(keys)
 
     return df
 
@@ -2043,17 +3016,7 @@ def harmonize_us_climate_alliance_pledge(outputDir=None,
     df_out = df[columns]
 
     # ensure type is correct
-    df_out = df_out.astype({
-        "target_id": str,
-        "actor_id": str,
-        "target_type": str,
-        "baseline_year": int,
-        "target_year": int,
-        "target_value": int,
-        'target_unit': str,
-        "URL": str,
-        "datasource_id": str
-    })
+    df_out = apply_dtype_plan(df_out)
 
     # sort by actor_id and target_year
     df_out = df_out.sort_values(by=['actor_id', 'target_year'])
@@ -2063,14 +3026,36 @@ def harmonize_us_climate_alliance_pledge(outputDir=None,
 
     
     
-def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None):
+# CDP full states and regions dataset, answers of every question are strings
+CDP_STATES_REGIONS_DTYPES = {
+    'Parent Section': 'string',
+    'Section': 'string',
+    'Organization Name': 'string',
+    'Country': 'string',
+    'Column Name': 'string',
+    'Row Number': 'int64',
+    'Response Answer': 'string',
+}
+
+def select_cdp_emissions_inventory(df=None):
+    ''' answers in the Assessment / 2. Emissions Inventory section '''
+    filt = (df['Parent Section'] == 'Assessment') & (df['Section'] == '2. Emissions Inventory')
+    return df.loc[filt]
+
+@profiled
+def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None, memoryBudget=None):
     # load raw data
     #fl = '/Users/luke/Documents/work/data/CDP/2022/2022_Full_States_and_Regions_Dataset.csv'
-    df = pd.read_csv(fl)
 
-    # select Assessment
-    filt = (df['Parent Section'] == 'Assessment') & (df['Section'] == '2. Emissions Inventory')
-    df = df.loc[filt]
+    # opt-in stage profiling
+    prof = stage_profiler('harmonize_cdp2022_states_regions')
+
+    # select Assessment, in partitions if the file does not fit in memoryBudget
+    df = read_csv_budgeted(fl,
+                           dtype=CDP_STATES_REGIONS_DTYPES,
+                           transform=select_cdp_emissions_inventory,
+                           memoryBudget=memoryBudget)
+    prof.stage('read_filter', df)
 
     # list to concatenate to
     concat_list = []
@@ -2211,20 +3196,16 @@ def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None):
         
     # concat them all together
     df_out = pd.concat(concat_list, ignore_index=True)
+    prof.stage('pivot', df_out)
 
-    # filter out NaN, "question not application", and <0
-    filt = (
-        (~df_out['Emissions (metric tonnes CO2e)'].isna()) & 
-        (df_out['Emissions (metric tonnes CO2e)'] != 'Question not applicable') 
-    )
-    df_filt = df_out.loc[filt]
+    # make emissions be float, "Question not applicable" becomes NaN
+    emissions, reject = parse_numeric(df_out['Emissions (metric tonnes CO2e)'])
+    assert reject.sum() == 0, f"{reject.sum()} emissions could not be parsed"
+    df_out['Emissions (metric tonnes CO2e)'] = emissions
 
-    # filter out where emissions < 0
-    filt = (df_filt['Emissions (metric tonnes CO2e)'].astype(float) > 0)
-    df_filt = df_filt.loc[filt]
-
-    # make emissions be float
-    df_filt['Emissions (metric tonnes CO2e)'] = df_filt['Emissions (metric tonnes CO2e)'].astype(float)
+    # filter out NaN and <0
+    filt = (df_out['Emissions (metric tonnes CO2e)'] > 0)
+    df_filt = df_out.loc[filt]
 
     # aggregate emissions
     df_agg = df_filt.groupby(by=['subnational'], as_index=False)['Emissions (metric tonnes CO2e)'].sum()
@@ -2234,6 +3215,7 @@ def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None):
          left_on='subnational', 
          right_on='subnational', 
          how='left')
+    prof.stage('aggregate', df_agg)
     
     # drop records with years such as 2018/2019
     #filt = ~df_agg['year'].str.contains('/')
@@ -2263,6 +3245,7 @@ def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None):
 
     # final table
     df_final = pd.merge(df_agg, df_sub, left_on=["subnational_harmonized"], right_on=["name_harmonized"], how="left")
+    prof.stage('merge_iso', df_final)
 
     # remove nan actor ids
     df_final = df_final.loc[~df_final['actor_id'].isna()]
@@ -2279,21 +3262,17 @@ def harmonize_cdp2022_states_regions(fl=None, datasourceDict=None):
     df_final['emissions_id'] = df_final.apply(lambda row: 
                                   f"CD_Full_states_regions:2022:{row['actor_id']}:{row['year']}", 
                                   axis=1)
-
-    # ensure data has correct types
-    df_final = df_final.astype(
-        {
-        'emissions_id': str,
-        'actor_id': str,
-        'year': int,
-        'total_emissions': int,
-        'datasource_id': str
-        }
-    )
+    prof.stage('apply', df_final)
 
     df_final = df_final[['emissions_id', 'actor_id', 'year', 'total_emissions', 'datasource_id']]
 
+    # ensure data has correct types
+    df_final = apply_dtype_plan(df_final)
+    prof.stage('astype', df_final)
+
     # sort by actor_id and year
     df_final = df_final.sort_values(by=['actor_id', 'year'])
+    prof.stage('sort', df_final)
+    prof.finish()
     
     return df_final
\ No newline at end of file
@@ -1,6 +1,8 @@
 import geopandas as gpd
 import pandas as pd
 import csv
+from utils_geometry import write_geometries
+from utils_geometry import fill_territory_from_geometry
 #from utils import read_iso_codes
 
 def read_iso_codes(fl=None):
@@ -30,14 +32,57 @@ def read_iso_codes(fl=None):
     return df
 
 
-def convert_countries_shp_to_geojson():
-    """ data downloaded from natural earth 
+# Natural Earth countries, the shapefile is only read to build the cache
+NATURAL_EARTH_COUNTRIES_SHP = '/Users/gloege/Desktop/data/ne_50m_admin_0_countries.shp'
+NATURAL_EARTH_COUNTRIES_CACHE = '/Users/gloege/Projects/OpenClimate/ne_50m_admin_0_countries.parquet'
+
+
+def cache_countries_geoparquet(fl=None, outputFile=None):
+    """ cache natural earth countries as GeoParquet
     https://www.naturalearthdata.com/downloads/50m-cultural-vectors/
+
+    rows are sorted by ISO_A2 in small row groups and each row has a bbox
+    covering column, so read_countries() only reads the row groups of the
+    countries or bounding box it asks for
     """
-    # converted to geojson
-    fl = '/Users/gloege/Desktop/data/ne_50m_admin_0_countries.shp'
+    fl = NATURAL_EARTH_COUNTRIES_SHP if fl is None else fl
+    outputFile = NATURAL_EARTH_COUNTRIES_CACHE if outputFile is None else outputFile
+
     df_countries = gpd.read_file(fl)
-    df_countries.to_file('/Users/gloege/Projects/OpenClimate/ne_50m_admin_0_countries.geojson', driver='GeoJSON')
+
+    # france is -99
+    df_countries.loc[df_countries['NAME']=="France",'ISO_A2'] = 'FR'
+
+    # norway is -99
+    df_countries.loc[df_countries['NAME']=="Norway",'ISO_A2'] = 'NO'
+
+    df_countries = df_countries.sort_values(by=['ISO_A2']).reset_index(drop=True)
+    df_countries.to_parquet(outputFile, index=False, write_covering_bbox=True, row_group_size=16)
+
+
+def read_countries(fl=None, columns=None, countries=None, bbox=None):
+    """ read natural earth countries from the GeoParquet cache
+
+    input
+    -----
+    fl: cache written by cache_countries_geoparquet()
+    columns: attribute columns to read [default: ['NAME', 'ISO_A2']]
+    countries: optional list of ISO_A2 codes
+    bbox: optional (minx, miny, maxx, maxy), only reads intersecting row groups
+
+    output
+    ------
+    df: GeoDataFrame with the columns and an admin_bound geometry column
+    """
+    fl = NATURAL_EARTH_COUNTRIES_CACHE if fl is None else fl
+    columns = ['NAME', 'ISO_A2'] if columns is None else columns
+
+    filters = None if countries is None else [('ISO_A2', 'in', list(countries))]
+
+    df_geo = gpd.read_parquet(fl, columns=columns + ['geometry'], filters=filters, bbox=bbox)
+    df_geo = df_geo.rename_geometry('admin_bound')
+
+    return df_geo
     
     
 # methodology for UN pop: https://population.un.org/wpp/publications/Files/WPP2022_Methodology.pdf
@@ -169,27 +214,11 @@ def read_capital_cities():
 
 
 
-def read_countries_geojson():
-    # load geojson
-    df_countries = gpd.read_file('/Users/gloege/Projects/OpenClimate/ne_50m_admin_0_countries.geojson')
-    columns = ['NAME', 'ISO_A2', 'geometry']
-    df_geo = df_countries[columns]
-    df_geo = df_geo.rename(columns={'geometry':'admin_bound'})
-
-    # france is -99
-    df_geo.loc[df_geo['NAME']=="France",'ISO_A2'] = 'FR'
-
-    # norway is -99
-    df_geo.loc[df_geo['NAME']=="Norway",'ISO_A2'] = 'NO'
-    
-    return df_geo
-
-
 def create_territory_table():
     # read in the data
     df_area = filter_area_data()
     df_cap = read_capital_cities()
-    df_geo = read_countries_geojson()
+    df_geo = read_countries(countries=df_area['actor_id'])
 
     # merge the datasets along iso-2 codes
     df_out = (
@@ -220,17 +249,13 @@ def create_territory_table():
 
     #df_out.head()
 
-    # fill lat lon for missing countries
-    #filt = df_out['lat'].isna(); df_out.loc[filt]
-    # MO : 22.210928, 113.552971 (https://www.latlong.net/place/macao-china-656.html)
-    # NA : -22.560881,17.065755. (https://www.countrycoordinate.com/city-windhoek-namibia/)
-    # PS : 31.898043, 35.204269. (https://www.latlong.net/place/ramallah-palestine-13002.html)
-
-    df_out.loc[df_out['actor_id'] == 'MO', ['lat','lng']] = [22.210928 * 10000, 113.552971 * 10000]
-
-    df_out.loc[df_out['actor_id'] == 'NA', ['lat','lng']] = [-22.560881 * 10000, 17.065755 * 10000]
+    # fill lat lon (and area) for missing countries from their boundary
+    # e.g. MO, NA and PS have no capital in the cities dataset
+    df_out = fill_territory_from_geometry(df=df_out, column='admin_bound')
 
-    df_out.loc[df_out['actor_id'] == 'PS', ['lat','lng']] = [31.898043 * 10000, 35.204269 * 10000]
+    # boundaries go to GeoParquet with simplified levels, not into the csv
+    write_geometries(df=df_out, outputDir='.', column='admin_bound')
+    df_out = df_out.drop(columns=['admin_bound'])
 
     # ensure data has correct types
     df_out = df_out.astype({
@@ -238,7 +263,6 @@ def create_territory_table():
         'area': int,
         'lat': int,
         'lng': int,
-        'admin_bound': str,
         'datasource_id': str
     })
 
@@ -278,7 +302,7 @@ def main_population():
     create_un_population_table()
     
     
-def main_territory()
+def main_territory():
     publisherDict = {
         'id': 'world_bank',
         'name': 'World Bank Open Data',
@@ -0,0 +1,208 @@
+import warnings
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from utils import make_dir
+from utils_keys import load_key_dictionaries
+from utils_keys import remap_keys
+from utils_store import read_emissions_tables
+
+# how records for the same (actor_id, year, datasource_id) are combined
+DUPLICATE_POLICIES = ['raise', 'sum', 'mean', 'max', 'last']
+
+
+def build_emissions_cube(dataDir=None, cubeDir=None, df=None, keysDir=None, duplicates=None):
+    ''' dense actor x year x source emissions cube
+
+    every EmissionsAgg table is pivoted into one float64 array
+    cube[actor, year, source] with NaN where a source has no value.
+    years are contiguous from the first to the last year reported.
+
+    input
+    -----
+    dataDir: root of the emissions tree [default: ./data_emissions]
+    cubeDir: where the arrays are written [default: ./store/cube]
+    df: emissions dataframe to use instead of reading dataDir
+    keysDir: key dictionaries, see utils_keys [default: KEYS_DIR]
+    duplicates: raise, or how to combine records of the same actor, year and
+                source (sum, mean, max, last in df order) [default: raise]
+
+    output
+    ------
+    {cubeDir}/cube.npy         float64 array (n_actors, n_years, n_sources)
+    {cubeDir}/actors.npy       actor_id of each row
+    {cubeDir}/actor_keys.npy   int32 actor_key of each row, stable across builds
+    {cubeDir}/years.npy        year of each column
+    {cubeDir}/sources.npy      datasource_id of each slice
+    {cubeDir}/source_keys.npy  int32 datasource_key of each slice
+    '''
+    cubeDir = './store/cube' if cubeDir is None else cubeDir
+    duplicates = 'raise' if duplicates is None else duplicates
+
+    assert isinstance(cubeDir, str), f"cubeDir must be a string"
+    assert duplicates in DUPLICATE_POLICIES, f"duplicates must be one of {DUPLICATE_POLICIES}"
+
+    if df is None:
+        df = read_emissions_tables(dataDir=dataDir)['EmissionsAgg']
+
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+
+    # create out_dir if does not exist
+    out_dir = Path(cubeDir).as_posix()
+    make_dir(path=out_dir)
+
+    # integer position of every record along each axis, factorized on the int32 keys
+    keys = load_key_dictionaries(keysDir=keysDir)
+    actor_codes, actor_keys = keys['actor_id'].factorize(keys['actor_id'].encode(df['actor_id'].astype(str)))
+    source_codes, source_keys = keys['datasource_id'].factorize(keys['datasource_id'].encode(df['datasource_id'].astype(str)))
+    actors = keys['actor_id'].decode(actor_keys)
+    sources = keys['datasource_id'].decode(source_keys)
+
+    year = df['year'].to_numpy().astype(int)
+    first_year = year.min()
+    years = np.arange(first_year, year.max() + 1, dtype='int16')
+    year_codes = year - first_year
+
+    shape = (len(actors), len(years), len(sources))
+    values = df['total_emissions'].to_numpy(dtype='float64', na_value=np.nan)
+
+    # a cell written twice would silently keep one of the values
+    cell = np.ravel_multi_index((actor_codes, year_codes, source_codes), shape)
+    repeated = pd.Series(cell).duplicated(keep=False).to_numpy()
+    if repeated.any():
+        first = df.loc[repeated, ['actor_id', 'year', 'datasource_id']].iloc[0].tolist()
+        assert duplicates != 'raise', \
+            (f"{repeated.sum()} records share an (actor_id, year, datasource_id), e.g. {first}, "
+             f"pass duplicates= one of {DUPLICATE_POLICIES[1:]} to combine them")
+        combined = pd.Series(values).groupby(cell, sort=False).agg(duplicates)
+        cell, values = combined.index.to_numpy(), combined.to_numpy()
+        actor_codes, year_codes, source_codes = np.unravel_index(cell, shape)
+
+    # scatter values into the dense cube
+    cube = np.lib.format.open_memmap(f'{out_dir}/cube.npy', mode='w+', dtype='float64', shape=shape)
+    cube[:] = np.nan
+    cube[actor_codes, year_codes, source_codes] = values
+    cube.flush()
+
+    # save the dictionaries before writing keys, a build running at the same time may move new keys
+    remaps = {column: dictionary.save() for column, dictionary in keys.items()}
+    actor_keys = remap_keys(actor_keys, remaps['actor_id'])
+    source_keys = remap_keys(source_keys, remaps['datasource_id'])
+
+    np.save(f'{out_dir}/actors.npy', np.asarray(actors, dtype=str))
+    np.save(f'{out_dir}/actor_keys.npy', actor_keys)
+    np.save(f'{out_dir}/years.npy', years)
+    np.save(f'{out_dir}/sources.npy', np.asarray(sources, dtype=str))
+    np.save(f'{out_dir}/source_keys.npy', source_keys)
+
+    return load_emissions_cube(cubeDir=cubeDir)
+
+
+def load_emissions_cube(cubeDir=None):
+    ''' memory-map the cube written by build_emissions_cube()
+
+    nothing is read until it is used, so loading is zero-copy
+
+    output
+    ------
+    dictionary {'cube': array, 'actors': array, 'actor_keys': array,
+                'years': array, 'sources': array, 'source_keys': array}
+    '''
+    cubeDir = './store/cube' if cubeDir is None else cubeDir
+
+    assert isinstance(cubeDir, str), f"cubeDir must be a string"
+
+    out_dir = Path(cubeDir).as_posix()
+
+    return {
+        'cube': np.load(f'{out_dir}/cube.npy', mmap_mode='r'),
+        'actors': np.load(f'{out_dir}/actors.npy', mmap_mode='r'),
+        'actor_keys': np.load(f'{out_dir}/actor_keys.npy', mmap_mode='r'),
+        'years': np.load(f'{out_dir}/years.npy', mmap_mode='r'),
+        'sources': np.load(f'{out_dir}/sources.npy', mmap_mode='r'),
+        'source_keys': np.load(f'{out_dir}/source_keys.npy', mmap_mode='r'),
+    }
+
+
+def cube_actor(cube=None, actor_id=None):
+    ''' years x sources matrix for one actor, as a dataframe '''
+    actors = cube['actors']
+    i = np.searchsorted(actors, actor_id)
+
+    assert i < len(actors) and actors[i] == actor_id, f"{actor_id} not in cube"
+
+    return pd.DataFrame(cube['cube'][i],
+                        index=pd.Index(cube['years'], name='year'),
+                        columns=pd.Index(cube['sources'], name='datasource_id'))
+
+
+def cube_gaps(values=None):
+    ''' missing years between the first and last reported year
+
+    input
+    -----
+    values: array (..., n_years, n_sources), e.g. cube['cube']
+
+    output
+    ------
+    boolean array, same shape, True where a value is missing
+    inside the reported period of that actor and source
+    '''
+    present = ~np.isnan(values)
+
+    # reported at or before / at or after each year
+    started = np.logical_or.accumulate(present, axis=-2)
+    not_ended = np.flip(np.logical_or.accumulate(np.flip(present, axis=-2), axis=-2), axis=-2)
+
+    return started & not_ended & ~present
+
+
+def cube_source_spread(values=None):
+    ''' relative disagreement between sources for each actor and year
+
+    (max - min) / mean over the sources, NaN where fewer than two sources report
+
+    input
+    -----
+    values: array (..., n_years, n_sources), e.g. cube['cube']
+    '''
+    n_sources = np.sum(~np.isnan(values), axis=-1)
+
+    with warnings.catch_warnings():
+        # all-NaN slices are expected
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        spread = (np.nanmax(values, axis=-1) - np.nanmin(values, axis=-1)) / np.nanmean(values, axis=-1)
+
+    return np.where(n_sources >= 2, spread, np.nan)
+
+
+def cube_trend(values=None, years=None):
+    ''' least-squares slope (tonnes per year) for each actor and source
+
+    missing years are ignored, NaN where fewer than two years are reported
+
+    input
+    -----
+    values: array (n_actors, n_years, n_sources), e.g. cube['cube']
+    years: array (n_years), e.g. cube['years']
+
+    output
+    ------
+    array (n_actors, n_sources)
+    '''
+    present = ~np.isnan(values)
+    x = np.asarray(years, dtype='float64')[None, :, None]
+
+    n = present.sum(axis=1)
+    y = np.where(present, values, 0.0)
+    x = np.where(present, x, 0.0)
+
+    sum_x = x.sum(axis=1)
+    sum_y = y.sum(axis=1)
+    sum_xy = (x * y).sum(axis=1)
+    sum_xx = (x * x).sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = (n * sum_xy - sum_x * sum_y) / (n * sum_xx - sum_x**2)
+
+    return np.where(n >= 2, slope, np.nan)
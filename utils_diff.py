@@ -0,0 +1,169 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from utils import make_dir
+from utils_validate import TABLE_PRIMARY_KEYS
+
+# text of a missing value, None, NaN and <NA> hash the same
+MISSING_TEXT = '\x00NA'
+
+
+def hash_text(column=None):
+    ''' column as text for hashing
+
+    numbers are written as float64 so 1 (int64, Int64) and 1.0 (float64)
+    give the same text, integers above 2**53 can collide
+    '''
+    missing = column.isna().to_numpy()
+
+    if pd.api.types.is_numeric_dtype(column.dtype) and not pd.api.types.is_bool_dtype(column.dtype):
+        text = pd.Series(column.to_numpy(dtype='float64', na_value=np.nan), index=column.index).astype(str)
+    else:
+        text = column.astype(str)
+
+    return text.where(~missing, MISSING_TEXT)
+
+
+def hash_rows(df=None, columns=None):
+    ''' 64-bit hash of each row over the given columns
+
+    values are hashed as text (see hash_text) so that int, Int64 and
+    float columns read from different versions hash the same
+    '''
+    df_text = pd.DataFrame({column: hash_text(df[column]) for column in columns}, index=df.index)
+    return pd.util.hash_pandas_object(df_text, index=False).to_numpy()
+
+
+def diff_tables(df_old=None, df_new=None, tableName=None, key=None, ignore=None):
+    ''' inserted, updated and deleted rows between two versions of a table
+
+    rows are matched by a hash of their primary key and compared by a
+    hash of their content, so the cost is linear in the number of rows
+
+    input
+    -----
+    df_old: previous version of the table
+    df_new: new version of the table
+    tableName: schema table name, used for the default key (see TABLE_PRIMARY_KEYS)
+    key: list of primary key columns
+    ignore: columns left out of the key and the comparison,
+            e.g. ['datasource_id'] when the datasource is versioned
+
+    output
+    ------
+    dictionary with DataFrames
+        inserted: rows of df_new whose key is not in df_old
+        updated: rows of df_new whose key is in df_old with different content
+        deleted: key columns of rows of df_old whose key is not in df_new
+    '''
+    ignore = [] if ignore is None else ignore
+    if key is None:
+        assert tableName in TABLE_PRIMARY_KEYS, f"{tableName} not in {list(TABLE_PRIMARY_KEYS.keys())}, pass key"
+        key = TABLE_PRIMARY_KEYS[tableName]
+
+    # ensure correct type
+    assert isinstance(df_old, pd.core.frame.DataFrame), f"df_old must be a DataFrame"
+    assert isinstance(df_new, pd.core.frame.DataFrame), f"df_new must be a DataFrame"
+    assert isinstance(key, list), f"key must be a list"
+    assert isinstance(ignore, list), f"ignore must be a list"
+
+    key = [column for column in key if column not in ignore]
+    content = [column for column in df_new.columns if column not in ignore]
+
+    # columns added in the new version count as changed content
+    df_old = df_old.reindex(columns=content)
+
+    key_old = pd.Index(hash_rows(df_old, key))
+    key_new = pd.Index(hash_rows(df_new, key))
+
+    assert key_old.is_unique, f"key {key} is not unique in df_old"
+    assert key_new.is_unique, f"key {key} is not unique in df_new"
+
+    # position of each new key in the old table (-1 if missing) and vice versa
+    pos_in_old = key_old.get_indexer(key_new)
+    pos_in_new = key_new.get_indexer(key_old)
+
+    content_old = hash_rows(df_old, content)
+    content_new = hash_rows(df_new, content)
+
+    inserted = pos_in_old == -1
+    matched = ~inserted
+    updated = matched.copy()
+    updated[matched] = content_new[matched] != content_old[pos_in_old[matched]]
+    deleted = pos_in_new == -1
+
+    return {
+        'inserted': df_new.loc[inserted].reset_index(drop=True),
+        'updated': df_new.loc[updated].reset_index(drop=True),
+        'deleted': df_old.loc[deleted, key].reset_index(drop=True),
+    }
+
+
+def read_table_version(fl=None):
+    ''' read an output table as text, so values compare exactly as written '''
+    return pd.read_csv(fl, dtype=str, keep_default_na=False)
+
+
+def diff_csv(oldFile=None, newFile=None, tableName=None, key=None, ignore=None):
+    ''' diff_tables() on two csv files
+
+    example
+    -------
+    diff_csv(oldFile='data_contextual/city/territory/OEF:WD:city-area:20221105/Territory.csv',
+             newFile='data_contextual/city/territory/OEF:WD:city-area:20221106/Territory.csv',
+             tableName='Territory',
+             ignore=['datasource_id'])
+    '''
+    tableName = Path(newFile).stem if tableName is None else tableName
+
+    return diff_tables(df_old=read_table_version(oldFile),
+                       df_new=read_table_version(newFile),
+                       tableName=tableName,
+                       key=key,
+                       ignore=ignore)
+
+
+def export_changes(changes=None, outputDir=None, tableName=None):
+    ''' write the change sets from diff_tables() as csv
+
+    output
+    ------
+    {outputDir}/{tableName}.inserted.csv
+    {outputDir}/{tableName}.updated.csv
+    {outputDir}/{tableName}.deleted.csv   (key columns only)
+    '''
+    outputDir = '.' if outputDir is None else outputDir
+    tableName = 'Output' if tableName is None else tableName
+
+    assert isinstance(changes, dict), f"changes must be the output of diff_tables()"
+    assert isinstance(outputDir, str), f"outputDir must a be string"
+    assert isinstance(tableName, str), f"tableName must be a string"
+
+    # create out_dir if does not exist
+    out_dir = Path(outputDir).as_posix()
+    make_dir(path=out_dir)
+
+    for change, df in changes.items():
+        df.to_csv(f'{out_dir}/{tableName}.{change}.csv', index=False)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old', help='previous version of the table')
+    parser.add_argument('new', help='new version of the table')
+    parser.add_argument('-o', '--output', help='directory for the change sets', default=None)
+    parser.add_argument('-k', '--key', help='comma separated primary key columns', default=None)
+    parser.add_argument('-i', '--ignore', help='comma separated columns to ignore', default=None)
+    args = parser.parse_args()
+
+    changes = diff_csv(oldFile=args.old,
+                       newFile=args.new,
+                       key=args.key.split(',') if args.key else None,
+                       ignore=args.ignore.split(',') if args.ignore else None)
+
+    for change, df in changes.items():
+        print(f'{change}: {len(df)}')
+
+    if args.output is not None:
+        export_changes(changes=changes, outputDir=args.output, tableName=Path(args.new).stem)
@@ -7,38 +7,8 @@ import numpy as np
 from utils_eucom import write_to_csv
 from utils_eucom import df_to_csv
 from utils import read_iso_codes
-
-def df_wide_to_long(df=None, value_name=None, var_name=None):
-    
-    # set default values (new column names)
-    var_name = "year" if var_name is None else var_name          # new column name with {value_vars}
-    value_name = "values" if value_name is None else value_name  # new column name with values
-    
-    # ensure correct type
-    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
-    assert isinstance(var_name, str), f"filePath must a be string"
-    assert isinstance(value_name, str), f"tableName must be a string"
-    
-    # ensure column names are strings
-    df.columns = df.columns.astype(str)
-    
-    # columns to use as identifiers (columns that are not number)
-    id_vars = [val for val in list(df.columns) if not val.isdigit()]
-
-    # columns to unpivot (columns that are numbers)
-    value_vars = [val for val in list(df.columns) if val.isdigit()]
-
-    # Unpivot (melt) a DataFrame from wide to long format
-    df_long = df.melt(id_vars = id_vars, 
-                            value_vars = value_vars,
-                            var_name = var_name, 
-                            value_name = value_name)
-    
-    # convert var_name column to int
-    df_long[var_name] = df_long[var_name].astype(int)
-    
-    return df_long
-
+from utils import df_wide_to_long
+from utils import parse_numeric
 
 def remove_country_groups(df, column=None):
     
@@ -252,9 +222,9 @@ def create_all_gdp_tables():
 
     df_long = df_wide_to_long(df=df_gdp_tmp, value_name='GDP')
 
-    # replace no data so is -99
-    df_long['GDP'] = (df_long['GDP'].replace('no data', -0.000000099))
-    df_long['GDP'] = df_long['GDP'].astype(float)
+    # convert to float, "no data" becomes NaN
+    df_long['GDP'], reject = parse_numeric(df_long['GDP'])
+    assert reject.sum() == 0, f"{reject.sum()} GDP values could not be parsed"
 
     # rename column
     df_long = df_long.rename(columns={"GDP, current prices (Billions of U.S. dollars)":"country"})
@@ -266,8 +236,8 @@ def create_all_gdp_tables():
     filt = df_long['year'] <=2021
     df_long = df_long.loc[filt]
 
-    # change type
-    df_long['GDP'] = df_long['GDP'].astype(int)
+    # change type, no data stays missing
+    df_long['GDP'] = np.trunc(df_long['GDP']).astype('Int64')
 
     # remove trailing white space
     df_long['country'] = df_long['country'].str.strip()
@@ -304,13 +274,11 @@ def create_all_gdp_tables():
     
     df_out = df_out.astype({
         'actor_id': str,
-        'gdp': int,
+        'gdp': 'Int64',
         'year': int,
         'datasource_id': str
     })
     
-    df_out['gdp'] = (df_out['gdp'].replace(-99, np.nan))
-    
 
     df_out = df_out.sort_values(by=['actor_id', 'year'])
 
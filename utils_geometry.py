@@ -0,0 +1,180 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from pathlib import Path
+from utils import make_dir
+
+# simplification tolerance (degrees) of each precomputed level
+# "full" keeps the source geometry, the others are for coarser zooms
+GEOMETRY_LEVELS = {
+    'full': 0.0,
+    'z6': 0.01,
+    'z4': 0.05,
+    'z2': 0.25,
+}
+
+# equal-area projection used for polygon areas
+EQUAL_AREA_CRS = 'EPSG:6933'
+
+
+def simplify_levels(geometry=None, levels=None):
+    ''' simplified copies of every geometry at each level
+
+    input
+    -----
+    geometry: GeoSeries
+    levels: dictionary {level: tolerance in degrees} [default: GEOMETRY_LEVELS]
+
+    output
+    ------
+    dictionary {level: array of geometries}, simplified in bulk with shapely
+    '''
+    levels = GEOMETRY_LEVELS if levels is None else levels
+
+    assert isinstance(levels, dict), f"levels must be a dictionary"
+
+    geoms = np.asarray(geometry.values, dtype=object)
+
+    return {level: geoms if tolerance == 0 else shapely.simplify(geoms, tolerance, preserve_topology=True)
+            for level, tolerance in levels.items()}
+
+
+def write_geometries(df=None,
+                     outputDir=None,
+                     tableName=None,
+                     column=None,
+                     keys=None,
+                     levels=None):
+    ''' write boundaries to GeoParquet, outside of the tabular csv
+
+    one row per (actor, level), geometries are stored as WKB so
+    the Territory csv only keeps actor_id, area, lat, lng, datasource_id
+
+    input
+    -----
+    df: dataframe with a geometry column
+    outputDir: output directory
+    tableName: file name [default: TerritoryGeometry]
+    column: geometry column [default: admin_bound]
+    keys: id columns to keep [default: ['actor_id', 'datasource_id']]
+    levels: dictionary {level: tolerance in degrees} [default: GEOMETRY_LEVELS]
+
+    output
+    ------
+    {outputDir}/{tableName}.parquet with columns *keys, level, tolerance, geometry
+    '''
+    tableName = 'TerritoryGeometry' if tableName is None else tableName
+    column = 'admin_bound' if column is None else column
+    keys = ['actor_id', 'datasource_id'] if keys is None else keys
+    levels = GEOMETRY_LEVELS if levels is None else levels
+
+    # ensure correct type
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+    assert isinstance(outputDir, str), f"outputDir must a be string"
+    assert column in df.columns, f"{column} not in df"
+
+    # create out_dir if does not exist
+    out_dir = Path(outputDir).as_posix()
+    make_dir(path=out_dir)
+
+    # actors without a boundary are not written
+    df = df.loc[df[column].notna()]
+    geometry = gpd.GeoSeries(df[column].to_numpy(), crs='EPSG:4326')
+
+    frames = []
+    for level, geoms in simplify_levels(geometry=geometry, levels=levels).items():
+        df_level = df[keys].reset_index(drop=True)
+        df_level['level'] = level
+        df_level['tolerance'] = levels[level]
+        frames.append(gpd.GeoDataFrame(df_level, geometry=geoms, crs='EPSG:4326'))
+
+    df_out = pd.concat(frames, ignore_index=True)
+    df_out['level'] = df_out['level'].astype('category')
+
+    df_out.to_parquet(f'{out_dir}/{tableName}.parquet', index=False)
+
+    return df_out
+
+
+def read_geometries(fl=None, level=None, actor_ids=None):
+    ''' read one level of the boundaries written by write_geometries()
+
+    input
+    -----
+    fl: GeoParquet file
+    level: level to read [default: full]
+    actor_ids: optional list of actors to read
+
+    output
+    ------
+    df: GeoDataFrame
+    '''
+    level = 'full' if level is None else level
+
+    # row groups are filtered while reading, not after
+    filters = [('level', '==', level)]
+    if actor_ids is not None:
+        filters.append(('actor_id', 'in', list(actor_ids)))
+
+    return gpd.read_parquet(fl, filters=filters)
+
+
+def geometry_area_km2(geometry=None):
+    ''' area of every geometry in km2, computed in bulk in an equal-area projection '''
+    geoms = gpd.GeoSeries(geometry, crs='EPSG:4326').to_crs(EQUAL_AREA_CRS).values
+    return shapely.area(np.asarray(geoms, dtype=object)) / 10**6
+
+
+def geometry_representative_points(geometry=None):
+    ''' lat, lng (degrees) of a point guaranteed to be inside every geometry
+
+    unlike the centroid, the representative point of a country made of
+    islands or with a concave border always falls on its territory
+    '''
+    points = shapely.point_on_surface(np.asarray(gpd.GeoSeries(geometry).values, dtype=object))
+    return shapely.get_y(points), shapely.get_x(points)
+
+
+def fill_territory_from_geometry(df=None, column=None, scale=None):
+    ''' fill missing Territory area, lat and lng from the boundary
+
+    input
+    -----
+    df: territory dataframe with area, lat, lng and a geometry column
+    column: geometry column [default: admin_bound]
+    scale: factor applied to lat/lng, Territory tables store degrees * 10000 [default: 10000]
+
+    output
+    ------
+    df: copy of df, values that were present are not changed
+    '''
+    column = 'admin_bound' if column is None else column
+    scale = 10000 if scale is None else scale
+
+    # ensure correct type
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+    assert column in df.columns, f"{column} not in df"
+
+    df_out = df.copy()
+    has_geometry = df_out[column].notna()
+
+    # only compute for rows that need it
+    for name in ['area', 'lat', 'lng']:
+        if name not in df_out.columns:
+            df_out[name] = np.nan
+
+    filt = has_geometry & df_out[['area', 'lat', 'lng']].isna().any(axis=1)
+    if not filt.any():
+        return df_out
+
+    geometry = df_out.loc[filt, column]
+
+    area = pd.Series(geometry_area_km2(geometry), index=geometry.index)
+    lat, lng = geometry_representative_points(geometry)
+
+    df_out['area'] = df_out['area'].fillna(area)
+    df_out['lat'] = df_out['lat'].fillna(pd.Series(lat * scale, index=geometry.index))
+    df_out['lng'] = df_out['lng'].fillna(pd.Series(lng * scale, index=geometry.index))
+
+    return df_out
@@ -0,0 +1,268 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from pathlib import Path
+from utils import make_dir
+
+# directory of the key dictionaries, one csv per id column
+KEYS_DIR = os.environ.get('OPENCLIMATE_KEYS_DIR', './store/keys')
+
+# id columns that get a surrogate key
+KEY_COLUMNS = ['actor_id', 'datasource_id']
+
+# key of a missing id, never written to a dictionary
+MISSING_KEY = -1
+
+# seconds to wait for another process to release a dictionary
+LOCK_TIMEOUT = 60
+
+
+@contextmanager
+def key_file_lock(fl=None, timeout=None):
+    ''' hold {fl}.lock while reading or appending a dictionary, the lock
+    file is created exclusively so this works across processes '''
+    timeout = LOCK_TIMEOUT if timeout is None else timeout
+    lock = f'{fl}.lock'
+
+    start = time.monotonic()
+    while True:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            if time.monotonic() - start > timeout:
+                raise TimeoutError(f"{lock} held for more than {timeout}s, remove it if no build is running")
+            time.sleep(0.05)
+
+    try:
+        yield
+    finally:
+        os.close(fd)
+        os.remove(lock)
+
+
+def remap_keys(keys=None, remap=None):
+    ''' keys handed out before save() -> keys in the saved dictionary, MISSING_KEY stays missing '''
+    keys = np.asarray(keys)
+    remap = np.append(remap, MISSING_KEY).astype('int32')
+
+    return remap[np.where(keys == MISSING_KEY, len(remap) - 1, keys)]
+
+
+def key_column(column=None):
+    ''' actor_id -> actor_key '''
+    return column[:-len('_id')] + '_key' if column.endswith('_id') else column + '_key'
+
+
+class KeyDictionary:
+    ''' stable int32 surrogate keys for the values of one id column
+
+    keys are assigned in order of first appearance and never change:
+    the dictionary is read from {keysDir}/{column}.csv and save()
+    appends the values added since. keys are not in string order,
+    rank() gives int32 codes that sort like the strings do
+
+    builds running at the same time may add the same key for different
+    values, save() merges with what they saved and returns the new key
+    of each key handed out, write keys to disk only after save()
+
+    example
+    -------
+    keys = KeyDictionary('actor_id')
+    df['actor_key'] = keys.encode(df['actor_id'])
+    df = df.iloc[np.argsort(keys.rank(df['actor_key']), kind='stable')]
+    df['actor_id'] = keys.decode(df['actor_key'])
+    df['actor_key'] = remap_keys(df['actor_key'], keys.save())
+    '''
+
+    def __init__(self, column=None, keysDir=None):
+        keysDir = KEYS_DIR if keysDir is None else keysDir
+
+        assert isinstance(column, str), f"column must be a string"
+        assert isinstance(keysDir, str), f"keysDir must be a string"
+
+        self.column = column
+        self.keysDir = Path(keysDir).as_posix()
+        self.fl = f'{self.keysDir}/{column}.csv'
+
+        self.values = []
+        if os.path.exists(self.fl):
+            with key_file_lock(self.fl):
+                self.values = self._read()
+
+        self.saved = len(self.values)
+        self._reindex()
+
+    def __len__(self):
+        return len(self.values)
+
+    def _read(self):
+        ''' values of the saved dictionary, in key order '''
+        if not os.path.exists(self.fl):
+            return []
+
+        # missing values are never saved, so no cell is NaN: "NA" is the
+        # ISO code for Namibia and an empty cell is the empty string
+        df = pd.read_csv(self.fl, dtype={self.column: str}, keep_default_na=False)
+        assert (df[key_column(self.column)].to_numpy() == np.arange(len(df))).all(), \
+            f"{self.fl} keys must be 0, 1, 2, ..."
+        return df[self.column].tolist()
+
+    def _reindex(self):
+        self.index = pd.Index(self.values, dtype=object)
+        self._order = None
+        self._ranks = None
+
+    def encode(self, values=None):
+        ''' int32 key of each value, new values get the next keys, missing values MISSING_KEY '''
+        values = pd.Series(values, dtype=object)
+        missing = values.isna().to_numpy()
+        values = values.where(missing, values.astype(str))
+
+        keys = self.index.get_indexer(values)
+
+        # new values, in order of first appearance
+        new = (keys == -1) & ~missing
+        if new.any():
+            self.values.extend(pd.unique(values[new]))
+            assert len(self.values) <= np.iinfo('int32').max, f"too many {self.column} values for int32 keys"
+            self._reindex()
+            keys = self.index.get_indexer(values)
+
+        keys[missing] = MISSING_KEY
+
+        return keys.astype('int32')
+
+    def decode(self, keys=None):
+        ''' value of each key, NaN for MISSING_KEY '''
+        keys = np.asarray(keys)
+        values = np.asarray(self.values + [np.nan], dtype=object)
+
+        return values[np.where(keys == MISSING_KEY, len(self.values), keys)]
+
+    def order(self):
+        ''' keys in string order of their values '''
+        if self._order is None:
+            self._order = np.argsort(np.asarray(self.values, dtype=object), kind='stable').astype('int32')
+        return self._order
+
+    def rank(self, keys=None):
+        ''' int32 codes that sort like the values, missing last (like sort_values) '''
+        if self._ranks is None:
+            order = self.order()
+            self._ranks = np.empty(len(order) + 1, dtype='int32')
+            self._ranks[order] = np.arange(len(order), dtype='int32')
+            self._ranks[-1] = len(order)
+
+        keys = np.asarray(keys)
+        return self._ranks[np.where(keys == MISSING_KEY, len(self.values), keys)]
+
+    def factorize(self, keys=None):
+        ''' pd.factorize(values, sort=True) on keys
+
+        output
+        ------
+        codes: position of each key in uniques
+        uniques: distinct keys in string order of their values
+        '''
+        codes, ranks = pd.factorize(self.rank(keys), sort=True)
+        order = np.append(self.order(), MISSING_KEY).astype('int32')
+
+        return codes, order[ranks]
+
+    def save(self):
+        ''' append the keys assigned since the dictionary was read
+
+        the file is re-read under a lock first: values another build saved
+        in the meantime keep their keys and only values still missing are
+        appended, so keys added here may move
+
+        output
+        ------
+        remap: int32 array, remap[key] is the saved key of each key handed out
+        '''
+        make_dir(path=self.keysDir)
+
+        with key_file_lock(self.fl):
+            saved = self._read()
+            assert saved[:self.saved] == self.values[:self.saved], f"{self.fl} changed its existing keys"
+
+            known = set(saved)
+            new = [value for value in self.values[self.saved:] if value not in known]
+
+            df = pd.DataFrame({
+                key_column(self.column): np.arange(len(saved), len(saved) + len(new)),
+                self.column: new,
+            })
+            df.to_csv(self.fl, mode='a', header=not os.path.exists(self.fl), index=False)
+
+        remap = pd.Index(saved + new, dtype=object).get_indexer(self.values).astype('int32')
+
+        self.values = saved + new
+        self.saved = len(self.values)
+        self._reindex()
+
+        return remap
+
+
+def load_key_dictionaries(columns=None, keysDir=None):
+    ''' {column: KeyDictionary} for each id column [default: KEY_COLUMNS] '''
+    columns = KEY_COLUMNS if columns is None else columns
+
+    return {column: KeyDictionary(column=column, keysDir=keysDir) for column in columns}
+
+
+def save_key_dictionaries(keys=None):
+    ''' save() each dictionary in keys, {column: remap} '''
+    return {column: dictionary.save() for column, dictionary in keys.items()}
+
+
+def add_keys(df=None, keys=None):
+    ''' add an int32 {column}_key for each dictionary in keys, e.g. actor_key '''
+    df = df.copy()
+    for column, dictionary in keys.items():
+        df[key_column(column)] = dictionary.encode(df[column])
+    return df
+
+
+def decode_keys(df=None, keys=None):
+    ''' replace each {column}_key in df by its decoded {column}, in place of the key column '''
+    df = df.copy()
+    for column, dictionary in keys.items():
+        if key_column(column) in df.columns:
+            df[key_column(column)] = dictionary.decode(df[key_column(column)])
+            df = df.rename(columns={key_column(column): column})
+    return df
+
+
+def remap_key_columns(df=None, remaps=None):
+    ''' remap_keys() on {column}_key for each remap in remaps, {column: output of save()} '''
+    df = df.copy()
+    for column, remap in remaps.items():
+        df[key_column(column)] = remap_keys(df[key_column(column)], remap)
+    return df
+
+
+def sort_order(df=None, by=None, keys=None):
+    ''' positions that sort df like sort_values(by, kind='stable')
+
+    columns with a dictionary in keys are sorted on the rank of
+    their int32 key instead of comparing strings
+
+    input
+    -----
+    df: dataframe with a {column}_key for each keyed column in by
+    by: columns to sort by
+    keys: output of load_key_dictionaries()
+    '''
+    sort_keys = []
+    for column in by:
+        if column in keys:
+            sort_keys.append(keys[column].rank(df[key_column(column)]))
+        else:
+            sort_keys.append(df[column].to_numpy())
+
+    # lexsort sorts on the last key first
+    return np.lexsort(sort_keys[::-1])
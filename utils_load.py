@@ -0,0 +1,215 @@
+import csv
+import io
+import sqlite3
+import pandas as pd
+from utils_validate import TABLE_PRIMARY_KEYS
+from utils_validate import read_output_tables
+
+
+def quote(name):
+    ''' quote an identifier (tables like EmissionsAgg and columns like URL are case sensitive) '''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_type(dtype):
+    ''' column type for a pandas dtype '''
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'BIGINT'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'DOUBLE PRECISION'
+    return 'TEXT'
+
+
+def create_table_sql(tableName=None, df=None):
+    ''' CREATE TABLE IF NOT EXISTS statement with the schema primary key '''
+    key = TABLE_PRIMARY_KEYS[tableName]
+    columns = [f'{quote(column)} {sql_type(df[column].dtype)}' for column in df.columns]
+    columns.append(f"PRIMARY KEY ({', '.join(quote(column) for column in key)})")
+    return f"CREATE TABLE IF NOT EXISTS {quote(tableName)} ({', '.join(columns)})"
+
+
+def upsert_sql(tableName=None, columns=None, placeholder=None, source=None):
+    ''' INSERT ... ON CONFLICT (primary key) DO UPDATE statement
+
+    input
+    -----
+    placeholder: parameter marker for a VALUES list ("?" for sqlite)
+    source: select statement to insert from instead of a VALUES list
+    '''
+    key = TABLE_PRIMARY_KEYS[tableName]
+    cols = ', '.join(quote(column) for column in columns)
+    updates = [f'{quote(column)} = excluded.{quote(column)}' for column in columns if column not in key]
+    on_conflict = f"ON CONFLICT ({', '.join(quote(column) for column in key)}) "
+    on_conflict += f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+
+    if source is None:
+        values = ', '.join([placeholder] * len(columns))
+        return f"INSERT INTO {quote(tableName)} ({cols}) VALUES ({values}) {on_conflict}"
+
+    # "WHERE true" keeps sqlite's parser from reading ON CONFLICT as a join clause
+    return f"INSERT INTO {quote(tableName)} ({cols}) {source} WHERE true {on_conflict}"
+
+
+def prepare_table(tableName=None, df=None):
+    ''' keep the last row of each primary key, an upsert can only touch a row once per statement '''
+    assert tableName in TABLE_PRIMARY_KEYS, f"{tableName} not in {list(TABLE_PRIMARY_KEYS.keys())}"
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+
+    df = df.drop(columns=['source_dir'], errors='ignore')
+    return df.drop_duplicates(subset=TABLE_PRIMARY_KEYS[tableName], keep='last')
+
+
+def df_rows(df=None):
+    ''' rows as tuples of python objects with None for missing values '''
+    df = df.astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def load_table_sqlite(con=None, tableName=None, df=None, batchSize=None):
+    ''' bulk upsert a table into sqlite with executemany
+
+    secondary indexes are dropped before the load and rebuilt after it,
+    the whole load runs in a single transaction
+
+    input
+    -----
+    con: sqlite3 connection
+    tableName: schema table name (see TABLE_PRIMARY_KEYS)
+    df: table to load
+    batchSize: rows per executemany call [default: 50000]
+    '''
+    batchSize = 50000 if batchSize is None else batchSize
+
+    assert isinstance(con, sqlite3.Connection), f"con must be a sqlite3 connection"
+
+    df = prepare_table(tableName=tableName, df=df)
+    columns = list(df.columns)
+    statement = upsert_sql(tableName=tableName, columns=columns, placeholder='?')
+
+    # the load runs in its own transaction
+    if con.in_transaction:
+        con.commit()
+
+    cur = con.cursor()
+    cur.execute(create_table_sql(tableName=tableName, df=df))
+
+    # secondary indexes, the primary key index is kept for the upsert
+    cur.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (tableName,))
+    indexes = cur.fetchall()
+
+    try:
+        cur.execute('BEGIN')
+        for name, _ in indexes:
+            cur.execute(f'DROP INDEX {quote(name)}')
+
+        rows = df_rows(df)
+        while True:
+            batch = [row for _, row in zip(range(batchSize), rows)]
+            if not batch:
+                break
+            cur.executemany(statement, batch)
+
+        for _, sql in indexes:
+            cur.execute(sql)
+        cur.execute('COMMIT')
+    except Exception:
+        cur.execute('ROLLBACK')
+        raise
+
+    return len(df)
+
+
+def load_table_postgres(con=None, tableName=None, df=None):
+    ''' bulk upsert a table into postgres with COPY
+
+    rows are copied into a temporary staging table and upserted from it,
+    secondary indexes are dropped before and rebuilt after the upsert,
+    all in one transaction
+
+    input
+    -----
+    con: psycopg2 connection
+    tableName: schema table name (see TABLE_PRIMARY_KEYS)
+    df: table to load
+    '''
+    df = prepare_table(tableName=tableName, df=df)
+    columns = list(df.columns)
+    cols = ', '.join(quote(column) for column in columns)
+    stage = quote(f'{tableName}_stage')
+
+    # csv buffer for COPY, empty unquoted fields are NULL
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+    buffer.seek(0)
+
+    with con:
+        with con.cursor() as cur:
+            cur.execute(create_table_sql(tableName=tableName, df=df))
+
+            # secondary indexes, the primary key index is kept for the upsert
+            cur.execute("""
+                SELECT i.indexname, i.indexdef FROM pg_indexes i
+                WHERE i.tablename = %s AND i.indexname NOT IN (
+                    SELECT conname FROM pg_constraint WHERE contype IN ('p', 'u'))
+            """, (tableName,))
+            indexes = cur.fetchall()
+            for name, _ in indexes:
+                cur.execute(f'DROP INDEX {quote(name)}')
+
+            cur.execute(f'CREATE TEMPORARY TABLE {stage} (LIKE {quote(tableName)} INCLUDING DEFAULTS) ON COMMIT DROP')
+            cur.copy_expert(f"COPY {stage} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '')", buffer)
+            cur.execute(upsert_sql(tableName=tableName, columns=columns, source=f'SELECT {cols} FROM {stage}'))
+
+            for _, sql in indexes:
+                cur.execute(sql)
+
+    return len(df)
+
+
+def load_tables(con=None, tables=None, batchSize=None):
+    ''' bulk load harmonized tables
+
+    input
+    -----
+    con: sqlite3 connection (local testing) or psycopg2 connection
+    tables: dictionary {table_name: df}, e.g. output of read_output_tables()
+    batchSize: rows per executemany call for sqlite
+
+    output
+    ------
+    dictionary {table_name: number of rows loaded}
+    '''
+    assert isinstance(tables, dict), f"tables must be a dictionary"
+
+    loaded = {}
+    for tableName, df in tables.items():
+        if isinstance(con, sqlite3.Connection):
+            loaded[tableName] = load_table_sqlite(con=con, tableName=tableName, df=df, batchSize=batchSize)
+        else:
+            loaded[tableName] = load_table_postgres(con=con, tableName=tableName, df=df)
+
+    return loaded
+
+
+def load_output_tree(con=None, dataDirs=None):
+    ''' bulk load every output table in the repository, see load_tables() '''
+    return load_tables(con=con, tables=read_output_tables(dataDirs=dataDirs))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('database', help='sqlite file or postgres dsn (postgresql://...)')
+    args = parser.parse_args()
+
+    if args.database.startswith('postgres'):
+        import psycopg2
+        con = psycopg2.connect(args.database)
+    else:
+        con = sqlite3.connect(args.database, isolation_level=None)
+
+    for tableName, n in load_output_tree(con=con).items():
+        print(f'{tableName}: {n}')
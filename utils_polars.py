@@ -0,0 +1,246 @@
+import re
+import polars as pl
+import pyarrow.csv as pa_csv
+from pathlib import Path
+from utils import PANDAS_EXTRA_NA_VALUES
+from utils import PRIMAP_DTYPES
+from utils import apply_dtype_plan
+from utils import make_dir
+
+# same missing markers as pd.read_csv with keep_default_na=True
+DEFAULT_NA_VALUES = pa_csv.ConvertOptions().null_values + PANDAS_EXTRA_NA_VALUES
+
+# PRIMAP codes that are not countries, dropped by filter_primap()
+PRIMAP_CODES_TO_DROP = [
+    'EARTH',
+    'ANNEXI',
+    'NONANNEXI',
+    'AOSIS',
+    'BASIC',
+    'EU27BX',
+    'LDC',
+    'UMBRELLA',
+    'ANT',
+]
+
+EMISSIONS_AGG_COLUMNS = [
+    'emissions_id',
+    'actor_id',
+    'year',
+    'total_emissions',
+    'datasource_id',
+]
+
+
+def year_columns(columns=None):
+    ''' digit-only column labels, the same columns df_wide_to_long() unpivots '''
+    return [column for column in columns if str(column).isdigit()]
+
+
+def scan_csv(fl=None, dtype=None):
+    ''' lazy csv scan with pd.read_csv missing values, urls are read eagerly '''
+    dtype = {} if dtype is None else dtype
+
+    schema = {column: pl.Utf8 for column, name in dtype.items() if name == 'string'}
+
+    if str(fl).startswith(('http://', 'https://')):
+        return pl.read_csv(fl, schema_overrides=schema, null_values=DEFAULT_NA_VALUES).lazy()
+
+    return pl.scan_csv(fl, schema_overrides=schema, null_values=DEFAULT_NA_VALUES)
+
+
+def emissions_id(prefix=None, actor_id=None, year=None):
+    ''' f"{prefix}:{actor_id}:{year}" like the pandas apply, a missing actor is "nan" '''
+    prefix = prefix if isinstance(prefix, pl.Expr) else pl.lit(prefix)
+
+    return pl.concat_str([
+        prefix,
+        pl.lit(':'),
+        pl.col(actor_id).fill_null('nan'),
+        pl.lit(':'),
+        pl.col(year).cast(pl.Utf8),
+    ])
+
+
+def collect_emissions_agg(lf=None, outputDir=None, tableName=None):
+    ''' run the plan and write the EmissionsAgg table
+
+    the collected table goes through apply_dtype_plan() and to_csv()
+    like the pandas path, so both backends write the same file
+
+    input
+    -----
+    lf: LazyFrame with the EmissionsAgg columns
+    outputDir: output directory
+    tableName: name of the table to create
+
+    output
+    ------
+    df: EmissionsAgg dataframe (pandas)
+    '''
+    out_dir = Path(outputDir).as_posix()
+    make_dir(path=out_dir)
+
+    # stable sort, missing actors last (same as sort_values)
+    lf = (
+        lf.select(EMISSIONS_AGG_COLUMNS)
+        .sort(['actor_id', 'year'], nulls_last=True, maintain_order=True)
+    )
+
+    df = lf.collect().to_pandas()
+    df = apply_dtype_plan(df)
+
+    df.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+
+    return df
+
+
+def primap_emissions_plan(fl=None,
+                          df_iso=None,
+                          datasourceDict=None,
+                          entity=None,
+                          category=None,
+                          scenario=None):
+    ''' harmonize_primap_emissions() as a lazy query plan
+
+    the filters are pushed into the csv scan and only the identifier
+    and year columns that are needed are read
+
+    input
+    -----
+    fl: PRIMAP csv
+    df_iso: output of read_iso_codes()
+    datasourceDict: dictionary with datasource info
+    entity, category, scenario: see subset_primap()
+
+    output
+    ------
+    lf: LazyFrame with the EmissionsAgg columns
+    '''
+    lf = scan_csv(fl, dtype=PRIMAP_DTYPES)
+    years = year_columns(lf.collect_schema().names())
+
+    # keep the ISO3 column itself, filter_primap() tests it after the merge
+    iso = (
+        pl.from_pandas(df_iso[['iso2', 'iso3']])
+        .lazy()
+        .with_columns(pl.col('iso3').alias('iso3_key'))
+    )
+
+    lf = (
+        lf
+        .filter(
+            (pl.col('entity') == entity) &
+            (pl.col('category (IPCC2006_PRIMAP)') == category) &
+            (pl.col('scenario (PRIMAP-hist)') == scenario)
+        )
+        .join(iso, left_on='area (ISO3)', right_on='iso3_key', how='left')
+        .with_columns([pl.col(year).cast(pl.Float64) for year in years])
+        .unpivot(index=['source', 'area (ISO3)', 'iso2', 'iso3'],
+                 on=years,
+                 variable_name='year',
+                 value_name='emissions')
+        .filter(pl.col('emissions').is_not_null())
+        # a code without an ISO3 match is kept, like ~isin() on NaN
+        .filter(~pl.col('iso3').is_in(PRIMAP_CODES_TO_DROP).fill_null(False))
+        # a missing area code is kept, like ~(df == 'ANT') in pandas
+        .filter(pl.col('area (ISO3)').ne_missing('ANT'))
+        .rename({'iso2': 'actor_id'})
+        .with_columns(pl.col('year').cast(pl.Int64))
+        .with_columns(
+            emissions_id=emissions_id(prefix=pl.col('source'), actor_id='actor_id', year='year'),
+            # gigagram to metric ton
+            total_emissions=pl.col('emissions') * 1000,
+            datasource_id=pl.lit(datasourceDict['datasource_id']),
+        )
+    )
+
+    return lf
+
+
+def unfccc_emissions_plan(df=None, df_iso=None, datasourceDict=None):
+    ''' harmonize_unfccc_emissions() as a lazy query plan
+
+    input
+    -----
+    df: UNFCCC table, cut at the first empty row and with harmonized Party names
+    df_iso: output of read_iso_codes()
+    datasourceDict: dictionary with datasource info
+
+    output
+    ------
+    lf: LazyFrame with the EmissionsAgg columns
+    '''
+    df = df.rename(columns=str)
+    years = year_columns(df.columns)
+
+    lf = pl.from_pandas(df[['Party'] + years]).lazy()
+    iso = pl.from_pandas(df_iso[['country', 'iso2', 'iso3']]).lazy()
+
+    # left merge then dropping unmatched countries is an inner join
+    lf = (
+        lf
+        .join(iso, left_on='Party', right_on='country', how='inner')
+        .with_columns([pl.col(year).cast(pl.Float64) for year in years])
+        .unpivot(index=['Party', 'iso2', 'iso3'],
+                 on=years,
+                 variable_name='year',
+                 value_name='emissions')
+        .rename({'iso3': 'identifier', 'iso2': 'actor_id'})
+        .with_columns(pl.col('year').cast(pl.Int16))
+        .with_columns(
+            emissions_id=emissions_id(prefix='UNFCCC-annex1-GHG', actor_id='actor_id', year='year'),
+            # kilotonne to metric ton
+            total_emissions=pl.col('emissions') * 1000,
+            datasource_id=pl.lit(datasourceDict['datasource_id']),
+        )
+    )
+
+    return lf
+
+
+def epa_state_ghg_plan(files=None, df_sub=None, datasourceDict=None):
+    ''' harmonize_epa_state_ghg() as a lazy query plan
+
+    input
+    -----
+    files: one csv per state, first column is "{state} Emissions ..."
+    df_sub: US subdivisions with actor_id and title-case name
+    datasourceDict: dictionary with datasource info
+
+    output
+    ------
+    lf: LazyFrame with the EmissionsAgg columns
+    '''
+
+    def scan_each_file(fl):
+        lf = scan_csv(fl)
+        columns = lf.collect_schema().names()
+        first_column = columns[0]
+        state = ''.join(re.search(r"(.*)\sEmissions.*", first_column).groups())
+        years = year_columns(columns)
+
+        return (
+            lf
+            .filter(pl.col(first_column) == 'Total')
+            .select([pl.lit(state).alias('state')] + [pl.col(year).cast(pl.Float64) for year in years])
+            .unpivot(index=['state'], on=years, variable_name='year', value_name='total_emissions')
+        )
+
+    lf = pl.concat([scan_each_file(fl) for fl in files], how='vertical')
+    sub = pl.from_pandas(df_sub[['actor_id', 'name']]).lazy()
+
+    lf = (
+        lf
+        # to metric tonnes
+        .with_columns(pl.col('total_emissions') * 10**6)
+        .join(sub, left_on='state', right_on='name', how='left', maintain_order='left')
+        .with_columns(pl.col('year').cast(pl.Int64))
+        .with_columns(
+            emissions_id=emissions_id(prefix='EPA_state_GHG_inventory', actor_id='actor_id', year='year'),
+            datasource_id=pl.lit(datasourceDict['datasource_id']),
+        )
+    )
+
+    return lf
+
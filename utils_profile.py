@@ -0,0 +1,219 @@
+import functools
+import json
+import os
+import time
+import tracemalloc
+from pathlib import Path
+
+# directory where profile reports are written
+# profiling is opt-in: it stays disabled unless this is set
+# (either with enable_profiling() or the OPENCLIMATE_PROFILE env variable)
+PROFILE_DIR = os.environ.get('OPENCLIMATE_PROFILE')
+
+# profilers that are still tracing, closed by profiled() if a harmonizer raises
+_OPEN_PROFILERS = []
+
+
+def enable_profiling(outputDir=None):
+    ''' turn on stage profiling for harmonizers
+
+    input
+    -----
+    outputDir: directory where reports are written [default: ./profile]
+    '''
+    global PROFILE_DIR
+    PROFILE_DIR = './profile' if outputDir is None else outputDir
+
+    assert isinstance(PROFILE_DIR, str), f"outputDir must be a string"
+
+
+def disable_profiling():
+    ''' turn off stage profiling '''
+    global PROFILE_DIR
+    PROFILE_DIR = None
+
+
+def df_shape(df=None):
+    ''' shape of a DataFrame (or anything with .shape), None otherwise '''
+    shape = getattr(df, 'shape', None)
+    return list(shape) if shape is not None else None
+
+
+class StageProfiler:
+    ''' records wall time, cpu time, peak memory and shape per stage
+
+    harmonizers call stage() at the end of each step, so a stage spans
+    the time since the previous call (or since the profiler was created).
+
+    example
+    -------
+    prof = stage_profiler('harmonize_primap_emissions')
+    df = read_primap(fl=fl)
+    prof.stage('read', df)
+    df_long = df_wide_to_long(df=df)
+    prof.stage('melt', df_long)
+    prof.finish()
+
+    output
+    ------
+    {outputDir}/{run}_{timestamp}.json    per-stage report
+    {outputDir}/{run}_{timestamp}.folded  collapsed stacks for flamegraph.pl
+                                          or speedscope (wall time in ms)
+    '''
+
+    def __init__(self, run=None, outputDir=None):
+        self.run = 'run' if run is None else run
+        self.outputDir = './profile' if outputDir is None else outputDir
+        self.stages = []
+
+        # only trace memory if no one else is already tracing
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start()
+        _OPEN_PROFILERS.append(self)
+
+        self._started = time.time()
+        self._reset()
+
+    def _reset(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        tracemalloc.reset_peak()
+
+    def stage(self, name=None, df=None):
+        ''' close the current stage and start the next one
+
+        input
+        -----
+        name: name of the stage (read, merge_iso, melt, apply, astype, sort, write, ...)
+        df: DataFrame produced by the stage, used to record its shape
+        '''
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        current, peak = tracemalloc.get_traced_memory()
+
+        self.stages.append({
+            'stage': name,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_mb': round(peak / 2**20, 3),
+            'current_mb': round(current / 2**20, 3),
+            'shape': df_shape(df),
+        })
+
+        self._reset()
+
+    def report(self):
+        ''' per-run report as a dictionary '''
+        return {
+            'run': self.run,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self._started)),
+            'wall_s': round(sum(s['wall_s'] for s in self.stages), 6),
+            'cpu_s': round(sum(s['cpu_s'] for s in self.stages), 6),
+            'peak_mb': max([s['peak_mb'] for s in self.stages], default=0),
+            'stages': self.stages,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        ''' stop tracing without writing a report, safe to call more than once '''
+        if self in _OPEN_PROFILERS:
+            _OPEN_PROFILERS.remove(self)
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+    def finish(self):
+        ''' stop tracing and write the json and folded reports
+
+        output
+        ------
+        report: dictionary with the per-stage records
+        '''
+        self.close()
+
+        report = self.report()
+
+        # create out_dir if does not exist
+        out_dir = Path(self.outputDir).as_posix()
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.localtime(self._started))
+        fl = f'{out_dir}/{self.run}_{stamp}'
+
+        with open(f'{fl}.json', 'w') as f:
+            json.dump(report, f, indent=2)
+
+        # collapsed stack format: "run;stage value"
+        with open(f'{fl}.folded', 'w') as f:
+            for s in self.stages:
+                f.write(f"{self.run};{s['stage']} {max(int(s['wall_s'] * 1000), 1)}\n")
+
+        return report
+
+
+class NullProfiler:
+    ''' stands in for StageProfiler when profiling is disabled '''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def stage(self, name=None, df=None):
+        pass
+
+    def close(self):
+        pass
+
+    def finish(self):
+        return None
+
+
+def stage_profiler(run=None):
+    ''' profiler for a harmonizer run
+
+    returns a StageProfiler if profiling is enabled, otherwise a NullProfiler
+    so harmonizers can annotate stages unconditionally at no cost
+
+    input
+    -----
+    run: name of the run, usually the harmonizer function name
+    '''
+    if PROFILE_DIR is None:
+        return NullProfiler()
+
+    return StageProfiler(run=run, outputDir=PROFILE_DIR)
+
+
+def profiled(harmonizer):
+    ''' stop the tracing of the profilers a harmonizer opened if it raises
+
+    a harmonizer that fails between stage_profiler() and finish() would
+    otherwise leave tracemalloc running for the rest of the process
+
+    example
+    -------
+    @profiled
+    def harmonize_primap_emissions(...):
+        prof = stage_profiler('harmonize_primap_emissions')
+        ...
+        prof.finish()
+    '''
+    @functools.wraps(harmonizer)
+    def wrapper(*args, **kwargs):
+        opened = len(_OPEN_PROFILERS)
+        try:
+            return harmonizer(*args, **kwargs)
+        finally:
+            # profilers opened by this call that did not finish
+            for prof in _OPEN_PROFILERS[opened:]:
+                prof.close()
+
+    return wrapper
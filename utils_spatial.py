@@ -0,0 +1,126 @@
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+# Natural Earth admin-1 boundaries (states, provinces, ...)
+ADMIN1_BOUNDARIES = 'https://naciscdn.org/naturalearth/10m/cultural/ne_10m_admin_1_states_provinces.zip'
+
+
+def read_admin1_boundaries(fl=None, countries=None):
+    ''' admin-1 polygons keyed by their ISO-3166-2 actor_id
+
+    input
+    -----
+    fl: shapefile, zip or geojson with an iso_3166_2 column [default: ADMIN1_BOUNDARIES]
+    countries: optional list of ISO-3166-1 alpha-2 codes to keep, e.g. ['CA']
+
+    output
+    ------
+    df: GeoDataFrame with columns actor_id, geometry (EPSG:4326)
+    '''
+    fl = ADMIN1_BOUNDARIES if fl is None else fl
+
+    df = gpd.read_file(fl, columns=['iso_3166_2', 'iso_a2'])
+
+    # natural earth uses codes like "CA-" or "-99" where there is no subdivision
+    filt = df['iso_3166_2'].str.match(r'^[A-Z]{2}-[A-Z0-9]+$', na=False)
+    if countries is not None:
+        filt &= df['iso_a2'].isin(countries)
+
+    df = df.loc[filt].rename(columns={'iso_3166_2': 'actor_id'})
+
+    return df[['actor_id', 'geometry']].to_crs('EPSG:4326').reset_index(drop=True)
+
+
+def points_from_lat_lng(df=None, lat=None, lng=None):
+    ''' GeoDataFrame of points from lat/lng columns in degrees
+
+    (0, 0) and missing coordinates become empty points, so they
+    are never assigned to a polygon
+    '''
+    lat = 'lat' if lat is None else lat
+    lng = 'lng' if lng is None else lng
+
+    # ensure correct type
+    assert isinstance(df, pd.core.frame.DataFrame), f"df must be a DataFrame"
+    assert lat in df.columns, f"{lat} not in df"
+    assert lng in df.columns, f"{lng} not in df"
+
+    y = pd.to_numeric(df[lat], errors='coerce').to_numpy(dtype='float64', copy=True)
+    x = pd.to_numeric(df[lng], errors='coerce').to_numpy(dtype='float64', copy=True)
+
+    missing = np.isnan(x) | np.isnan(y) | ((x == 0) & (y == 0))
+    x[missing] = np.nan
+    y[missing] = np.nan
+
+    return gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(x, y), crs='EPSG:4326')
+
+
+def assign_points_to_polygons(points=None, polygons=None, column=None):
+    ''' value of column of the polygon containing each point
+
+    all points are queried against the STRtree of the polygons
+    in a single bulk call. a point on a border counts as inside, a point
+    on a shared border gets the first matching polygon (in polygons order)
+
+    input
+    -----
+    points: GeoDataFrame of points, e.g. from points_from_lat_lng()
+    polygons: GeoDataFrame of polygons, e.g. from read_admin1_boundaries()
+    column: polygon column to return [default: actor_id]
+
+    output
+    ------
+    series aligned with points, NaN where no polygon contains the point
+    '''
+    column = 'actor_id' if column is None else column
+
+    # ensure correct type
+    assert isinstance(points, gpd.GeoDataFrame), f"points must be a GeoDataFrame"
+    assert isinstance(polygons, gpd.GeoDataFrame), f"polygons must be a GeoDataFrame"
+    assert column in polygons.columns, f"{column} not in polygons"
+
+    polygons = polygons.to_crs(points.crs)
+
+    # (point position, polygon position) pairs from the spatial index
+    # 'within' excludes the boundary, 'intersects' keeps border points
+    point_pos, polygon_pos = polygons.sindex.query(points.geometry, predicate='intersects')
+
+    # first polygon of each point, pairs come back in tree order
+    order = np.lexsort((polygon_pos, point_pos))
+    point_pos, polygon_pos = point_pos[order], polygon_pos[order]
+    point_pos, first = np.unique(point_pos, return_index=True)
+
+    values = pd.Series(np.nan, index=points.index, dtype=object)
+    values.iloc[point_pos] = polygons[column].to_numpy()[polygon_pos[first]]
+
+    return values
+
+
+def assign_actors(df=None, lat=None, lng=None, subdivisions=None, cities=None):
+    ''' assign rows with coordinates to subnational (and optionally city) actors
+
+    input
+    -----
+    df: dataframe with lat/lng in degrees, e.g. facilities
+    lat, lng: coordinate columns [default: lat, lng]
+    subdivisions: admin-1 polygons with actor_id [default: read_admin1_boundaries()]
+    cities: optional city polygons with actor_id
+
+    output
+    ------
+    df: copy of df with columns
+        subdivision_id: ISO-3166-2 actor_id of the containing admin-1 polygon
+        city_id: actor_id of the containing city polygon (if cities given)
+    '''
+    subdivisions = read_admin1_boundaries() if subdivisions is None else subdivisions
+
+    points = points_from_lat_lng(df=df, lat=lat, lng=lng)
+
+    df_out = df.copy()
+    df_out['subdivision_id'] = assign_points_to_polygons(points=points, polygons=subdivisions)
+
+    if cities is not None:
+        df_out['city_id'] = assign_points_to_polygons(points=points, polygons=cities)
+
+    return df_out
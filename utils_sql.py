@@ -0,0 +1,265 @@
+import os
+import re
+import duckdb
+import pyarrow.csv as pa_csv
+from pathlib import Path
+from utils import PANDAS_EXTRA_NA_VALUES
+from utils import PRIMAP_DTYPES
+from utils import apply_dtype_plan
+from utils import make_dir
+
+# directory of the reference tables cached by cache_reference_tables()
+# the source csv files are read over http when a table is not cached
+REFERENCE_DIR = os.environ.get('OPENCLIMATE_REFERENCE_DIR')
+
+# DuckDB spills joins and sorts to TEMP_DIR once MEMORY_LIMIT is reached
+MEMORY_LIMIT = os.environ.get('OPENCLIMATE_MEMORY_LIMIT', '4GB')
+TEMP_DIR = os.environ.get('OPENCLIMATE_TEMP_DIR', './.duckdb_tmp')
+
+# same missing markers as pd.read_csv with keep_default_na=True
+DEFAULT_NA_VALUES = pa_csv.ConvertOptions().null_values + PANDAS_EXTRA_NA_VALUES
+
+# reference tables {name: source csv}, all columns are read as text
+# so codes such as "NA" (Namibia) are not missing values
+REFERENCE_SOURCES = {
+    'iso3166_1': 'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-1.csv',
+    'iso3166_2': 'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-2/Actor.csv',
+}
+
+# views over the raw reference tables {name: (table, query)}, same columns as the pandas readers
+REFERENCE_VIEWS = {
+    # read_iso_codes()
+    'iso_codes': ('iso3166_1', '''
+        SELECT "English short name" AS country,
+               "French short name" AS country_french,
+               "Alpha-2 code" AS iso2,
+               "Alpha-3 code" AS iso3
+        FROM iso3166_1
+    '''),
+    # US states in harmonize_epa_state_ghg(), names in title case
+    'us_states': ('iso3166_2', '''
+        SELECT actor_id, is_part_of, title(name) AS name
+        FROM iso3166_2
+        WHERE is_part_of = 'US'
+    '''),
+}
+
+def connect(references=None, memoryLimit=None, tempDirectory=None, threads=None):
+    ''' DuckDB connection that spills to disk instead of running out of memory
+
+    input
+    -----
+    references: reference tables or views to register, e.g. ['iso_codes'] [default: none]
+    memoryLimit: e.g. "4GB" [default: MEMORY_LIMIT]
+    tempDirectory: where joins and sorts spill [default: TEMP_DIR]
+    threads: worker threads [default: all cores]
+
+    output
+    ------
+    con: duckdb connection
+    '''
+    memoryLimit = MEMORY_LIMIT if memoryLimit is None else memoryLimit
+    tempDirectory = TEMP_DIR if tempDirectory is None else tempDirectory
+
+    con = duckdb.connect()
+    con.execute(f"SET memory_limit = '{memoryLimit}'")
+    con.execute(f"SET temp_directory = '{Path(tempDirectory).as_posix()}'")
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+
+    # pandas str.title(), not a DuckDB builtin
+    con.create_function('title', lambda name: None if name is None else name.title(), ['VARCHAR'], 'VARCHAR')
+
+    register_references(con=con, names=references)
+
+    return con
+
+
+def quote(value=None):
+    ''' SQL string literal '''
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def read_csv_sql(fl=None, types=None, allText=None):
+    ''' read_csv() table function with the pd.read_csv missing values '''
+    types = {} if types is None else types
+    allText = False if allText is None else allText
+
+    options = ['header = true']
+    if allText:
+        options.append('all_varchar = true')
+    else:
+        options.append('nullstr = [' + ', '.join(quote(value) for value in DEFAULT_NA_VALUES) + ']')
+    if types:
+        options.append('types = {' + ', '.join(f'{quote(column)}: {quote(name)}' for column, name in types.items()) + '}')
+
+    return f"read_csv({quote(Path(fl).as_posix() if not str(fl).startswith('http') else fl)}, {', '.join(options)})"
+
+
+def reference_file(name=None, referenceDir=None):
+    ''' cached parquet of a reference table if there is one, else its source csv '''
+    referenceDir = REFERENCE_DIR if referenceDir is None else referenceDir
+
+    if referenceDir is not None:
+        fl = Path(referenceDir) / f'{name}.parquet'
+        if fl.exists():
+            return f"read_parquet({quote(fl.as_posix())})"
+
+    return read_csv_sql(REFERENCE_SOURCES[name], allText=True)
+
+
+def register_references(con=None, names=None, referenceDir=None):
+    ''' create views for reference tables (REFERENCE_SOURCES) or derived views (REFERENCE_VIEWS)
+
+    a view reads its file when it is created, so only the ones a query uses are registered
+    '''
+    names = [] if names is None else names
+
+    for name in names:
+        assert name in REFERENCE_SOURCES or name in REFERENCE_VIEWS, f"no reference table {name}"
+
+        if name in REFERENCE_VIEWS:
+            table, query = REFERENCE_VIEWS[name]
+            register_references(con=con, names=[table], referenceDir=referenceDir)
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS {query}")
+        else:
+            con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM {reference_file(name, referenceDir)}")
+
+def cache_reference_tables(outputDir=None, names=None):
+    ''' download the reference tables once and store them as parquet
+
+    input
+    -----
+    outputDir: cache directory [default: REFERENCE_DIR]
+    names: tables to cache [default: all of REFERENCE_SOURCES]
+    '''
+    outputDir = REFERENCE_DIR if outputDir is None else outputDir
+    names = list(REFERENCE_SOURCES) if names is None else names
+
+    assert isinstance(outputDir, str), f"outputDir must be a string"
+
+    out_dir = Path(outputDir).as_posix()
+    make_dir(path=out_dir)
+
+    con = duckdb.connect()
+    for name in names:
+        con.execute(f"COPY (SELECT * FROM {read_csv_sql(REFERENCE_SOURCES[name], allText=True)}) "
+                    f"TO {quote(f'{out_dir}/{name}.parquet')} (FORMAT parquet)")
+
+
+def emissions_id_sql(prefix=None, actor_id=None, year=None):
+    ''' f"{prefix}:{actor_id}:{year}" like the pandas apply, a missing actor is "nan" '''
+    return f"concat({prefix}, ':', coalesce({actor_id}, 'nan'), ':', CAST({year} AS VARCHAR))"
+
+
+def collect_emissions_agg(con=None, query=None, outputDir=None, tableName=None):
+    ''' run an EmissionsAgg query and write the table
+
+    the result goes through apply_dtype_plan() and to_csv()
+    like the pandas path, so both backends write the same file
+
+    input
+    -----
+    con: connection from connect()
+    query: SELECT with the EmissionsAgg columns and a row_id tie breaker
+    outputDir: output directory
+    tableName: name of the table to create
+
+    output
+    ------
+    df: EmissionsAgg dataframe (pandas)
+    '''
+    out_dir = Path(outputDir).as_posix()
+    make_dir(path=out_dir)
+
+    # same order as sort_values(by=['actor_id', 'year']) on the melted rows
+    df = con.execute(f'''
+        SELECT emissions_id, actor_id, year, total_emissions, datasource_id
+        FROM ({query})
+        ORDER BY actor_id NULLS LAST, year, row_id
+    ''').df()
+
+    df = apply_dtype_plan(df)
+
+    df.to_csv(f'{out_dir}/{tableName}.csv', index=False)
+
+    return df
+
+
+def primap_emissions_sql(fl=None, datasourceDict=None, entity=None, category=None, scenario=None):
+    ''' harmonize_primap_emissions() as one query over the PRIMAP csv and iso_codes
+
+    output
+    ------
+    query for collect_emissions_agg()
+    '''
+    codes_to_drop = ['EARTH', 'ANNEXI', 'NONANNEXI', 'AOSIS', 'BASIC', 'EU27BX', 'LDC', 'UMBRELLA', 'ANT']
+
+    return f'''
+        WITH subset AS (
+            SELECT *, row_number() OVER () AS row_id
+            FROM {read_csv_sql(fl, types={column: 'VARCHAR' for column in PRIMAP_DTYPES})}
+            WHERE entity = {quote(entity)}
+              AND "category (IPCC2006_PRIMAP)" = {quote(category)}
+              AND "scenario (PRIMAP-hist)" = {quote(scenario)}
+        ),
+        merged AS (
+            SELECT s.*, i.iso2, i.iso3
+            FROM subset s
+            LEFT JOIN iso_codes i ON s."area (ISO3)" = i.iso3
+        ),
+        long AS (
+            UNPIVOT merged ON COLUMNS('^[0-9]+$') INTO NAME year VALUE emissions
+        )
+        SELECT {emissions_id_sql('source', 'iso2', 'year')} AS emissions_id,
+               iso2 AS actor_id,
+               CAST(year AS INTEGER) AS year,
+               CAST(emissions AS DOUBLE) * 1000 AS total_emissions,
+               {quote(datasourceDict['datasource_id'])} AS datasource_id,
+               row_id
+        FROM long
+        WHERE emissions IS NOT NULL
+          AND (iso3 IS NULL OR iso3 NOT IN ({', '.join(quote(code) for code in codes_to_drop)}))
+          -- a missing area code is kept, like ~(df == 'ANT') in pandas
+          AND "area (ISO3)" IS DISTINCT FROM 'ANT'
+    '''
+
+
+def epa_state_ghg_sql(con=None, files=None, datasourceDict=None):
+    ''' harmonize_epa_state_ghg() as one query over the state csv files and us_states
+
+    output
+    ------
+    query for collect_emissions_agg()
+    '''
+
+    def select_each_file(i, fl):
+        source = read_csv_sql(fl)
+        columns = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+        first_column = columns[0]
+        state = ''.join(re.search(r"(.*)\sEmissions.*", first_column).groups())
+        return f'''
+            SELECT {i} AS file_id, row_id, {quote(state)} AS state, year, CAST(total_emissions AS DOUBLE) AS total_emissions
+            FROM (
+                SELECT * EXCLUDE ("{first_column}"), row_number() OVER () AS row_id
+                FROM {source}
+                WHERE "{first_column}" = 'Total'
+            )
+            -- keep missing years, like df_wide_to_long() without dropna
+            UNPIVOT INCLUDE NULLS (total_emissions FOR year IN (COLUMNS('^[0-9]+$')))
+        '''
+
+    files_sql = ' UNION ALL '.join(select_each_file(i, fl) for i, fl in enumerate(files))
+
+    return f'''
+        WITH long AS ({files_sql})
+        SELECT {emissions_id_sql(quote('EPA_state_GHG_inventory'), 's.actor_id', 'l.year')} AS emissions_id,
+               s.actor_id,
+               CAST(l.year AS INTEGER) AS year,
+               l.total_emissions * 10**6 AS total_emissions,
+               {quote(datasourceDict['datasource_id'])} AS datasource_id,
+               -- melt order: file, year, row
+               row_number() OVER (ORDER BY l.file_id, l.year, l.row_id) AS row_id
+        FROM long l
+        LEFT JOIN us_states s ON l.state = s.name
+    '''
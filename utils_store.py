@@ -0,0 +1,282 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from utils import make_dir
+from utils import apply_dtype_plan
+from utils_keys import add_keys
+from utils_keys import load_key_dictionaries
+from utils_keys import remap_key_columns
+from utils_keys import sort_order
+
+# "NA" is the ISO code for Namibia, only empty cells are missing values
+NA_VALUES = ['']
+
+EMISSIONS_COLUMNS = [
+    'emissions_id',
+    'actor_id',
+    'year',
+    'total_emissions',
+    'methodology_id',
+    'datasource_id',
+]
+
+# the store is sorted on these columns
+STORE_SORT_COLUMNS = ['actor_id', 'year', 'datasource_id']
+
+
+def read_harmonized_csv(fl=None):
+    ''' read a harmonized output table, keeping "NA" as a string '''
+    return pd.read_csv(fl, keep_default_na=False, na_values=NA_VALUES)
+
+
+def read_emissions_tables(dataDir=None):
+    ''' read every EmissionsAgg, DataSource and Methodology table under dataDir
+
+    input
+    -----
+    dataDir: root of the emissions tree [default: ./data_emissions]
+
+    output
+    ------
+    dictionary {'EmissionsAgg': df, 'DataSource': df, 'Methodology': df}
+    each EmissionsAgg row gets a "source_dir" column with its directory
+    '''
+    dataDir = './data_emissions' if dataDir is None else dataDir
+
+    assert isinstance(dataDir, str), f"dataDir must be a string"
+
+    path = Path(dataDir)
+
+    def read_all(tableName):
+        files = sorted(path.glob(f'**/{tableName}.csv'))
+        dfs = []
+        for fl in files:
+            df = read_harmonized_csv(fl)
+            df['source_dir'] = fl.parent.relative_to(path).as_posix()
+            dfs.append(df)
+        return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+
+    df_emissions = read_all('EmissionsAgg')
+    df_datasource = read_all('DataSource')
+    df_methodology = read_all('Methodology')
+
+    # not every source has a methodology
+    if 'methodology_id' not in df_emissions.columns:
+        df_emissions['methodology_id'] = np.nan
+
+    df_emissions = df_emissions[EMISSIONS_COLUMNS + ['source_dir']]
+
+    # the same datasource or methodology can be written in several directories
+    if len(df_datasource) > 0:
+        df_datasource = (
+            df_datasource
+            .drop(columns=['source_dir'])
+            .drop_duplicates(subset=['datasource_id'], keep='last')
+            .reset_index(drop=True)
+        )
+    if len(df_methodology) > 0:
+        df_methodology = (
+            df_methodology
+            .drop(columns=['source_dir'])
+            .drop_duplicates(subset=['methodology_id'], keep='last')
+            .reset_index(drop=True)
+        )
+
+    return {'EmissionsAgg': df_emissions,
+            'DataSource': df_datasource,
+            'Methodology': df_methodology}
+
+
+def actor_offsets(actor_ids=None):
+    ''' [start, stop) row offsets of each actor in a column sorted by actor_id
+
+    output
+    ------
+    df: dataframe with columns actor_id, start, stop
+    '''
+    actor_ids = np.asarray(actor_ids, dtype=object)
+
+    # boundaries where the actor changes
+    is_start = np.ones(len(actor_ids), dtype=bool)
+    is_start[1:] = actor_ids[1:] != actor_ids[:-1]
+    start = np.flatnonzero(is_start)
+    stop = np.append(start[1:], len(actor_ids))
+
+    return pd.DataFrame({'actor_id': actor_ids[start],
+                         'start': start,
+                         'stop': stop})
+
+
+def build_emissions_store(dataDir=None, storeDir=None, keysDir=None):
+    ''' consolidate all emissions tables into one sorted columnar store
+
+    input
+    -----
+    dataDir: root of the emissions tree [default: ./data_emissions]
+    storeDir: where the store is written [default: ./store/emissions]
+    keysDir: key dictionaries, see utils_keys [default: KEYS_DIR]
+
+    output
+    ------
+    {storeDir}/EmissionsAgg.parquet  all emissions, sorted by (actor_id, year, datasource_id),
+                                     with int32 actor_key and datasource_key
+    {storeDir}/DataSource.parquet    all datasources
+    {storeDir}/Methodology.parquet   all methodologies
+    {storeDir}/ActorIndex.parquet    [start, stop) row range of each actor_id
+    '''
+    storeDir = './store/emissions' if storeDir is None else storeDir
+
+    assert isinstance(storeDir, str), f"storeDir must be a string"
+
+    # create out_dir if does not exist
+    out_dir = Path(storeDir).as_posix()
+    make_dir(path=out_dir)
+
+    tables = read_emissions_tables(dataDir=dataDir)
+
+    # stable integer keys, the same across builds
+    keys = load_key_dictionaries(keysDir=keysDir)
+    df = add_keys(tables['EmissionsAgg'], keys=keys)
+    if len(tables['DataSource']) > 0:
+        tables['DataSource'] = add_keys(tables['DataSource'], keys={'datasource_id': keys['datasource_id']})
+
+    # sort once on the integer keys, every lookup relies on this order
+    df = df.iloc[sort_order(df, by=STORE_SORT_COLUMNS, keys=keys)].reset_index(drop=True)
+
+    # keep missing methodologies missing instead of the string "nan"
+    methodology_id = df['methodology_id'].astype('category')
+    df = apply_dtype_plan(df)
+    df['methodology_id'] = methodology_id
+    df['source_dir'] = df['source_dir'].astype('category')
+
+    # save the dictionaries before writing keys, a build running at the same time may move new keys
+    remaps = {column: dictionary.save() for column, dictionary in keys.items()}
+    df = remap_key_columns(df, remaps=remaps)
+    if len(tables['DataSource']) > 0:
+        tables['DataSource'] = remap_key_columns(tables['DataSource'], remaps={'datasource_id': remaps['datasource_id']})
+
+    df_index = actor_offsets(df['actor_id'].astype(str))
+
+    df.to_parquet(f'{out_dir}/EmissionsAgg.parquet', index=False)
+    df_index.to_parquet(f'{out_dir}/ActorIndex.parquet', index=False)
+    tables['DataSource'].to_parquet(f'{out_dir}/DataSource.parquet', index=False)
+    tables['Methodology'].to_parquet(f'{out_dir}/Methodology.parquet', index=False)
+
+    return df
+
+
+def load_emissions_store(storeDir=None):
+    ''' load the store built by build_emissions_store() and its indexes
+
+    output
+    ------
+    store: dictionary passed to query_emissions()
+    '''
+    storeDir = './store/emissions' if storeDir is None else storeDir
+
+    assert isinstance(storeDir, str), f"storeDir must be a string"
+
+    out_dir = Path(storeDir).as_posix()
+
+    df = pd.read_parquet(f'{out_dir}/EmissionsAgg.parquet')
+    df_index = pd.read_parquet(f'{out_dir}/ActorIndex.parquet')
+
+    # secondary indexes, built once per load
+    years = df['year'].to_numpy()
+    year_order = np.argsort(years, kind='stable')
+
+    # grouped on the integer key, looked up by datasource_id
+    datasource_keys = dict(df[['datasource_id', 'datasource_key']].drop_duplicates().itertuples(index=False))
+    datasource_index = {
+        key: np.asarray(positions)
+        for key, positions in df.groupby('datasource_key').indices.items()
+    }
+
+    return {
+        'EmissionsAgg': df,
+        'DataSource': pd.read_parquet(f'{out_dir}/DataSource.parquet'),
+        'Methodology': pd.read_parquet(f'{out_dir}/Methodology.parquet'),
+        'actor_index': dict(zip(df_index['actor_id'],
+                                zip(df_index['start'], df_index['stop']))),
+        'year_order': year_order,
+        'years_sorted': years[year_order],
+        'datasource_keys': datasource_keys,
+        'datasource_index': datasource_index,
+    }
+
+
+def query_emissions(store=None,
+                    actor_id=None,
+                    start_year=None,
+                    end_year=None,
+                    datasource_id=None,
+                    with_datasource=None):
+    ''' slice of the emissions store
+
+    the most selective index is used to find candidate rows
+    (actor range, then datasource positions, then the year order)
+    and the remaining conditions are only checked on those rows
+
+    input
+    -----
+    store: output of load_emissions_store()
+    actor_id: actor to return
+    start_year, end_year: inclusive year range
+    datasource_id: datasource to return
+    with_datasource: join DataSource and Methodology columns [default: False]
+
+    output
+    ------
+    df: matching emissions, ordered by (actor_id, year, datasource_id)
+    '''
+    with_datasource = False if with_datasource is None else with_datasource
+
+    assert isinstance(store, dict), f"store must be the output of load_emissions_store()"
+
+    df = store['EmissionsAgg']
+    years = df['year'].to_numpy()
+
+    # an unknown datasource matches nothing
+    datasource_key = None if datasource_id is None else store['datasource_keys'].get(datasource_id)
+
+    if actor_id is not None:
+        start, stop = store['actor_index'].get(actor_id, (0, 0))
+
+        # years are sorted within an actor
+        if start_year is not None:
+            start = start + np.searchsorted(years[start:stop], start_year, side='left')
+        if end_year is not None:
+            stop = start + np.searchsorted(years[start:stop], end_year, side='right')
+
+        positions = np.arange(start, max(start, stop))
+
+    elif datasource_id is not None:
+        positions = store['datasource_index'].get(datasource_key, np.array([], dtype=int))
+
+    elif start_year is not None or end_year is not None:
+        years_sorted = store['years_sorted']
+        lo = 0 if start_year is None else np.searchsorted(years_sorted, start_year, side='left')
+        hi = len(years_sorted) if end_year is None else np.searchsorted(years_sorted, end_year, side='right')
+        positions = np.sort(store['year_order'][lo:hi])
+
+    else:
+        positions = np.arange(len(df))
+
+    # remaining conditions, only on candidate rows
+    mask = np.ones(len(positions), dtype=bool)
+    if datasource_id is not None and actor_id is not None:
+        mask &= (df['datasource_key'].to_numpy()[positions] == datasource_key)
+    if actor_id is None and datasource_id is not None:
+        if start_year is not None:
+            mask &= years[positions] >= start_year
+        if end_year is not None:
+            mask &= years[positions] <= end_year
+
+    df_out = df.iloc[positions[mask]]
+
+    if with_datasource:
+        df_out = df_out.merge(store['DataSource'], on='datasource_id', how='left', suffixes=('', '_datasource'))
+        if len(store['Methodology']) > 0:
+            df_out = df_out.merge(store['Methodology'], on='methodology_id', how='left', suffixes=('', '_methodology'))
+
+    return df_out.reset_index(drop=True)
@@ -0,0 +1,224 @@
+import pandas as pd
+from pathlib import Path
+from utils_store import read_harmonized_csv
+
+# directories with harmonized output tables
+OUTPUT_DIRS = [
+    './data_emissions',
+    './data_targets',
+    './data_contextual',
+    './actor',
+    './Kosovo',
+]
+
+# primary key of each table in the OpenClimate schema
+TABLE_PRIMARY_KEYS = {
+    'Actor': ['actor_id'],
+    'ActorIdentifier': ['actor_id', 'identifier', 'namespace', 'datasource_id'],
+    'ActorName': ['actor_id', 'name', 'language'],
+    'DataSource': ['datasource_id'],
+    'DataSourceTag': ['datasource_id', 'tag_id'],
+    'EmissionsAgg': ['emissions_id'],
+    'GDP': ['actor_id', 'year', 'datasource_id'],
+    'Methodology': ['methodology_id'],
+    'Population': ['actor_id', 'year', 'datasource_id'],
+    'Publisher': ['id'],
+    'Tag': ['tag_id'],
+    'Target': ['target_id'],
+    'TargetTag': ['target_id', 'tag_id'],
+    'Territory': ['actor_id', 'datasource_id'],
+}
+
+# other keys that must be unique
+TABLE_UNIQUE_KEYS = {
+    'EmissionsAgg': [['actor_id', 'year', 'datasource_id']],
+}
+
+# tables that are re-declared in several directories,
+# identical copies are fine, conflicting copies are not
+REFERENCE_TABLES = [
+    'DataSource',
+    'DataSourceTag',
+    'Methodology',
+    'Publisher',
+    'Tag',
+]
+
+# actors defined outside this repository
+REFERENCE_ACTOR_FILES = [
+    'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-1/Actor.csv',
+    'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-ISO-3166/main/ISO-3166-2/Actor.csv',
+    'https://raw.githubusercontent.com/Open-Earth-Foundation/OpenClimate-UNLOCODE/main/UNLOCODE/Actor.csv',
+]
+
+
+def read_output_tables(dataDirs=None):
+    ''' read every schema table under the output directories
+
+    input
+    -----
+    dataDirs: list of directories [default: OUTPUT_DIRS]
+
+    output
+    ------
+    dictionary {table_name: df}, tables with the same name are concatenated
+    and each row has a "source_dir" column with the directory it came from
+    '''
+    dataDirs = OUTPUT_DIRS if dataDirs is None else dataDirs
+
+    assert isinstance(dataDirs, list), f"dataDirs must be a list"
+
+    frames = {}
+    for dataDir in dataDirs:
+        for fl in sorted(Path(dataDir).glob('**/*.csv')):
+            if fl.stem not in TABLE_PRIMARY_KEYS:
+                continue
+            df = read_harmonized_csv(fl)
+            df['source_dir'] = fl.parent.as_posix()
+            frames.setdefault(fl.stem, []).append(df)
+
+    return {name: pd.concat(dfs, ignore_index=True) for name, dfs in frames.items()}
+
+
+def duplicate_key_violations(df=None, table=None, key=None):
+    ''' rows whose key is not unique, one record per duplicated key '''
+    if not all(column in df.columns for column in key):
+        return []
+
+    filt = df.duplicated(subset=key, keep=False)
+    if not filt.any():
+        return []
+
+    df_dup = df.loc[filt]
+    counts = df_dup.groupby(key, dropna=False).agg(
+        count=('source_dir', 'size'),
+        source_dir=('source_dir', lambda dirs: ';'.join(sorted(set(dirs)))))
+
+    return [{
+        'check': 'duplicate_key',
+        'table': table,
+        'column': ','.join(key),
+        'value': ':'.join(str(v) for v in (idx if isinstance(idx, tuple) else (idx,))),
+        'count': row['count'],
+        'source_dir': row['source_dir'],
+    } for idx, row in counts.iterrows()]
+
+
+def missing_reference_violations(df=None, table=None, column=None, known=None):
+    ''' values of column that are not in the known set '''
+    if column not in df.columns:
+        return []
+
+    values = df[column]
+    filt = values.notna() & ~values.isin(known)
+    if not filt.any():
+        return []
+
+    counts = df.loc[filt].groupby(column).agg(
+        count=('source_dir', 'size'),
+        source_dir=('source_dir', lambda dirs: ';'.join(sorted(set(dirs)))))
+
+    return [{
+        'check': 'missing_reference',
+        'table': table,
+        'column': column,
+        'value': value,
+        'count': row['count'],
+        'source_dir': row['source_dir'],
+    } for value, row in counts.iterrows()]
+
+
+def validate_tables(tables=None, referenceActorFiles=None):
+    ''' check primary keys and references across harmonized tables
+
+    checks
+    ------
+    - primary keys (emissions_id, target_id, (actor_id, year, datasource_id), ...) are unique
+    - every actor_id is in an Actor table (here or in referenceActorFiles)
+    - every datasource_id is in a DataSource table
+    - every methodology_id is in a Methodology table
+
+    all checks are hash-based (duplicated / isin), no pairwise comparisons
+
+    input
+    -----
+    tables: output of read_output_tables()
+    referenceActorFiles: Actor tables defined outside this repo [default: REFERENCE_ACTOR_FILES]
+
+    output
+    ------
+    df: one row per violation with columns
+        check, table, column, value, count, source_dir
+    '''
+    referenceActorFiles = REFERENCE_ACTOR_FILES if referenceActorFiles is None else referenceActorFiles
+
+    assert isinstance(tables, dict), f"tables must be a dictionary"
+    assert isinstance(referenceActorFiles, list), f"referenceActorFiles must be a list"
+
+    violations = []
+
+    # key uniqueness
+    for table, df in tables.items():
+        if table in REFERENCE_TABLES:
+            df = df.drop_duplicates(subset=[c for c in df.columns if c != 'source_dir'])
+
+        for key in [TABLE_PRIMARY_KEYS[table]] + TABLE_UNIQUE_KEYS.get(table, []):
+            violations += duplicate_key_violations(df=df, table=table, key=key)
+
+    # known ids
+    actor_tables = [tables[name]['actor_id'] for name in ['Actor'] if name in tables]
+    actor_tables += [read_harmonized_csv(fl)['actor_id'] for fl in referenceActorFiles]
+
+    known = {
+        'actor_id': set(pd.concat(actor_tables)) | {'EARTH'} if actor_tables else {'EARTH'},
+        'datasource_id': set(tables['DataSource']['datasource_id']) if 'DataSource' in tables else set(),
+        'methodology_id': set(tables['Methodology']['methodology_id']) if 'Methodology' in tables else set(),
+    }
+
+    # referential integrity
+    for table, df in tables.items():
+        for column, known_values in known.items():
+            # a table does not reference its own key
+            if TABLE_PRIMARY_KEYS[table] == [column]:
+                continue
+            violations += missing_reference_violations(df=df, table=table, column=column, known=known_values)
+
+    columns = ['check', 'table', 'column', 'value', 'count', 'source_dir']
+    return pd.DataFrame(violations, columns=columns)
+
+
+def validate_output_tree(dataDirs=None, referenceActorFiles=None, outputFile=None):
+    ''' validate every output table in the repository
+
+    input
+    -----
+    dataDirs: list of directories [default: OUTPUT_DIRS]
+    referenceActorFiles: Actor tables defined outside this repo [default: REFERENCE_ACTOR_FILES]
+    outputFile: optional csv file for the violations
+
+    output
+    ------
+    df: violations, see validate_tables()
+    '''
+    tables = read_output_tables(dataDirs=dataDirs)
+    df = validate_tables(tables=tables, referenceActorFiles=referenceActorFiles)
+
+    if outputFile is not None:
+        df.to_csv(outputFile, index=False)
+
+    return df
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', help='csv file for the violations', default=None)
+    parser.add_argument('--offline', action='store_true', help='only use Actor tables in this repository')
+    args = parser.parse_args()
+
+    df = validate_output_tree(referenceActorFiles=[] if args.offline else None,
+                              outputFile=args.output)
+
+    if len(df) > 0:
+        print(df.groupby(['check', 'table', 'column'])['count'].sum().to_string())
+    print(f'{len(df)} violations')
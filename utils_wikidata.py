@@ -0,0 +1,240 @@
+import logging
+import os
+import pandas as pd
+
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+
+# how several values for the same key are reduced to one
+DEDUPE_POLICIES = ['max', 'latest', 'median']
+
+
+def read_source(fl=None, itemColumn=None, codeColumn=None, valueColumn=None, yearColumn=None):
+    ''' read a Wikidata extract into typed columns
+
+    input
+    -----
+    fl: extract csv (source/wikidata-*)
+    itemColumn: entity url column (item, city, region)
+    codeColumn: identifier column (locode, iso31662)
+    valueColumn: numeric column (population, area)
+    yearColumn: optional year column (populationYear)
+
+    output
+    ------
+    df: dataframe with columns qid, code, value (float) and year (Int64),
+        value/year are NaN where the source value does not parse
+    '''
+    columns = [itemColumn, codeColumn, valueColumn] + ([yearColumn] if yearColumn else [])
+
+    # "NA" is an ISO code, only empty cells are missing
+    df = pd.read_csv(fl, usecols=columns, dtype=str, keep_default_na=False, na_values=[''])
+
+    df_out = pd.DataFrame({
+        'qid': df[itemColumn].str.replace(ENTITY_PREFIX, '', regex=False),
+        'code': df[codeColumn],
+        'value': pd.to_numeric(df[valueColumn], errors='coerce'),
+    })
+    if yearColumn:
+        df_out['year'] = pd.to_numeric(df[yearColumn], errors='coerce').astype('Int64')
+
+    return df_out
+
+
+def locode_actor_ids(codes=None):
+    ''' "ITRGO" -> "IT RGO" '''
+    return codes.str[0:2] + ' ' + codes.str[2:5]
+
+
+def known_actors(actor_ids=None, is_actor_id=None):
+    ''' boolean mask of actor_ids that exist, is_actor_id is called once per distinct code '''
+    known = {actor_id: is_actor_id(actor_id) for actor_id in pd.unique(actor_ids)}
+
+    for actor_id, exists in known.items():
+        if not exists:
+            logging.warning(f'skipping {actor_id}: no such actor')
+
+    return actor_ids.map(known).astype(bool)
+
+
+def valid_values(df=None):
+    ''' boolean mask of rows whose value (and year) parsed '''
+    filt = df['value'].notna()
+    if 'year' in df.columns:
+        filt &= df['year'].notna()
+
+    for actor_id in df.loc[~filt, 'actor_id']:
+        logging.warning(f'skipping {actor_id}: invalid data')
+
+    return filt
+
+
+def dedupe_values(df=None, keys=None, policy=None):
+    ''' one value per key
+
+    input
+    -----
+    df: dataframe with the key columns and a value column
+    keys: columns identifying a record, e.g. ['actor_id', 'year']
+    policy: max, latest (last in the source) or median [default: max]
+
+    output
+    ------
+    df: key columns and value, actors in order of first appearance
+    '''
+    policy = 'max' if policy is None else policy
+
+    assert policy in DEDUPE_POLICIES, f"policy must be one of {DEDUPE_POLICIES}"
+
+    grouped = df.groupby(keys, sort=False)['value']
+    if policy == 'latest':
+        df_out = grouped.last().reset_index()
+    else:
+        df_out = grouped.agg(policy).reset_index()
+
+    # keep the records of an actor together, in order of first appearance
+    actor_order = pd.factorize(df_out['actor_id'])[0]
+    return df_out.iloc[actor_order.argsort(kind='stable')].reset_index(drop=True)
+
+
+def actor_identifiers(df=None, datasource_id=None, subset=None):
+    ''' ActorIdentifier table linking actors to their Wikidata QID
+
+    subset: columns a row is unique on [default: ['actor_id'], first QID of each actor]
+    '''
+    subset = ['actor_id'] if subset is None else subset
+
+    df_out = pd.DataFrame({
+        'actor_id': df['actor_id'],
+        'identifier': df['qid'],
+        'namespace': 'Wikidata',
+        'datasource_id': datasource_id,
+    })
+
+    return df_out.drop_duplicates(subset=subset).reset_index(drop=True)
+
+
+def harmonize_source(df=None, is_actor_id=None, keys=None, policy=None):
+    ''' resolve actors, drop invalid values and deduplicate
+
+    input
+    -----
+    df: output of read_source() with an actor_id column
+    is_actor_id: function code -> bool
+    keys: dedupe keys, ['actor_id', 'year'] for populations, ['actor_id'] for areas
+    policy: see dedupe_values()
+
+    output
+    ------
+    df_valid: rows that passed (for ActorIdentifier)
+    df_values: one rounded value per key
+    '''
+    df = df.loc[known_actors(df['actor_id'], is_actor_id)]
+    df = df.loc[valid_values(df)]
+
+    # round each value before reducing, like round(float(value)) per row
+    df_values = dedupe_values(df=df.assign(value=df['value'].round()), keys=keys, policy=policy)
+    df_values['value'] = df_values['value'].round().astype('int64')
+
+    return df, df_values
+
+
+def changed_actors(df=None, df_previous=None):
+    ''' actors with any source row added, removed or changed since the previous extract
+
+    rows are compared on (qid, code, year) and value, counting repeats,
+    so an actor is unchanged only if its source rows are exactly the same
+    '''
+    columns = [column for column in ['actor_id', 'qid', 'code', 'year', 'value'] if column in df.columns]
+
+    counts = (
+        df.value_counts(subset=columns, dropna=False).rename('n').reset_index()
+        .merge(df_previous.value_counts(subset=columns, dropna=False).rename('n').reset_index(),
+               on=columns, how='outer', suffixes=('', '_previous'))
+    )
+    filt = counts['n'].fillna(0) != counts['n_previous'].fillna(0)
+
+    return set(counts.loc[filt, 'actor_id'])
+
+
+def read_previous_output(outputDir=None, tableName=None, valueColumn=None):
+    ''' ActorIdentifier and value table of the previous snapshot, in the shape of harmonize_source() '''
+    df_identifiers = pd.read_csv(f'{outputDir}/ActorIdentifier.csv', dtype=str, keep_default_na=False)
+    df_values = pd.read_csv(f'{outputDir}/{tableName}.csv', keep_default_na=False, dtype={'actor_id': str})
+
+    return {
+        'identifiers': df_identifiers[['actor_id', 'identifier']].rename(columns={'identifier': 'qid'}),
+        'values': df_values.drop(columns=['datasource_id']).rename(columns={valueColumn: 'value'}),
+    }
+
+
+def harmonize_incremental(df=None, df_previous=None, previous=None, is_actor_id=None, keys=None, policy=None):
+    ''' harmonize_source() on the actors that changed since the previous extract
+
+    actors whose source rows are unchanged keep their previous output rows,
+    actors in the previous ActorIdentifier are known without an API lookup
+
+    input
+    -----
+    df: new extract, output of read_source() with an actor_id column
+    df_previous: previous extract, same shape
+    previous: output of read_previous_output()
+    is_actor_id, keys, policy: see harmonize_source()
+
+    output
+    ------
+    same as harmonize_source()
+    '''
+    affected = changed_actors(df=df, df_previous=df_previous)
+    logging.info(f'{len(affected)} actors changed since the previous extract')
+
+    # seed the lookup with actors resolved in the previous snapshot
+    resolved = set(previous['identifiers']['actor_id'])
+    def is_known_actor_id(actor_id):
+        return True if actor_id in resolved else is_actor_id(actor_id)
+
+    df_valid, df_values = harmonize_source(df=df.loc[df['actor_id'].isin(affected)],
+                                           is_actor_id=is_known_actor_id,
+                                           keys=keys,
+                                           policy=policy)
+
+    # carry over unchanged actors
+    df_identifiers = previous['identifiers']
+    df_identifiers = df_identifiers.loc[~df_identifiers['actor_id'].isin(affected)]
+    df_previous_values = previous['values']
+    df_previous_values = df_previous_values.loc[~df_previous_values['actor_id'].isin(affected)]
+
+    df_valid = pd.concat([df_identifiers, df_valid[['actor_id', 'qid']]], ignore_index=True)
+    df_values = pd.concat([df_previous_values, df_values], ignore_index=True)
+
+    # same order as a full run, first appearance among the parsed rows of the new extract
+    filt = df['value'].notna()
+    if 'year' in df.columns:
+        filt &= df['year'].notna()
+    df_parsed = df.loc[filt].reset_index(drop=True)
+
+    def in_order(df_out, keys):
+        first = df_parsed.reset_index().groupby(keys, as_index=False)['index'].min()
+        order = df_out[keys].merge(first, on=keys, how='left')['index'].to_numpy()
+        return df_out.iloc[order.argsort(kind='stable')].reset_index(drop=True)
+
+    return in_order(df_valid, ['actor_id', 'qid']), in_order(df_values, ['actor_id'])
+
+
+def write_tables(outputDir=None, tables=None):
+    ''' write {name: dataframe or list of dicts} as {outputDir}/{name}.csv '''
+    os.makedirs(outputDir, exist_ok=True)
+
+    for name, rows in tables.items():
+        df = rows if isinstance(rows, pd.core.frame.DataFrame) else pd.DataFrame(rows)
+        # csv.DictWriter line endings, so regenerated files only differ by content
+        df.to_csv(f'{outputDir}/{name}.csv', index=False, lineterminator='\r\n')
+
+
+def reference_tables(publisher=None, datasource=None, tags=None):
+    ''' Publisher, DataSource, Tag and DataSourceTag tables of a script '''
+    return {
+        'Publisher': [publisher],
+        'DataSource': [datasource],
+        'Tag': tags,
+        'DataSourceTag': [{'datasource_id': datasource['datasource_id'], 'tag_id': t['tag_id']} for t in tags],
+    }
@@ -0,0 +1,195 @@
+import bz2
+import csv
+import gzip
+import json
+import logging
+import os
+from multiprocessing import Pool
+
+ENTITY_PREFIX = 'http://www.wikidata.org/entity/'
+
+# input files of the wikidata_* scripts, same names and columns
+OUTPUTS = {
+    'city-population': {
+        'file': 'source/wikidata-city-population/wikidata-city-population.csv',
+        'fieldnames': ['item', 'locode', 'population', 'populationYear'],
+    },
+    'subnational-population': {
+        'file': 'source/wikidata-subnational-population/wikidata-subnational-population.csv',
+        'fieldnames': ['item', 'iso31662', 'population', 'populationYear'],
+    },
+    'city-area': {
+        'file': 'source/Wikidata-City-Area/wikidata-city-area.csv',
+        'fieldnames': ['city', 'locode', 'area'],
+    },
+    'subnational-area': {
+        'file': 'source/Wikidata-Subnational-Area/wikidata-subnational-area.csv',
+        'fieldnames': ['region', 'iso31662', 'area'],
+    },
+}
+
+# area units to km2 (P2370 conversions of the common units)
+AREA_UNITS_KM2 = {
+    'Q712226': 1.0,                 # square kilometre
+    'Q25343': 1e-6,                 # square metre
+    'Q35852': 0.01,                 # hectare
+    'Q232291': 2.589988110336,      # square mile
+    'Q81292': 0.0040468564224,      # acre
+    'Q857027': 9.290304e-8,         # square foot
+}
+
+# an entity is only decoded if its line contains one of these
+IDENTIFIER_PROPERTIES = ['P1937', 'P300']
+
+decoder = json.JSONDecoder()
+
+def open_dump(name):
+    if name.endswith('.bz2'):
+        return bz2.open(name, mode='rt', encoding='utf-8')
+    if name.endswith('.gz'):
+        return gzip.open(name, mode='rt', encoding='utf-8')
+    return open(name, encoding='utf-8')
+
+def entity_id(line):
+    # the dump writes "id" right after "type"
+    start = line.find('"id":"') + len('"id":"')
+    return line[start:line.find('"', start)]
+
+def property_statements(line, prop):
+    # decode only this property's statement list, not the whole entity;
+    # statement lists start with "mainsnak", qualifier and reference
+    # snak lists with "snaktype", so this skips those
+    key = f'"{prop}":[{{"mainsnak"'
+    start = line.find(key)
+    if start < 0:
+        return []
+    statements, _ = decoder.raw_decode(line, start + len(prop) + 3)
+    return statements
+
+def statement_value(statement):
+    snak = statement['mainsnak']
+    if snak.get('snaktype') != 'value':
+        return None
+    return snak['datavalue']['value']
+
+def statement_year(statement):
+    for qualifier in statement.get('qualifiers', {}).get('P585', []):
+        if qualifier.get('snaktype') == 'value':
+            # "+2018-00-00T00:00:00Z"
+            time = qualifier['datavalue']['value']['time']
+            return int(time[:time.index('-', 1)])
+    return None
+
+def best_rank(statements):
+    statements = [st for st in statements if st.get('rank') != 'deprecated']
+    preferred = [st for st in statements if st.get('rank') == 'preferred']
+    return preferred if preferred else statements
+
+def identifiers(line, prop):
+    values = [statement_value(st) for st in property_statements(line, prop) if st.get('rank') != 'deprecated']
+    return sorted(set(v.replace(' ', '') for v in values if v))
+
+def populations(line, minYear):
+    rows = []
+    for st in property_statements(line, 'P1082'):
+        value = statement_value(st)
+        year = statement_year(st)
+        if value is None or year is None:
+            continue
+        if minYear is not None and year < minYear:
+            continue
+        rows.append((value['amount'].lstrip('+'), year))
+    return rows
+
+def areas(line):
+    rows = []
+    for st in best_rank(property_statements(line, 'P2046')):
+        value = statement_value(st)
+        if value is None:
+            continue
+        unit = value.get('unit', '').replace(ENTITY_PREFIX, '')
+        if unit not in AREA_UNITS_KM2:
+            logging.debug(f'skipping area unit {unit}')
+            continue
+        rows.append(float(value['amount']) * AREA_UNITS_KM2[unit])
+    return rows
+
+def extract_lines(args):
+    lines, minYear = args
+    out = {name: [] for name in OUTPUTS}
+
+    for line in lines:
+        # cheap substring test before any json decoding
+        if not any(f'"{prop}"' in line for prop in IDENTIFIER_PROPERTIES):
+            continue
+
+        item = ENTITY_PREFIX + entity_id(line)
+        locodes = identifiers(line, 'P1937')
+        iso31662s = identifiers(line, 'P300')
+        if not locodes and not iso31662s:
+            continue
+
+        pops = populations(line, minYear) if '"P1082"' in line else []
+        area_values = areas(line) if '"P2046"' in line else []
+
+        for locode in locodes:
+            out['city-population'] += [(item, locode, pop, year) for pop, year in pops]
+            out['city-area'] += [(item, locode, area) for area in area_values]
+
+        for iso31662 in iso31662s:
+            out['subnational-population'] += [(item, iso31662, pop, year) for pop, year in pops]
+            out['subnational-area'] += [(item, iso31662, area) for area in area_values]
+
+    return out
+
+def read_chunks(name, chunkSize, minYear):
+    chunk = []
+    with open_dump(name) as dump:
+        for line in dump:
+            chunk.append(line)
+            if len(chunk) >= chunkSize:
+                yield (chunk, minYear)
+                chunk = []
+    if chunk:
+        yield (chunk, minYear)
+
+def main(dump, outputDir='.', processes=None, chunkSize=10000, minYear=None):
+
+    files = {}
+    writers = {}
+    seen = {}
+    for name, output in OUTPUTS.items():
+        fl = os.path.join(outputDir, output['file'])
+        os.makedirs(os.path.dirname(fl), exist_ok=True)
+        files[name] = open(fl, mode='w', newline='')
+        writers[name] = csv.writer(files[name])
+        writers[name].writerow(output['fieldnames'])
+        seen[name] = set()
+
+    with Pool(processes=processes) as pool:
+        for i, out in enumerate(pool.imap(extract_lines, read_chunks(dump, chunkSize, minYear))):
+            for name, rows in out.items():
+                # same rows as SELECT DISTINCT
+                rows = [row for row in rows if row not in seen[name]]
+                seen[name].update(rows)
+                writers[name].writerows(rows)
+            logging.debug(f'{(i + 1) * chunkSize} lines')
+
+    for name, fl in files.items():
+        fl.close()
+        logging.info(f'{name}: {len(seen[name])} rows')
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dump', help='Wikidata JSON dump (latest-all.json.bz2 or .gz)')
+    parser.add_argument('-o', '--output', help='root directory for the source/ files', default='.')
+    parser.add_argument('-p', '--processes', type=int, help='worker processes', default=None)
+    parser.add_argument('-c', '--chunk-size', type=int, help='dump lines per worker task', default=10000)
+    parser.add_argument('-y', '--min-year', type=int, help='drop populations before this year', default=None)
+    parser.add_argument('-d', '--debug', action='store_true', help='flag for running debug')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    main(args.dump, outputDir=args.output, processes=args.processes, chunkSize=args.chunk_size, minYear=args.min_year)
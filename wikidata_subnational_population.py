@@ -1,5 +1,8 @@
 import logging
 import requests
+from utils_wikidata import read_source, harmonize_source
+from utils_wikidata import actor_identifiers, write_tables, reference_tables
+from utils_wikidata import read_previous_output, harmonize_incremental
 
 apihost = None
 INPUT_FILE = "source/wikidata-subnational-population/wikidata-subnational-population.csv"
@@ -38,22 +41,6 @@ TAGS = [
      'tag_name': 'Dataset by Evan Prodromou'}
 ]
 
-import csv
-
-def slurp_file(name):
-    data = []
-    with open(name) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            data.append(row)
-    return data
-
-def write_csv(name, rows):
-    with open(f'{OUTPUT_DIR}/{name}.csv', mode='w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
-
 cache = {}
 session = requests.Session()
 def is_actor_id(code):
@@ -72,58 +59,38 @@ def is_actor_id(code):
     logging.debug(f'{code} -> {cache[code]}')
     return cache[code]
 
-def main():
-
-    input = slurp_file(INPUT_FILE)
-
-    actor_identifiers = {}
-    values = {}
-    populations = []
+def read_input(fl):
+    df = read_source(fl,
+                     itemColumn='item',
+                     codeColumn='iso31662',
+                     valueColumn='population',
+                     yearColumn='populationYear')
 
-    for row in input:
+    df['actor_id'] = df['code']
+    return df
 
-        actor_id = row['iso31662']
-        population = round(float(row['population']))
-        year = int(row['populationYear'])
+def main(policy=None, previousInput=None, previousOutput=None):
 
-        if not is_actor_id(actor_id):
-            logging.info(f'skipping {actor_id}')
-            continue
+    df = read_input(INPUT_FILE)
 
-        if actor_id not in actor_identifiers:
-            qno = row['item'].replace('http://www.wikidata.org/entity/', '')
-            actor_identifiers[actor_id] = {
-                'actor_id': actor_id,
-                'identifier': qno,
-                'namespace': 'Wikidata',
-                'datasource_id': DATASOURCE['datasource_id']
-            }
+    # one lookup per distinct actor, one population per actor_id and year
+    if previousInput is None:
+        df_valid, df_values = harmonize_source(df, is_actor_id, keys=['actor_id', 'year'], policy=policy)
+    else:
+        # only the actors that changed since the previous extract
+        previous = read_previous_output(previousOutput, tableName='Population', valueColumn='population')
+        df_valid, df_values = harmonize_incremental(df, read_input(previousInput), previous,
+                                                    is_actor_id, keys=['actor_id', 'year'], policy=policy)
 
-        # Note: we may have years with multiple records
+    df_values = df_values.rename(columns={'value': 'population'})
+    df_values['datasource_id'] = DATASOURCE['datasource_id']
+    df_values = df_values[['actor_id', 'population', 'year', 'datasource_id']]
 
-        if actor_id not in values:
-            values[actor_id] = {}
+    tables = reference_tables(publisher=PUBLISHER, datasource=DATASOURCE, tags=TAGS)
+    tables['ActorIdentifier'] = actor_identifiers(df_valid, DATASOURCE['datasource_id'])
+    tables['Population'] = df_values
 
-        if year not in values[actor_id]:
-            values[actor_id][year] = []
-
-        values[actor_id][year].append(population)
-
-    for id, years in values.items():
-        for year, pops in years.items():
-            populations.append({
-                'actor_id': id,
-                'population': max(pops), # FIXME: better check!
-                'year': year,
-                'datasource_id': DATASOURCE['datasource_id']
-            })
-
-    write_csv('Publisher', [PUBLISHER])
-    write_csv('DataSource', [DATASOURCE])
-    write_csv('Tag', TAGS)
-    write_csv('DataSourceTag', list(map(lambda t: {'datasource_id': DATASOURCE['datasource_id'], 'tag_id': t['tag_id']}, TAGS)))
-    write_csv('ActorIdentifier', list(actor_identifiers.values()))
-    write_csv('Population', populations)
+    write_tables(OUTPUT_DIR, tables)
 
 if __name__ == "__main__":
     import os
@@ -131,9 +98,14 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('-A', '--api', help='API host prefix', default=(os.environ.get('OPENCLIMATE_API') or 'https://openclimate.network'))
     parser.add_argument('-d', '--debug', action='store_true', help='flag for running debug')
+    parser.add_argument('--previous-input', help='previous extract, only changed actors are processed', default=None)
+    parser.add_argument('--previous-output', help='output directory of the previous extract', default=None)
+    parser.add_argument('-p', '--policy', choices=['max', 'latest', 'median'], help='how duplicate values are reduced', default='max')
     args = parser.parse_args()
 
     apihost = args.api
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
 
-    main()
\ No newline at end of file
+    assert (args.previous_input is None) == (args.previous_output is None), "--previous-input needs --previous-output"
+
+    main(policy=args.policy, previousInput=args.previous_input, previousOutput=args.previous_output)
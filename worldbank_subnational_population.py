@@ -38,21 +38,37 @@ TAGS = [
      'tag_name': 'Dataset by Evan Prodromou'}
 ]
 
-import csv
-
-def slurp_file(name):
-    data = []
-    with open(name) as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            data.append(row)
-    return data
-
-def write_csv(name, rows):
-    with open(f'{OUTPUT_DIR}/{name}.csv', mode='w') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
-        writer.writeheader()
-        writer.writerows(rows)
+import re
+import pandas as pd
+from utils import df_wide_to_long
+from utils_wikidata import write_tables
+from utils_wikidata import reference_tables
+
+# year columns look like "2000 [YR2000]"
+YEAR_COLUMN = re.compile(r'^(\d{4}) \[YR\1\]$')
+
+# World Bank marks missing values with ".."
+MISSING_VALUES = ['', '..']
+
+def read_input(fl):
+    ''' read the World Bank extract with one numeric column per year
+
+    every "YYYY [YRYYYY]" column is kept and renamed to its year,
+    missing markers become NaN and the footer rows are dropped
+    '''
+    df = pd.read_csv(fl, dtype=str, keep_default_na=False, na_values=MISSING_VALUES)
+
+    # footer ("Data from database: ...") has no code
+    df = df.loc[df['Country Code'].notna()].reset_index(drop=True)
+
+    years = {column: YEAR_COLUMN.match(column).group(1)
+             for column in df.columns if YEAR_COLUMN.match(column)}
+
+    df_out = df[['Country Code', 'Country Name']].copy()
+    for column, year in years.items():
+        df_out[year] = pd.to_numeric(df[column], errors='coerce')
+
+    return df_out
 
 cache = {}
 session = requests.Session()
@@ -127,42 +143,45 @@ def actor_id_from_row(row):
 
 def main():
 
-    input = slurp_file(INPUT_FILE)
-
-    actor_identifiers = {}
-    populations = []
-
-    for row in input:
+    df = read_input(INPUT_FILE)
 
-        actor_id = actor_id_from_row(row)
+    # one lookup per distinct code, not per row and year
+    df_codes = df[['Country Code', 'Country Name']].drop_duplicates('Country Code')
+    actor_ids = {code: actor_id_from_row({'Country Code': code, 'Country Name': name})
+                 for code, name in zip(df_codes['Country Code'], df_codes['Country Name'])}
 
+    for code, actor_id in actor_ids.items():
         if not actor_id:
-            logging.info(f'Skipping row {row["Country Code"]}; not a known actor')
-            continue
-
-
-        if actor_id not in actor_identifiers:
-            actor_identifiers[actor_id] = {
-                'actor_id': actor_id,
-                'identifier': row['Country Code'],
-                'namespace': 'World Bank',
-                'datasource_id': DATASOURCE['datasource_id']
-            }
-
-        for year in range(2000, 2016 + 1):
-            populations.append({
-                'actor_id': actor_id,
-                'year': year,
-                'population': int(row[f'{year} [YR{year}]']),
-                'datasource_id': DATASOURCE['datasource_id']
-            })
-
-    write_csv('Publisher', [PUBLISHER])
-    write_csv('DataSource', [DATASOURCE])
-    write_csv('Tag', TAGS)
-    write_csv('DataSourceTag', list(map(lambda t: {'datasource_id': DATASOURCE['datasource_id'], 'tag_id': t['tag_id']}, TAGS)))
-    write_csv('ActorIdentifier', list(actor_identifiers.values()))
-    write_csv('Population', populations)
+            logging.info(f'Skipping row {code}; not a known actor')
+
+    df['actor_id'] = df['Country Code'].map(actor_ids)
+    df = df.loc[df['actor_id'].notna()].drop(columns=['Country Name'])
+
+    # first code of each actor
+    df_identifiers = pd.DataFrame({
+        'actor_id': df['actor_id'],
+        'identifier': df['Country Code'],
+        'namespace': 'World Bank',
+        'datasource_id': DATASOURCE['datasource_id'],
+    }).drop_duplicates(subset=['actor_id'])
+
+    # all years at once, rows without a value are dropped during the reshape
+    df['row'] = range(len(df))
+    df_long = df_wide_to_long(df=df.drop(columns=['Country Code']), value_name='population', dropna=True)
+    df_long = df_long.sort_values(by=['row', 'year'], kind='stable')
+
+    df_population = pd.DataFrame({
+        'actor_id': df_long['actor_id'].astype(str),
+        'year': df_long['year'],
+        'population': df_long['population'].astype('int64'),
+        'datasource_id': DATASOURCE['datasource_id'],
+    })
+
+    write_tables(outputDir=OUTPUT_DIR, tables={
+        **reference_tables(publisher=PUBLISHER, datasource=DATASOURCE, tags=TAGS),
+        'ActorIdentifier': df_identifiers,
+        'Population': df_population,
+    })
 
 if __name__ == "__main__":
     import os
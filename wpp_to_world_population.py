@@ -1,4 +1,4 @@
-INPUT_FILE = "source/WPP2022_GEN_F01_DEMOGRAPHIC_INDICATORS_COMPACT_REV1/Estimates-Table 1.csv"
+INPUT_DIR = "source/WPP2022_GEN_F01_DEMOGRAPHIC_INDICATORS_COMPACT_REV1"
 OUTPUT_DIR = "World Population Prospects 2022"
 
 PUBLISHER = {
@@ -15,40 +15,163 @@ DATASOURCE = {
     "URL": "https://population.un.org/wpp/Download/Standard/MostUsed/"
 }
 
+# one csv per sheet of the workbook, "{sheet}-Table 1.csv"
+ESTIMATES = "Estimates"
+SHEET_SUFFIX = "-Table 1.csv"
+SKIP_SHEETS = ["NOTES"]
+
+# header cells, looked up by name rather than position
+HEADER_FIRST_CELL = "Index"
+LOCATION_COLUMN = "Location code"
+ISO2_COLUMN = "ISO2 Alpha-code"
+TYPE_COLUMN = "Type"
+YEAR_COLUMN = "Year"
+POPULATION_COLUMN = "Total Population, as of 1 January (thousands)"
+
+# WPP locations that are actors without an ISO2 code
+LOCATION_ACTOR_IDS = {
+    "900": "EARTH",     # WORLD
+}
+
+# values are in thousands, "..." when missing
+MISSING_VALUES = ["", "...", "…"]
+
 import csv
+import logging
+import os
+
+def normalize(cell):
+    # exported headers can wrap ("Total Population,\nas of 1 January ...")
+    return " ".join(cell.split())
+
+def variant_files(inputDir):
+    ''' {variant: csv} for the estimates and every projection variant sheet '''
+    files = {}
+    for name in sorted(os.listdir(inputDir)):
+        if not name.endswith(SHEET_SUFFIX):
+            continue
+        variant = name[:-len(SHEET_SUFFIX)]
+        if variant not in SKIP_SHEETS:
+            files[variant] = os.path.join(inputDir, name)
+    return files
 
-def slurp_file(name):
-    data = []
-    with open(name) as csvfile:
+def variant_datasource(variant):
+    ''' estimates keep the original datasource, each projection variant gets its own '''
+    if variant == ESTIMATES:
+        return DATASOURCE
+    slug = variant.replace(" ", "-").lower()
+    return {
+        **DATASOURCE,
+        "datasource_id": f'{DATASOURCE["datasource_id"]}:{slug}',
+        "name": f'{DATASOURCE["name"]} ({variant})',
+    }
+
+def variant_output_dir(outputDir, variant):
+    return outputDir if variant == ESTIMATES else os.path.join(outputDir, variant)
+
+class LocationIndex:
+    ''' WPP location code -> actor_id, decided once per location '''
+
+    def __init__(self):
+        self.actor_ids = dict(LOCATION_ACTOR_IDS)
+
+    def actor_id(self, code, iso2, location_type):
+        if code not in self.actor_ids:
+            # regions, income groups etc. have no ISO2 code and are not actors
+            actor_id = iso2 if location_type == "Country/Area" and iso2 else None
+            if actor_id is None:
+                logging.debug(f'Skipping location {code}; not an actor')
+            self.actor_ids[code] = actor_id
+        return self.actor_ids[code]
+
+def read_rows(name):
+    ''' stream the data rows of a sheet as dictionaries, skipping the title block '''
+    with open(name, newline='', encoding='utf-8') as csvfile:
         reader = csv.reader(csvfile)
         for row in reader:
-            data.append(row)
-    return data
+            if row and normalize(row[0]) == HEADER_FIRST_CELL:
+                header = [normalize(cell) for cell in row]
+                break
+        else:
+            raise Exception(f"No header row in {name}")
+
+        missing = {LOCATION_COLUMN, ISO2_COLUMN, TYPE_COLUMN, YEAR_COLUMN, POPULATION_COLUMN} - set(header)
+        assert not missing, f"{name} has no column(s) {missing}"
 
-def write_csv(name, rows):
-    with open(f'{OUTPUT_DIR}/{name}.csv', mode='w') as csvfile:
+        for row in reader:
+            yield dict(zip(header, row))
+
+def parse_population(value):
+    # "7 975 105" thousands -> persons
+    value = "".join(value.split())
+    if value in MISSING_VALUES:
+        return None
+    return round(float(value) * 1000)
+
+def write_csv(outputDir, name, rows):
+    with open(f'{outputDir}/{name}.csv', mode='w') as csvfile:
         writer = csv.DictWriter(csvfile, fieldnames=rows[0].keys())
         writer.writeheader()
         writer.writerows(rows)
 
+def harmonize_variant(name, outputDir, datasource, index):
+    ''' write the Population table of one sheet while reading it '''
+    os.makedirs(outputDir, exist_ok=True)
+    write_csv(outputDir, 'Publisher', [PUBLISHER])
+    write_csv(outputDir, 'DataSource', [datasource])
+
+    count = 0
+    with open(f'{outputDir}/Population.csv', mode='w') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['actor_id', 'year', 'population', 'datasource_id'])
+
+        for row in read_rows(name):
+            # separator and label rows have no year
+            if not row[YEAR_COLUMN].strip():
+                continue
+
+            actor_id = index.actor_id(row[LOCATION_COLUMN].strip(),
+                                      row[ISO2_COLUMN].strip(),
+                                      row[TYPE_COLUMN].strip())
+            if actor_id is None:
+                continue
 
-def main():
+            population = parse_population(row[POPULATION_COLUMN])
+            if population is None:
+                continue
 
-    input = slurp_file(INPUT_FILE)
-    output = []
+            writer.writerow([actor_id, int(float(row[YEAR_COLUMN])), population, datasource['datasource_id']])
+            count += 1
 
-    for row in input:
-        if row[2] == "WORLD":
-            output.append({
-                "actor_id": "EARTH",
-                "year": row[10],
-                "population": int(row[11].replace(" ", "")) * 1000,
-                "datasource_id": DATASOURCE["datasource_id"]
-            })
+    return count
 
-    write_csv('Publisher', [PUBLISHER])
-    write_csv('DataSource', [DATASOURCE])
-    write_csv('Population', output)
+def main(inputDir=None, outputDir=None, variants=None):
+    inputDir = INPUT_DIR if inputDir is None else inputDir
+    outputDir = OUTPUT_DIR if outputDir is None else outputDir
+
+    files = variant_files(inputDir)
+    if variants is not None:
+        files = {variant: fl for variant, fl in files.items() if variant in variants}
+
+    assert files, f"no sheets found in {inputDir}"
+
+    # the index is shared, every sheet lists the same locations
+    index = LocationIndex()
+
+    for variant, fl in files.items():
+        datasource = variant_datasource(variant)
+        count = harmonize_variant(fl, variant_output_dir(outputDir, variant), datasource, index)
+        logging.info(f'{variant}: {count} rows ({datasource["datasource_id"]})')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='directory of the exported WPP sheets', default=INPUT_DIR)
+    parser.add_argument('-o', '--output', help='output directory, projection variants go in subdirectories', default=OUTPUT_DIR)
+    parser.add_argument('-v', '--variant', action='append', help='only this sheet (repeatable), e.g. "Estimates" or "Medium variant"')
+    parser.add_argument('-d', '--debug', action='store_true', help='flag for running debug')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    main(inputDir=args.input, outputDir=args.output, variants=args.variant)